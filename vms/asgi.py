@@ -2,6 +2,9 @@
 ASGI config for vms project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with `uvicorn vms.asgi:application` (see README.md). Under ASGI the
+voucher list, voucher page, PDF download and API lookup are async views
+(VOUCHER_ASYNC_VIEWS); set VMS_ASYNC_VIEWS=0 to serve the sync ones instead.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -12,5 +15,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vms.settings')
+os.environ.setdefault('VMS_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
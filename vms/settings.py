@@ -42,7 +42,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'vouchers.performance.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'vouchers.storage.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -55,7 +57,8 @@ ROOT_URLCONF = 'vms.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, with rendering time reported by vouchers.performance
+        'BACKEND': 'vouchers.performance.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -74,13 +77,60 @@ WSGI_APPLICATION = 'vms.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# VMS_DB_PROFILE (environment variable) picks how SQLite is run:
+#   'development' (default): Django's stock SQLite settings, for runserver and the tests.
+#   'production': WAL journal, so readers never wait for the writer; synchronous=NORMAL (a power cut can
+#       lose the last commits but not corrupt the file); 64 MB page cache and 256 MB of memory-mapped I/O; write
+#       transactions start with BEGIN IMMEDIATE and wait up to 20 s for the lock; connections are reused for
+#       10 minutes; voucher writes queue on an application lock (vouchers/locking.py) instead of racing for SQLite's.
+#       Set VMS_DB_PROFILE=production on the servers.
+# VMS_DB_PATH (environment variable) replaces db.sqlite3 as the database file.
+# `python manage.py benchmark_db` compares the profiles under concurrent reads and writes.
+
+SQLITE_PROFILES = {
+    'production': {
+        'DATABASE': {
+            'OPTIONS': {
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA cache_size=-65536;'
+                    'PRAGMA mmap_size=268435456;'
+                    'PRAGMA temp_store=MEMORY;'
+                ),
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+        },
+        'SERIALIZE_WRITES': True,
+    },
+    'development': {
+        'DATABASE': {},
+        'SERIALIZE_WRITES': False,
+    },
+}
+DB_PROFILE = os.environ.get('VMS_DB_PROFILE', 'development')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('VMS_DB_PATH', BASE_DIR / 'db.sqlite3'),
+        **SQLITE_PROFILES[DB_PROFILE]['DATABASE'],
     }
 }
 
+# Voucher writes wait up to VOUCHER_WRITE_LOCK_TIMEOUT seconds for the application write lock
+VOUCHER_SERIALIZE_WRITES = SQLITE_PROFILES[DB_PROFILE]['SERIALIZE_WRITES']
+VOUCHER_WRITE_LOCK_TIMEOUT = 30
+
+# `python manage.py archive_year <year>` moves a closed fiscal year out of db.sqlite3 into VOUCHER_ARCHIVE_DIR/fy<year>.sqlite3.
+# Archives are opened read-only as the databases 'archive_<year>' when found there (see vouchers/archive.py); the
+# router keeps archived vouchers read-only, refuses new vouchers dated in a closed year and keeps migrate off archives.
+VOUCHER_ARCHIVE_DIR = BASE_DIR / 'archive'
+DATABASE_ROUTERS = ['vouchers.routers.ArchiveRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -119,8 +169,129 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
+# Run `python manage.py build_images` after changing a source image, then `collectstatic` on deploy. WhiteNoise
+# (vouchers.storage.StaticFilesMiddleware, which also runs async under ASGI) serves the collected files from the app
+# itself: hashed names with a far-future max-age, and their .br/.gz copies to clients that accept them. `python manage.py page_weight` reports what the landing and list pages transfer.
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'vouchers.storage.StaticFilesStorage'},
+}
+# Source image -> widths of the WebP copies build_images makes of it
+VOUCHER_IMAGE_VARIANTS = {
+    'images/background.jpg': [960, 1920],
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Voucher numbering
+# Set VOUCHER_NUMBERING_PER_FISCAL_YEAR to restart numbers every fiscal year (IDs become e.g. BPV-2025-00000001)
+
+VOUCHER_NUMBERING_PER_FISCAL_YEAR = False
+VOUCHER_FISCAL_YEAR_START_MONTH = 7
+
+# Voucher PDF cache
+# Rendered PDFs are kept on disk, keyed by a hash of the voucher content. Set the directory to None to turn it off.
+# Warming on save renders outside a request, so it needs the absolute site URL for the logo.
+# The size limit is enforced every VOUCHER_PDF_CACHE_EVICT_EVERY files a process writes, not on every one.
+
+VOUCHER_PDF_CACHE_DIR = BASE_DIR / 'pdf_cache'
+VOUCHER_PDF_CACHE_MAX_BYTES = 200 * 1024 * 1024
+VOUCHER_PDF_CACHE_EVICT_EVERY = 50
+VOUCHER_PDF_CACHE_WARM_ON_SAVE = False
+VOUCHER_PDF_BASE_URL = None
+
+# Background PDF rendering
+# With VOUCHER_PDF_ASYNC on, uncached PDFs are queued and rendered by `python manage.py run_pdf_worker`.
+# New jobs are refused (HTTP 503) once VOUCHER_PDF_QUEUE_LIMIT are queued or running.
+
+VOUCHER_PDF_ASYNC = False
+VOUCHER_PDF_WORKERS = 2
+VOUCHER_PDF_QUEUE_LIMIT = 100
+
+# PDF engine start-up
+# WeasyPrint is imported on the first PDF render (vouchers/renderer.py). VMS_PDF_PRELOAD=1 loads it, and warms up
+# fonts, when the app starts instead: set it for long-lived web workers, leave it off for cron jobs and one-off commands.
+# `python manage.py benchmark_startup` compares the two.
+
+VOUCHER_PDF_PRELOAD = os.environ.get('VMS_PDF_PRELOAD') == '1'
+
+# ASGI
+# `uvicorn vms.asgi:application` serves the app from an event loop (see README.md). vms/asgi.py turns on
+# VOUCHER_ASYNC_VIEWS, which routes the voucher list, the voucher page, PDF downloads and the single-voucher API lookup to
+# async views (the *_async views in vouchers/views.py); the other pages stay sync and run in Django's threads. The async
+# PDF view renders on a pool of VOUCHER_PDF_RENDER_THREADS threads (vouchers/pdf_pool.py), so renders can't take the
+# threads other requests need; once VOUCHER_PDF_RENDER_BACKLOG more renders are waiting, downloads get HTTP 503.
+# `python manage.py benchmark_asgi` compares WSGI and ASGI under a mixed load.
+
+VOUCHER_ASYNC_VIEWS = os.environ.get('VMS_ASYNC_VIEWS') == '1'
+if VOUCHER_ASYNC_VIEWS:
+    # Each ASGI request runs its queries on a thread of its own, so its connection is closed when it finishes
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+VOUCHER_PDF_RENDER_THREADS = 2
+VOUCHER_PDF_RENDER_BACKLOG = 8
+
+# Batch printing
+# Largest number of vouchers the batch print page will put in one download; use `manage.py print_vouchers` for more.
+
+VOUCHER_BATCH_PRINT_LIMIT = 500
+
+# HTTP caching of voucher pages
+# The voucher list and detail pages send an ETag and are revalidated on every visit; an unchanged page costs one
+# indexed lookup and a 304. The rendered body of a voucher is kept in the cache for VOUCHER_FRAGMENT_CACHE_SECONDS,
+# keyed by its updated_at, so editing the voucher or its items switches to a fresh copy. The local-memory cache is
+# per process; point CACHES at a shared backend to share the fragments between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+VOUCHER_FRAGMENT_CACHE_SECONDS = 24 * 60 * 60
+
+# Voucher page navigation
+# The arrows on a voucher page step through vouchers by (date, voucher_id), using stored links (vouchers/navigation.py)
+# instead of range queries on every view. 'date' steps through all vouchers, 'type' through those of the same type;
+# ?nav=date / ?nav=type switches on the page. `python manage.py rebuild_navigation` recomputes the links.
+
+VOUCHER_NAVIGATION_SCOPE = 'date'
+
+# JSON API
+# Read-only voucher data for integrations under /api/v1/ (vouchers/api.py): batch fetch by ID and a change feed by
+# updated_at. With VOUCHER_API_TOKEN set, requests need "Authorization: Bearer <token>" or a staff login; without it
+# the API is as open as the voucher pages. POSTs that queue PDF renders skip the CSRF check only when they carry
+# the token. The feed holds back vouchers saved in the last
+# VOUCHER_API_SYNC_LAG_SECONDS, so a voucher still being committed can't end up behind a client's cursor.
+
+VOUCHER_API_TOKEN = os.environ.get('VMS_API_TOKEN')
+VOUCHER_API_BATCH_LIMIT = 1000
+VOUCHER_API_PAGE_SIZE = 500
+VOUCHER_API_SYNC_LAG_SECONDS = 5
+
+# Request performance instrumentation
+# VMS_PERF_METRICS=1 turns on VOUCHER_PERF_METRICS: vouchers.performance.PerformanceMiddleware times each request (SQL, templates, PDF
+# rendering), adds a Server-Timing header, logs a line to 'vouchers.performance' and keeps per-view histograms.
+# Requests slower than VOUCHER_SLOW_REQUEST_MS are logged as warnings, the rest at DEBUG (VMS_PERF_LOG_LEVEL=DEBUG
+# shows every request). The histograms are served at /metrics/ in Prometheus text format to staff users, or to a
+# scraper sending "Authorization: Bearer <VOUCHER_METRICS_TOKEN>". Histograms are per process: scrape every worker.
+
+VOUCHER_PERF_METRICS = os.environ.get('VMS_PERF_METRICS') == '1'
+VOUCHER_SLOW_REQUEST_MS = 500
+VOUCHER_METRICS_TOKEN = os.environ.get('VMS_METRICS_TOKEN')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'vouchers.performance': {
+            'handlers': ['console'], 'level': os.environ.get('VMS_PERF_LOG_LEVEL', 'INFO'), 'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,196 @@
+# vouchers/api.py
+"""
+Read-only JSON API for integrations (views.api_*), versioned under /api/v1/.
+
+Vouchers come out as flat objects: the common fields, the bank fields of their
+type (bank and cheque_no for BPV; bank, inst_type and inst_no for BRV) and
+their items. ?fields= picks what to send; leaving out items saves their query
+as well as the bytes.
+
+Whatever the number of vouchers, a response costs one query for the vouchers
+(the child tables are LEFT JOINed) and one for all of their items:
+- batch fetch: up to VOUCHER_API_BATCH_LIMIT vouchers by ID
+- change feed: vouchers ordered by (updated_at, voucher_id), paged with an
+  opaque cursor, so a client asks for what changed since its last poll. Item
+  changes move their voucher's updated_at (signals.py). Deleted vouchers are
+  not in the feed; a client catches those by listing the IDs
+  (?fields=voucher_id) from the start now and then.
+
+afetch() and aserialize() do the same with the async ORM, for the async
+single-voucher lookup served under ASGI.
+"""
+import base64
+import datetime
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Voucher, Item
+from .services import CHILD_MODELS
+
+VOUCHER_FIELDS = [
+    'voucher_id', 'voucher_type', 'date', 'payee', 'memo', 'prepared_by',
+    'total_amount', 'amount_in_words', 'updated_at',
+]
+# Bank fields, read from whichever child table the voucher is in
+BANK_FIELDS = {
+    'bank': F('bankpaymentvoucher__bank'),
+    'cheque_no': F('bankpaymentvoucher__cheque_no'),
+    'inst_type': F('bankreceiptvoucher__inst_type'),
+    'inst_no': F('bankreceiptvoucher__inst_no'),
+}
+ITEM_FIELDS = ['id', 'account', 'description', 'amount']
+FIELDS = VOUCHER_FIELDS + list(BANK_FIELDS) + ['items']
+# Read for every response: the key, what decides the bank fields, and what ETags and cursors are built from
+ALWAYS_READ = ['voucher_id', 'voucher_type', 'updated_at']
+
+
+class ApiError(Exception):
+    """A bad request; the message is sent back to the client with a 400"""
+
+
+def batch_limit():
+    return getattr(settings, 'VOUCHER_API_BATCH_LIMIT', 1000)
+
+
+def page_size():
+    return getattr(settings, 'VOUCHER_API_PAGE_SIZE', 500)
+
+
+def parse_fields(value):
+    """The fields named in a comma separated ?fields= value (or a JSON list), in FIELDS order; all if it is empty"""
+    if not value:
+        return FIELDS
+    if isinstance(value, str):
+        value = value.split(',')
+    if not all(isinstance(name, str) for name in value):
+        raise ApiError("Field names must be strings.")
+    names = {name.strip() for name in value if name.strip()}
+    unknown = names - set(FIELDS)
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(sorted(unknown))}. Available: {', '.join(FIELDS)}.")
+    return [name for name in FIELDS if name in names]
+
+
+def parse_ids(values):
+    """Voucher IDs from ?ids= values (comma separated, repeatable) or a JSON list; duplicates dropped"""
+    voucher_ids = []
+    for value in values:
+        if not isinstance(value, str):
+            raise ApiError("Voucher IDs must be strings.")
+        voucher_ids.extend(voucher_id.strip() for voucher_id in value.split(',') if voucher_id.strip())
+    voucher_ids = list(dict.fromkeys(voucher_ids))
+    if not voucher_ids:
+        raise ApiError("Give the voucher IDs to fetch as ids=BPV-00000001,CPV-00000002.")
+    if len(voucher_ids) > batch_limit():
+        raise ApiError(f"At most {batch_limit()} vouchers can be fetched at once; {len(voucher_ids)} were asked for.")
+    return voucher_ids
+
+
+def voucher_rows(vouchers, fields):
+    """`vouchers` (a Voucher queryset) as dicts of the columns `fields` need, bank fields included in the same query"""
+    columns = [name for name in VOUCHER_FIELDS if name in fields or name in ALWAYS_READ]
+    bank_columns = {name: expression for name, expression in BANK_FIELDS.items() if name in fields}
+    return vouchers.values(*columns, **bank_columns)
+
+
+def serialize(rows, fields):
+    """The JSON objects for voucher_rows(); loads the items of all of them in one query if `fields` has items"""
+    items = list(_items(rows)) if 'items' in fields and rows else []
+    return _objects(rows, fields, items)
+
+
+async def aserialize(rows, fields):
+    """serialize() with the async ORM"""
+    items = [item async for item in _items(rows)] if 'items' in fields and rows else []
+    return _objects(rows, fields, items)
+
+
+def _items(rows):
+    return (
+        Item.objects.filter(voucher_id__in=[row['voucher_id'] for row in rows])
+        .order_by('voucher_id', 'pk').values('voucher_id', *ITEM_FIELDS)
+    )
+
+
+def _objects(rows, fields, item_rows):
+    items = {}
+    for item in item_rows:
+        items.setdefault(item.pop('voucher_id'), []).append(item)
+    result = []
+    for row in rows:
+        type_fields = CHILD_MODELS[row['voucher_type']][1] if row['voucher_type'] in CHILD_MODELS else []
+        data = {}
+        for name in fields:
+            if name == 'items':
+                data['items'] = items.get(row['voucher_id'], [])
+            elif name in BANK_FIELDS:
+                if name in type_fields:
+                    data[name] = row[name]
+            else:
+                data[name] = row[name]
+        result.append(data)
+    return result
+
+
+def fetch(voucher_ids, fields):
+    """(voucher rows in the order asked for, IDs that don't exist); serialize() the rows once the ETag is checked"""
+    return _in_order(voucher_ids, voucher_rows(Voucher.objects.filter(pk__in=voucher_ids), fields))
+
+
+async def afetch(voucher_ids, fields):
+    """fetch() with the async ORM"""
+    rows = voucher_rows(Voucher.objects.filter(pk__in=voucher_ids), fields)
+    return _in_order(voucher_ids, [row async for row in rows])
+
+
+def _in_order(voucher_ids, rows):
+    by_id = {row['voucher_id']: row for row in rows}
+    rows = [by_id[voucher_id] for voucher_id in voucher_ids if voucher_id in by_id]
+    return rows, [voucher_id for voucher_id in voucher_ids if voucher_id not in by_id]
+
+
+# --- Change feed ---
+
+def encode_cursor(row):
+    raw = f"{row['updated_at'].isoformat()}|{row['voucher_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Returns (updated_at, voucher_id) from a cursor; raises ApiError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        updated_at, voucher_id = raw.split('|', 1)
+        updated_at = datetime.datetime.fromisoformat(updated_at)
+    except ValueError:
+        raise ApiError("Invalid cursor; start again without one.")
+    if timezone.is_naive(updated_at):
+        raise ApiError("Invalid cursor; start again without one.")
+    return updated_at, voucher_id
+
+
+def changes(after=None, limit=None, fields=FIELDS):
+    """
+    Returns (rows, cursor, more): the voucher rows changed since the cursor
+    `after` (from the start without one), oldest change first; the cursor to
+    pass next time, which is `after` again when nothing has changed; and
+    whether more rows are waiting already.
+
+    Vouchers saved in the last VOUCHER_API_SYNC_LAG_SECONDS are held back: their
+    updated_at is taken before their transaction commits, so a voucher still
+    being written could otherwise show up behind a cursor the client has already passed.
+    """
+    limit = limit or page_size()
+    lag = getattr(settings, 'VOUCHER_API_SYNC_LAG_SECONDS', 5)
+    vouchers = Voucher.objects.filter(updated_at__lte=timezone.now() - datetime.timedelta(seconds=lag))
+    if after:
+        updated_at, voucher_id = decode_cursor(after)
+        vouchers = vouchers.filter(
+            Q(updated_at__gte=updated_at) & (Q(updated_at__gt=updated_at) | Q(voucher_id__gt=voucher_id))
+        )
+    rows = list(voucher_rows(vouchers.order_by('updated_at', 'voucher_id'), fields)[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1]) if rows else after, more
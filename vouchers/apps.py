@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class VouchersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'vouchers'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        if getattr(settings, 'VOUCHER_PDF_PRELOAD', False):
+            from . import renderer
+            renderer.preload()
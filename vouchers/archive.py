@@ -0,0 +1,329 @@
+# vouchers/archive.py
+"""
+Closed fiscal years, moved out of the live database into one read-only SQLite
+file per year.
+
+`manage.py archive_year 2023` copies the vouchers dated in FY2023, with their
+bank fields, items and navigation links, into VOUCHER_ARCHIVE_DIR/fy2023.sqlite3
+(which gets its own full-text index). The copy is checked against the live rows
+and the reporting summaries, and only then are the live rows deleted, in one
+transaction. The live database, its indexes and its backups hold the open years only.
+
+Archive files are opened when found, as the read-only databases
+'archive_<year>'. Archived vouchers are still there for:
+- voucher_detail and the PDF download, which look a voucher up in the archives
+  when it isn't live (locate())
+- search.search(), which runs the query against each archive after the live index
+- the reports: the summary tables keep the rows of archived years in the live
+  database, and reports.rebuild()/verify() leave those rows alone
+The voucher list, exports, batch printing and the API cover the open years.
+
+Years are archived oldest first, so every date up to the end of the newest
+archived year is closed. routers.ArchiveRouter refuses to save or delete
+archived vouchers and new vouchers dated in a closed year; VoucherForm, the
+admin's form and the importer reject such dates up front, so the router is
+only the last line of defence. An archive keeps the schema of the tables
+it was written from.
+"""
+import datetime
+import importlib
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+
+from . import locking
+from .models import Voucher, fiscal_year_for
+
+ALIAS_PREFIX = 'archive_'
+FILE_NAME = re.compile(r'^fy(\d{4})\.sqlite3$')
+# Tables copied into an archive, with the column holding the voucher ID
+TABLES = [
+    ('vouchers_voucher', 'voucher_id'),
+    ('vouchers_bankpaymentvoucher', 'voucher_ptr_id'),
+    ('vouchers_bankreceiptvoucher', 'voucher_ptr_id'),
+    ('vouchers_item', 'voucher_id'),
+    ('vouchers_vouchernavigation', 'voucher_id'),
+]
+# Rows about vouchers that only matter while they are live; deleted with them
+LIVE_ONLY_TABLES = [('vouchers_pdfrenderjob', 'voucher_id')]
+# Amounts are summed as whole cents, which are exact where SQLite's decimals are floats
+CENTS = "coalesce(sum(CAST(round({} * 100) AS INTEGER)), 0)"
+IN_YEAR = "SELECT voucher_id FROM {}.vouchers_voucher WHERE date BETWEEN %s AND %s"
+SEARCH_INDEX = importlib.import_module('vouchers.migrations.0006_search_index')
+DATE_FIELD = Voucher._meta.get_field('date')
+# (archive directory, its modification time, the years in it) as years() last listed them
+_years = None
+
+
+class ArchiveError(Exception):
+    """A year that can't be archived (yet), or a copy that doesn't match the live rows"""
+
+
+class ClosedYearError(Exception):
+    """A write to an archived voucher, or a voucher dated in a closed fiscal year"""
+
+
+def archive_dir():
+    return Path(getattr(settings, 'VOUCHER_ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+
+
+def path_for(year):
+    return archive_dir() / f'fy{year}.sqlite3'
+
+
+def is_archive(alias):
+    return bool(alias) and alias.startswith(ALIAS_PREFIX)
+
+
+def fiscal_year_range(year):
+    """(first day, last day) of a fiscal year"""
+    start_month = getattr(settings, 'VOUCHER_FISCAL_YEAR_START_MONTH', 7)
+    return datetime.date(year, start_month, 1), datetime.date(year + 1, start_month, 1) - datetime.timedelta(days=1)
+
+
+def years():
+    """
+    The archived fiscal years, newest first. The router asks on every write, so
+    the list is kept until the directory changes: a stat, not a listing, per call.
+    archive_year (in this process or another) adds a file, which changes it.
+    """
+    global _years
+    directory = archive_dir()
+    try:
+        modified = os.stat(directory).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    cached = _years
+    if cached is None or cached[:2] != (directory, modified):
+        names = os.listdir(directory)
+        cached = _years = (directory, modified, sorted(
+            (int(match[1]) for match in map(FILE_NAME.match, names) if match), reverse=True,
+        ))
+    return list(cached[2])
+
+
+def forget_years():
+    """Makes the next years() list the directory again"""
+    global _years
+    _years = None
+
+
+def databases():
+    """The aliases of the archive databases, newest first; each is added to `connections` the first time it is seen"""
+    aliases = []
+    for year in years():
+        alias = f'{ALIAS_PREFIX}{year}'
+        # Read-only to SQLite as well as to the router
+        name = f'{path_for(year).resolve().as_uri()}?mode=ro'
+        if connections.settings.get(alias, {}).get('NAME') != name:
+            database = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name}
+            connections.settings[alias] = connections.configure_settings({DEFAULT_DB_ALIAS: {}, alias: database})[alias]
+            try:
+                # This thread's connection to the file the alias used to name (VOUCHER_ARCHIVE_DIR changed in tests)
+                del connections[alias]
+            except AttributeError:
+                pass
+        aliases.append(alias)
+    return aliases
+
+
+def closed_through():
+    """The last day of the newest archived fiscal year, or None if no year is archived"""
+    archived = years()
+    return fiscal_year_range(archived[0])[1] if archived else None
+
+
+def open_from():
+    """The first day that is not archived, or None if no year is archived"""
+    closed = closed_through()
+    return closed + datetime.timedelta(days=1) if closed else None
+
+
+def is_closed(date):
+    closed = closed_through()
+    return closed is not None and DATE_FIELD.to_python(date) <= closed
+
+
+def closed_message(date):
+    return f"FY{fiscal_year_for(DATE_FIELD.to_python(date))} is closed and archived; vouchers can't be dated in it."
+
+
+def locate(voucher_id):
+    """The alias of the archive holding a voucher that isn't live, or None"""
+    for alias in databases():
+        if Voucher.objects.using(alias).filter(pk=voucher_id).exists():
+            return alias
+    return None
+
+
+# --- Closing a year ---
+
+def fingerprint(cursor, schema, start, end):
+    """Row counts per table, amounts in cents and the latest change of the vouchers dated start..end in `schema`"""
+    params = [start.isoformat(), end.isoformat()]
+    in_year = IN_YEAR.format(schema)
+    result = {}
+    for table, column in TABLES:
+        cursor.execute(f"SELECT count(*) FROM {schema}.{table} WHERE {column} IN ({in_year})", params)
+        result[table] = cursor.fetchone()[0]
+    cursor.execute(
+        f"SELECT {CENTS.format('total_amount')}, max(updated_at) FROM {schema}.vouchers_voucher "
+        f"WHERE date BETWEEN %s AND %s", params,
+    )
+    result['voucher_cents'], result['last_change'] = cursor.fetchone()
+    cursor.execute(f"SELECT {CENTS.format('amount')} FROM {schema}.vouchers_item WHERE voucher_id IN ({in_year})", params)
+    result['item_cents'] = cursor.fetchone()[0]
+    return result
+
+
+def summary_problems(cursor, start, end, counts):
+    """How the reporting summaries for start..end disagree with the fingerprint() of its vouchers"""
+    params = [start.isoformat(), end.isoformat()]
+    cursor.execute(
+        f"SELECT coalesce(sum(item_count), 0), {CENTS.format('total')} FROM vouchers_accountdailysummary "
+        f"WHERE date BETWEEN %s AND %s", params,
+    )
+    items = cursor.fetchone()
+    cursor.execute(
+        f"SELECT coalesce(sum(voucher_count), 0), {CENTS.format('total')} FROM vouchers_payeemonthlysummary "
+        f"WHERE month BETWEEN %s AND %s", params,
+    )
+    vouchers = cursor.fetchone()
+    problems = []
+    if items != (counts['vouchers_item'], counts['item_cents']):
+        problems.append(f"account summaries have {items[0]} items for {items[1] / 100:.2f}, "
+                        f"the vouchers {counts['vouchers_item']} for {counts['item_cents'] / 100:.2f}")
+    if vouchers != (counts['vouchers_voucher'], counts['voucher_cents']):
+        problems.append(f"payee summaries have {vouchers[0]} vouchers for {vouchers[1] / 100:.2f}, "
+                        f"the vouchers {counts['vouchers_voucher']} for {counts['voucher_cents'] / 100:.2f}")
+    return problems
+
+
+def archive_year(year):
+    """
+    Moves the vouchers of fiscal year `year` into its archive file and returns
+    the fingerprint() the copy was checked with. Raises ArchiveError, leaving
+    the live rows as they were, if the year can't be archived or the copy
+    doesn't match. Once the file is in place the year is closed to writes; if
+    the live rows are still there (the run died before deleting them), running
+    again checks them against the file and deletes them.
+    """
+    if connection.vendor != 'sqlite':
+        raise ArchiveError("Archiving needs the SQLite database.")
+    if connection.in_atomic_block:
+        raise ArchiveError("Archiving attaches the archive file, which SQLite refuses inside a transaction.")
+    start, end = fiscal_year_range(year)
+    if end >= datetime.date.today():
+        raise ArchiveError(f"FY{year} runs until {end}; only years that have ended can be closed.")
+    earlier = Voucher.objects.filter(date__lt=start).order_by('date').values_list('date', flat=True).first()
+    if earlier is not None:
+        raise ArchiveError(f"Years are archived oldest first: archive FY{fiscal_year_for(earlier)} before FY{year}.")
+
+    archived = years()
+    if archived and year < archived[0] and year not in archived:
+        raise ArchiveError(f"FY{archived[0]} is archived already, which closed every year before it.")
+    path = path_for(year)
+    if path.exists():
+        if not Voucher.objects.filter(date__range=(start, end)).exists():
+            raise ArchiveError(f"FY{year} is archived already, in {path}.")
+    else:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(f'{path.name}.partial')
+        partial.unlink(missing_ok=True)
+        try:
+            _write(partial, start, end)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        # Readers see the year closed from here on; the router stops writes to it
+        os.replace(partial, path)
+        # The directory's modification time may not have ticked since years() last listed it
+        forget_years()
+    return _delete_live(path, start, end)
+
+
+def _write(path, start, end):
+    """Writes the vouchers dated start..end to a new archive file and checks the copy"""
+    tables = [table for table, _ in TABLES]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT type, sql FROM sqlite_master WHERE tbl_name IN ({}) AND sql IS NOT NULL".format(
+                ', '.join(['%s'] * len(tables))),
+            tables,
+        )
+        schema = cursor.fetchall()
+    _run_on_file(path, [sql for kind, sql in schema if kind == 'table'])
+
+    params = [start.isoformat(), end.isoformat()]
+    with _attached(path):
+        with transaction.atomic(), connection.cursor() as cursor:
+            for table, column in TABLES:
+                cursor.execute(
+                    f"INSERT INTO archive.{table} SELECT * FROM main.{table} WHERE {column} IN ({IN_YEAR.format('main')})",
+                    params,
+                )
+            live, copied = fingerprint(cursor, 'main', start, end), fingerprint(cursor, 'archive', start, end)
+            if live != copied:
+                raise ArchiveError(f"The copy doesn't match the live rows: {copied} != {live}.")
+            problems = summary_problems(cursor, start, end, live)
+            if problems:
+                raise ArchiveError(
+                    f"The reporting summaries don't match the vouchers ({'; '.join(problems)}). "
+                    "Run `manage.py rebuild_summaries` and archive again."
+                )
+    # Indexes and the search index are quicker to build over the copied rows
+    _run_on_file(path, [sql for kind, sql in schema if kind == 'index']
+                 + SEARCH_INDEX.TABLES_SQL + SEARCH_INDEX.POPULATE_SQL + ['ANALYZE'])
+
+
+def _run_on_file(path, statements):
+    archive = sqlite3.connect(path)
+    try:
+        with archive:
+            for sql in statements:
+                archive.execute(sql)
+    finally:
+        archive.close()
+
+
+@contextmanager
+def _attached(path, read_only=False):
+    """Attaches an archive file to the default connection as the schema 'archive' for the block"""
+    name = f'{path.resolve().as_uri()}?mode=ro' if read_only else str(path)
+    with connection.cursor() as cursor:
+        cursor.execute("ATTACH DATABASE %s AS archive", [name])
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("DETACH DATABASE archive")
+
+
+def _delete_live(path, start, end):
+    """Deletes the live rows of start..end after checking them against the archive file; returns its fingerprint()"""
+    params = [start.isoformat(), end.isoformat()]
+    in_year = IN_YEAR.format('main')
+    with _attached(path, read_only=True):
+        with locking.write_transaction(), connection.cursor() as cursor:
+            live, archived = fingerprint(cursor, 'main', start, end), fingerprint(cursor, 'archive', start, end)
+            if live != archived:
+                raise ArchiveError(
+                    f"The live rows changed after {path} was written: {live} != {archived}. "
+                    "Delete the file and archive again."
+                )
+            if 'vouchers_search' in connection.introspection.table_names(cursor):
+                # With the doc rows gone first, the item triggers have no search row to re-index
+                cursor.execute(
+                    f"DELETE FROM main.vouchers_search WHERE rowid IN "
+                    f"(SELECT id FROM main.vouchers_search_doc WHERE voucher_id IN ({in_year}))", params,
+                )
+                cursor.execute(f"DELETE FROM main.vouchers_search_doc WHERE voucher_id IN ({in_year})", params)
+            for table, column in LIVE_ONLY_TABLES + TABLES[:0:-1]:
+                cursor.execute(f"DELETE FROM main.{table} WHERE {column} IN ({in_year})", params)
+            cursor.execute("DELETE FROM main.vouchers_voucher WHERE date BETWEEN %s AND %s", params)
+    return archived
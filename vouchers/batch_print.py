@@ -0,0 +1,36 @@
+# vouchers/batch_print.py
+"""
+Printing many vouchers at once, either as one merged PDF (one voucher per page,
+with the stylesheet and logo loaded once) or as a ZIP of per-voucher PDFs.
+Vouchers are read and rendered in chunks, so only one chunk of rows and page
+layouts is in memory at a time, however many vouchers are printed.
+"""
+import zipfile
+
+from . import pdf_cache
+from .models import Voucher
+from .pdf import pdf_filename, render_batch_pdf
+
+CHUNK_SIZE = 200
+
+
+def select_vouchers(**filters):
+    """Vouchers matching VoucherQuerySet.matching() filters, in print order"""
+    return Voucher.objects.matching(**filters).order_by('date', 'voucher_id')
+
+
+def iter_typed(vouchers, chunk_size=CHUNK_SIZE):
+    """Yields typed vouchers with their items, fetching CHUNK_SIZE vouchers (two queries) at a time"""
+    for voucher in vouchers.with_details().iterator(chunk_size=chunk_size):
+        yield voucher.get_child_instance()
+
+
+def write_merged_pdf(vouchers, base_url, target):
+    render_batch_pdf(iter_typed(vouchers), base_url, target, chunk_size=CHUNK_SIZE)
+
+
+def write_zip(vouchers, base_url, target):
+    """Writes one PDF per voucher into a ZIP, reusing (and filling) the PDF cache"""
+    with zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for voucher in iter_typed(vouchers):
+            archive.writestr(pdf_filename(voucher), pdf_cache.get_or_render(voucher, base_url))
@@ -0,0 +1,71 @@
+# vouchers/exports.py
+"""
+Ledger export: one row per item, with its voucher's fields and bank details,
+as CSV or XLSX. Rows are generated lazily from a chunked iterator, so the
+export streams in constant memory however many vouchers match.
+"""
+import csv
+
+from django.db.models import Prefetch
+
+from .models import Voucher, Item
+from .xlsx import stream_xlsx
+
+CHUNK_SIZE = 2000
+HEADER = [
+    'Voucher ID', 'Type', 'Date', 'Payee', 'Memo', 'Prepared By',
+    'Bank', 'Cheque #', 'Instrument Type', 'Instrument #',
+    'Voucher Total', 'Amount in Words',
+    'Account', 'Description', 'Amount',
+]
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def ledger_rows(start_date=None, end_date=None, voucher_type=None, payee=None, account=None):
+    """Yields the header and then one row per item (or per voucher without items)"""
+    vouchers = Voucher.objects.matching(
+        start_date=start_date, end_date=end_date, voucher_type=voucher_type, payee=payee, account=account,
+    ).select_related('bankpaymentvoucher', 'bankreceiptvoucher').order_by('date', 'voucher_id')
+    items = Item.objects.order_by('pk')
+    if account:
+        items = items.filter(account=account)
+    vouchers = vouchers.prefetch_related(Prefetch('items', queryset=items))
+
+    yield HEADER
+    for base in vouchers.iterator(chunk_size=CHUNK_SIZE):
+        voucher = base.get_child_instance()
+        voucher_fields = [
+            voucher.voucher_id, voucher.voucher_type, voucher.date, voucher.payee, voucher.memo, voucher.prepared_by,
+            getattr(voucher, 'bank', None), getattr(voucher, 'cheque_no', None),
+            getattr(voucher, 'inst_type', None), getattr(voucher, 'inst_no', None),
+            voucher.total_amount, voucher.amount_in_words,
+        ]
+        voucher_items = voucher.items.all()
+        if not voucher_items:
+            yield voucher_fields + [None, None, None]
+        for item in voucher_items:
+            yield voucher_fields + [item.account, item.description, item.amount]
+
+
+class _Echo:
+    """Pseudo-buffer for csv.writer: hands each formatted line straight back"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(_Echo())
+    for row in rows:
+        yield writer.writerow(['' if value is None else value for value in row])
+
+
+def stream_export(file_format, **filters):
+    """Yields the export file (str chunks for CSV, bytes for XLSX)"""
+    rows = ledger_rows(**filters)
+    if file_format == 'xlsx':
+        return stream_xlsx(rows, sheet_name='Ledger')
+    return stream_csv(rows)
@@ -1,7 +1,27 @@
 # vouchers/forms.py
 from django import forms
+from . import archive, reports
 from .models import Voucher, Item, BankPaymentVoucher, BankReceiptVoucher
 
+def voucher_type_errors(voucher_type, data):
+    """Returns {field: message} for the fields a voucher type requires but `data` lacks"""
+    errors = {}
+    if voucher_type in ['BPV', 'BRV']:
+        if not data.get('bank'):
+            errors['bank'] = 'This field is required for Bank Vouchers.'
+
+    if voucher_type == 'BPV':
+        if not data.get('cheque_no'):
+            errors['cheque_no'] = 'This field is required for Bank Payment Vouchers.'
+
+    if voucher_type == 'BRV':
+        if not data.get('inst_type'):
+            errors['inst_type'] = 'This field is required for Bank Receipt Vouchers.'
+        if not data.get('inst_no'):
+            errors['inst_no'] = 'This field is required for Bank Receipt Vouchers.'
+
+    return errors
+
 class VoucherForm(forms.ModelForm):
     # We add all possible fields here. We will show/hide them with JS.
     bank = forms.CharField(required=False)
@@ -27,21 +47,10 @@ class VoucherForm(forms.ModelForm):
         cleaned_data = super().clean()
         # The view will pass voucher_type, we need to validate based on it
         voucher_type = self.data.get('voucher_type')
-        
-        if voucher_type in ['BPV', 'BRV']:
-            if not cleaned_data.get('bank'):
-                self.add_error('bank', 'This field is required for Bank Vouchers.')
-        
-        if voucher_type == 'BPV':
-            if not cleaned_data.get('cheque_no'):
-                self.add_error('cheque_no', 'This field is required for Bank Payment Vouchers.')
-
-        if voucher_type == 'BRV':
-            if not cleaned_data.get('inst_type'):
-                self.add_error('inst_type', 'This field is required for Bank Receipt Vouchers.')
-            if not cleaned_data.get('inst_no'):
-                self.add_error('inst_no', 'This field is required for Bank Receipt Vouchers.')
-        
+        for field, message in voucher_type_errors(voucher_type, cleaned_data).items():
+            self.add_error(field, message)
+        if cleaned_data.get('date') and archive.is_closed(cleaned_data['date']):
+            self.add_error('date', archive.closed_message(cleaned_data['date']))
         return cleaned_data
 
 class ItemForm(forms.ModelForm):
@@ -56,4 +65,76 @@ ItemFormSet = forms.inlineformset_factory(
     extra=1,
     can_delete=True,
     can_delete_extra=True
-)
\ No newline at end of file
+)
+
+class BatchPrintForm(forms.Form):
+    FORMAT_CHOICES = [('pdf', 'Single PDF'), ('zip', 'ZIP of PDFs')]
+
+    start_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    end_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    voucher_type = forms.ChoiceField(required=False, choices=[('', 'All types')] + Voucher.VOUCHER_TYPE_CHOICES)
+    ids = forms.CharField(required=False, label="Voucher IDs", help_text="Comma separated")
+    format = forms.ChoiceField(choices=FORMAT_CHOICES, initial='pdf')
+
+    def clean_ids(self):
+        return [voucher_id.strip() for voucher_id in self.cleaned_data['ids'].split(',') if voucher_id.strip()]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not any(cleaned_data.get(name) for name in ['start_date', 'end_date', 'voucher_type', 'ids']):
+            raise forms.ValidationError('Choose a date range, a voucher type or a list of voucher IDs.')
+        return cleaned_data
+
+    def filters(self):
+        return {
+            'start_date': self.cleaned_data['start_date'],
+            'end_date': self.cleaned_data['end_date'],
+            'voucher_type': self.cleaned_data['voucher_type'],
+            'voucher_ids': self.cleaned_data['ids'],
+        }
+
+
+class ImportVouchersForm(forms.Form):
+    file = forms.FileField(help_text="CSV or JSON Lines: record=voucher rows, each followed by its record=item rows")
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if not upload.name.lower().endswith(('.csv', '.jsonl', '.json')):
+            raise forms.ValidationError('Upload a .csv or .jsonl file.')
+        return upload
+
+    def file_format(self):
+        return 'csv' if self.cleaned_data['file'].name.lower().endswith('.csv') else 'jsonl'
+
+
+class ExportForm(forms.Form):
+    FORMAT_CHOICES = [('csv', 'CSV'), ('xlsx', 'Excel (XLSX)')]
+
+    start_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    end_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    voucher_type = forms.ChoiceField(required=False, choices=[('', 'All types')] + Voucher.VOUCHER_TYPE_CHOICES)
+    payee = forms.CharField(required=False)
+    account = forms.CharField(required=False)
+    format = forms.ChoiceField(choices=FORMAT_CHOICES, initial='csv')
+
+    def filters(self):
+        return {name: self.cleaned_data[name] for name in ['start_date', 'end_date', 'voucher_type', 'payee', 'account']}
+
+
+class ReportForm(forms.Form):
+    start_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    end_date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def date_range(self):
+        """The chosen dates, defaulting to the fiscal year to date"""
+        start_date, end_date = reports.year_to_date()
+        cleaned_data = getattr(self, 'cleaned_data', {})
+        return cleaned_data.get('start_date') or start_date, cleaned_data.get('end_date') or end_date
+
+
+class PeriodReportForm(ReportForm):
+    period = forms.ChoiceField(choices=[('month', 'Monthly'), ('day', 'Daily')], required=False)
+
+
+class PayeeReportForm(ReportForm):
+    voucher_type = forms.ChoiceField(required=False, choices=[('', 'All types')] + Voucher.VOUCHER_TYPE_CHOICES)
@@ -0,0 +1,229 @@
+# vouchers/importer.py
+"""
+Streaming bulk import of vouchers from CSV or JSON Lines.
+
+Both formats carry one record per row/line. A record with record=voucher starts
+a voucher (voucher_type, date, payee, memo, prepared_by and the bank fields),
+and the record=item rows after it (account, description, amount) are its
+items. Optional `ref` columns are echoed back in error reports. The file is
+read row by row and written in batches with services.bulk_create_vouchers(),
+each batch in its own write transaction together with the ImportCheckpoint.
+A checkpoint records a hash of the file's content, and only that file can
+resume from it: a different file under the same checkpoint name is refused
+rather than having its first records skipped.
+"""
+import csv
+import datetime
+import hashlib
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+from . import archive
+from .forms import voucher_type_errors
+from .locking import write_transaction
+from .models import Voucher, Item, ImportCheckpoint
+from .services import CHILD_MODELS, bulk_create_vouchers
+
+VOUCHER_TYPES = {code for code, _ in Voucher.VOUCHER_TYPE_CHOICES}
+REQUIRED_VOUCHER_FIELDS = ['payee', 'prepared_by']
+REQUIRED_ITEM_FIELDS = ['account', 'description']
+# Largest total a voucher can hold (DecimalField(max_digits=12, decimal_places=2))
+MAX_TOTAL = Decimal('9999999999.99')
+
+
+class CheckpointMismatch(Exception):
+    """Raised when a checkpoint with progress was saved for a file with different content"""
+
+
+class ImportResult:
+    def __init__(self, position=0):
+        self.position = position
+        self.imported = 0
+        self.errors = []
+
+    @property
+    def failed(self):
+        return len(self.errors)
+
+
+def fingerprint(fileobj, chunk_size=1024 * 1024):
+    """SHA-256 of a seekable binary file's content; the file is left at the start"""
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    while chunk := fileobj.read(chunk_size):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def read_records(fileobj, file_format):
+    """Yields (line number, dict) for every row of a binary CSV or JSONL file"""
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_no, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                record = {'_error': f'Invalid JSON: {e}'}
+            if not isinstance(record, dict):
+                record = {'_error': 'Expected a JSON object.'}
+            yield line_no, record
+
+
+def group_records(records):
+    """Yields (line number, voucher record, [item records]) from a flat stream of records"""
+    current = None
+    for line_no, record in records:
+        if _kind(record) == 'item' and current is not None:
+            current[2].append((line_no, record))
+            continue
+        if current is not None:
+            yield current
+        # Anything that isn't an item starts a new group; validate() rejects non-voucher ones
+        current = (line_no, record, [])
+    if current is not None:
+        yield current
+
+
+def _kind(record):
+    return _text(record, 'record').lower()
+
+
+def _text(record, name):
+    value = record.get(name)
+    return str(value).strip() if value is not None else ''
+
+
+def _max_length_errors(model, data, errors):
+    for name, value in data.items():
+        max_length = getattr(model._meta.get_field(name), 'max_length', None)
+        if max_length and value and len(value) > max_length:
+            errors.setdefault(name, f'Ensure this value has at most {max_length} characters.')
+
+
+def validate(record, item_records, closed_through=None):
+    """
+    Returns (voucher_type, cleaned data, [item dicts]) for one voucher record, or
+    (None, errors). Applies the same rules as VoucherForm/ItemForm without
+    building forms or model instances, which would dominate the import time.
+    Dates up to `closed_through` (archive.closed_through()) are in archived years.
+    """
+    errors = {}
+    if '_error' in record:
+        return None, {'record': record['_error']}
+    if _kind(record) != 'voucher':
+        return None, {'record': f"Expected a voucher record, got '{_text(record, 'record')}'."}
+
+    voucher_type = _text(record, 'voucher_type').upper()
+    if voucher_type not in VOUCHER_TYPES:
+        errors['voucher_type'] = f"Select a valid choice. '{voucher_type}' is not one of the available choices."
+
+    data = {name: _text(record, name) for name in ['payee', 'prepared_by', 'memo', 'bank', 'cheque_no', 'inst_type', 'inst_no']}
+    try:
+        data['date'] = datetime.date.fromisoformat(_text(record, 'date'))
+    except ValueError:
+        errors['date'] = 'Enter a valid date (YYYY-MM-DD).'
+    else:
+        if closed_through and data['date'] <= closed_through:
+            errors['date'] = archive.closed_message(data['date'])
+    for name in REQUIRED_VOUCHER_FIELDS:
+        if not data[name]:
+            errors[name] = 'This field is required.'
+    errors.update(voucher_type_errors(voucher_type, data))
+    data['memo'] = data['memo'] or None
+
+    model = CHILD_MODELS[voucher_type][0] if voucher_type in CHILD_MODELS else Voucher
+    _max_length_errors(model, {name: data[name] for name in ['payee', 'prepared_by']}, errors)
+    if model is not Voucher:
+        _max_length_errors(model, {name: data[name] for name in CHILD_MODELS[voucher_type][1]}, errors)
+
+    items = []
+    total = Decimal('0.00')
+    for item_line, item_record in item_records:
+        if '_error' in item_record:
+            errors[f'line {item_line}'] = item_record['_error']
+            continue
+        item_data = {name: _text(item_record, name) for name in REQUIRED_ITEM_FIELDS}
+        item_errors = {}
+        for name in REQUIRED_ITEM_FIELDS:
+            if not item_data[name]:
+                item_errors[name] = 'This field is required.'
+        _max_length_errors(Item, item_data, item_errors)
+        try:
+            amount = Decimal(_text(item_record, 'amount'))
+            if not amount.is_finite() or amount.as_tuple().exponent < -2 or abs(amount) >= Decimal('1e8'):
+                raise InvalidOperation
+        except InvalidOperation:
+            item_errors['amount'] = 'Enter a number with at most 8 digits before and 2 after the decimal point.'
+        if item_errors:
+            errors.update({f'line {item_line} {name}': message for name, message in item_errors.items()})
+            continue
+        total += amount
+        item_data['amount'] = amount
+        items.append(item_data)
+    if abs(total) > MAX_TOTAL:
+        errors['total_amount'] = 'The items add up to more than a voucher can hold.'
+
+    if errors:
+        return None, errors
+    return voucher_type, data, items
+
+
+def import_vouchers(fileobj, file_format, batch_size=1000, checkpoint_name=None):
+    """
+    Imports every voucher in a binary file object and returns an ImportResult.
+    Invalid vouchers are skipped and reported; the rest are committed every
+    `batch_size` vouchers. With a checkpoint name, progress is saved in the same
+    transaction as each batch, and a re-run of the same file (which must be
+    seekable) skips the vouchers already read; raises CheckpointMismatch if the
+    checkpoint has progress from another file.
+    """
+    checkpoint = None
+    if checkpoint_name:
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(name=checkpoint_name)
+        content = fingerprint(fileobj)
+        if checkpoint.position and checkpoint.fingerprint != content:
+            raise CheckpointMismatch(
+                f"Checkpoint '{checkpoint_name}' is {checkpoint.position} records into a file with different content."
+            )
+        checkpoint.fingerprint = content
+    result = ImportResult(position=checkpoint.position if checkpoint else 0)
+    skip = result.position
+    closed_through = archive.closed_through()
+
+    batch_records, batch_errors = [], []
+
+    def flush():
+        with write_transaction():
+            if batch_records:
+                bulk_create_vouchers(batch_records)
+            if checkpoint is not None:
+                checkpoint.position = result.position
+                checkpoint.imported += len(batch_records)
+                checkpoint.failed += len(batch_errors)
+                checkpoint.save()
+        result.imported += len(batch_records)
+        result.errors.extend(batch_errors)
+        batch_records.clear()
+        batch_errors.clear()
+
+    for index, (line_no, record, item_records) in enumerate(group_records(read_records(fileobj, file_format))):
+        if index < skip:
+            continue
+        cleaned = validate(record, item_records, closed_through)
+        if cleaned[0] is None:
+            batch_errors.append((line_no, _text(record, 'ref'), cleaned[1]))
+        else:
+            batch_records.append(cleaned)
+        result.position = index + 1
+        if len(batch_records) + len(batch_errors) >= batch_size:
+            flush()
+    flush()
+    return result
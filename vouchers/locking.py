@@ -0,0 +1,97 @@
+# vouchers/locking.py
+"""
+Application-level serialization of voucher writes.
+
+SQLite has a single writer. With BEGIN IMMEDIATE and a busy timeout a second
+writer waits for the lock, but SQLite's busy handler polls with growing sleeps
+and fails with "database is locked" once the timeout runs out, so a burst of
+inserts is served out of order and the unlucky ones fail. write_transaction()
+queues writers in the application instead: a thread lock within the process
+and an flock() on a file next to the database across processes (server
+workers, management commands), taken before the transaction begins.
+Turned on by VOUCHER_SERIALIZE_WRITES (the 'production' database profile, VMS_DB_PROFILE=production).
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the threads of one process are serialized
+    fcntl = None
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+_thread_lock = threading.Lock()
+_local = threading.local()
+# Lock files opened by this process, keyed by (pid, path) so a forked worker opens its own
+_lock_files = {}
+
+
+class WriteLockTimeout(OperationalError):
+    pass
+
+
+def _lock_path(using):
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+        return None
+    return f"{connection.settings_dict['NAME']}.write-lock"
+
+
+def _lock_file(path, deadline):
+    """Takes the flock() on `path`, polling until `deadline`; returns the open file, or None without fcntl"""
+    if path is None or fcntl is None:
+        return None
+    key = (os.getpid(), path)
+    if key not in _lock_files:
+        _lock_files[key] = open(path, 'a')
+    lock_file = _lock_files[key]
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock_file
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                raise WriteLockTimeout("Timed out waiting for another process to finish writing vouchers.")
+            time.sleep(0.002)
+
+
+@contextmanager
+def write_lock(using=DEFAULT_DB_ALIAS):
+    """Holds the write lock for the block; re-entrant within a thread, and a no-op unless VOUCHER_SERIALIZE_WRITES is on"""
+    if not getattr(settings, 'VOUCHER_SERIALIZE_WRITES', False):
+        yield
+        return
+    if getattr(_local, 'depth', 0):
+        _local.depth += 1
+        try:
+            yield
+        finally:
+            _local.depth -= 1
+        return
+
+    timeout = getattr(settings, 'VOUCHER_WRITE_LOCK_TIMEOUT', 30)
+    deadline = time.monotonic() + timeout
+    if not _thread_lock.acquire(timeout=timeout):
+        raise WriteLockTimeout("Timed out waiting for another request to finish writing vouchers.")
+    try:
+        lock_file = _lock_file(_lock_path(using), deadline)
+        _local.depth = 1
+        try:
+            yield
+        finally:
+            _local.depth = 0
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    finally:
+        _thread_lock.release()
+
+
+@contextmanager
+def write_transaction(using=DEFAULT_DB_ALIAS):
+    """transaction.atomic() behind the write lock; use it for the outermost transaction of a voucher write"""
+    with write_lock(using), transaction.atomic(using=using):
+        yield
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from vouchers import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Closes a fiscal year: moves its vouchers, items and navigation links into a read-only archive "
+        "database (VOUCHER_ARCHIVE_DIR/fy<year>.sqlite3), checks the copy against the live rows and the "
+        "reporting summaries, then deletes the live rows in one transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('year', type=int, help="The fiscal year, by the calendar year it starts in")
+        parser.add_argument('--vacuum', action='store_true', help="VACUUM the live database afterwards to free the space")
+
+    def handle(self, *args, **options):
+        year = options['year']
+        try:
+            counts = archive.archive_year(year)
+        except archive.ArchiveError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            f"FY{year} archived to {archive.path_for(year)}: {counts['vouchers_voucher']} vouchers "
+            f"({counts['voucher_cents'] / 100:,.2f}), {counts['vouchers_item']} items "
+            f"({counts['item_cents'] / 100:,.2f}); the copy matches the live rows and the reporting summaries."
+        ))
+        if options['vacuum']:
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM")
+            self.stdout.write("Live database vacuumed.")
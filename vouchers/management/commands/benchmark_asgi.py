@@ -0,0 +1,272 @@
+import argparse
+import asyncio
+import datetime
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from vouchers.models import Voucher
+from vouchers.synthetic import VoucherGenerator, seed_vouchers
+
+from .benchmark_db import percentile
+from .benchmark_requests import SEED_DAYS, Command as BenchmarkRequests
+
+# Page -> URL name; the mix is given as page=weight
+PAGES = {
+    'list': 'voucher_list',
+    'detail': 'voucher_detail',
+    'lookup': 'api_voucher',
+    'pdf': 'download_voucher_pdf',
+}
+DEFAULT_MIX = 'list=30,detail=40,lookup=20,pdf=10'
+# Mode -> VMS_ASYNC_VIEWS in the process serving it
+MODES = [('wsgi', '0'), ('asgi', '1')]
+
+
+def parse_mix(value):
+    try:
+        mix = {page: int(weight) for page, weight in (part.split('=') for part in value.split(','))}
+    except ValueError:
+        raise CommandError(f"--mix takes page=weight pairs, e.g. {DEFAULT_MIX}.")
+    unknown = set(mix) - set(PAGES)
+    if unknown or not any(mix.values()) or min(mix.values()) < 0:
+        raise CommandError(f"--mix pages are {', '.join(PAGES)}, with weights of 0 or more.")
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a scratch database and serves the same mixed load (voucher list, voucher pages, API lookups "
+        "and uncached PDFs) in two fresh processes: through Django's WSGI handler on --threads threads, as a "
+        "threaded WSGI server runs it, and through the ASGI handler with the async views on one event loop, "
+        "as uvicorn runs vms.asgi. Reports requests/second and latency percentiles per page. The requests go "
+        "to the handlers directly, so the numbers leave out the server's HTTP parsing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vouchers', type=int, default=5000, help="Vouchers to seed")
+        parser.add_argument('--requests', type=int, default=2000, help="Measured requests per mode")
+        parser.add_argument('--concurrency', type=int, default=16, help="Requests in flight at once")
+        parser.add_argument('--threads', type=int, default=8,
+                            help="Request threads of the WSGI server (default: 8); ASGI uses one event loop")
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Share of each page in the load (default: {DEFAULT_MIX})")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        # Set on the processes this command starts for each mode
+        parser.add_argument('--serve', choices=[mode for mode, _ in MODES], help=argparse.SUPPRESS)
+        parser.add_argument('--database', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            return self.serve(options)
+        if connection.vendor != 'sqlite':
+            raise CommandError("benchmark_asgi seeds a scratch SQLite database; the default database is not SQLite.")
+        if min(options['vouchers'], options['requests'], options['concurrency'], options['threads']) < 1:
+            raise CommandError("--vouchers, --requests, --concurrency and --threads must all be at least 1.")
+        parse_mix(options['mix'])
+
+        manage_py = os.path.join(settings.BASE_DIR, 'manage.py')
+        results = []
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'benchmark.sqlite3')
+            with BenchmarkRequests.scratch_database(path):
+                call_command('migrate', verbosity=0, interactive=False)
+                started = time.perf_counter()
+                end_date = datetime.date.today()
+                generator = VoucherGenerator(seed=options['seed'])
+                for _ in seed_vouchers(
+                    generator, options['vouchers'], end_date - datetime.timedelta(days=SEED_DAYS - 1), end_date,
+                ):
+                    pass
+                self.stdout.write(f"Seeded {options['vouchers']} vouchers ({time.perf_counter() - started:.1f}s)")
+
+            for mode, async_views in MODES:
+                command = [
+                    sys.executable, manage_py, 'benchmark_asgi', '--serve', mode, '--database', path,
+                    '--requests', str(options['requests']), '--concurrency', str(options['concurrency']),
+                    '--threads', str(options['threads']), '--mix', options['mix'], '--seed', str(options['seed']),
+                ]
+                # Slow requests would be logged to the console in the middle of the report
+                env = {**os.environ, 'VMS_ASYNC_VIEWS': async_views, 'VMS_PERF_LOG_LEVEL': 'ERROR'}
+                completed = subprocess.run(command, env=env, capture_output=True, text=True)
+                if completed.returncode != 0:
+                    raise CommandError(f"The {mode} run failed:\n{completed.stderr}")
+                result = json.loads(completed.stdout.strip().splitlines()[-1])
+                results.append(result)
+                self.write_result(result)
+
+        wsgi, asgi = results
+        self.stdout.write(
+            f"ASGI served {asgi['requests_per_second'] / wsgi['requests_per_second'] - 1:+.0%} requests/second "
+            f"against WSGI with {options['concurrency']} requests in flight"
+        )
+        if options['output']:
+            report = {
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'git_commit': BenchmarkRequests.git_commit(),
+                'vouchers': options['vouchers'],
+                'concurrency': options['concurrency'],
+                'threads': options['threads'],
+                'mix': options['mix'],
+                'results': results,
+            }
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def write_result(self, result):
+        self.stdout.write(
+            f"{result['mode'].upper()}: {result['requests_per_second']:.0f} requests/s "
+            f"({result['requests']} in {result['seconds']:.1f}s)"
+        )
+        for page, stats in result['pages'].items():
+            line = (
+                f"  {page:<8}{stats['requests']:>6} requests  p50 {stats['p50_ms']:>8.1f}ms  "
+                f"p95 {stats['p95_ms']:>8.1f}ms  p99 {stats['p99_ms']:>8.1f}ms"
+            )
+            if stats['errors']:
+                line += self.style.ERROR(f"  {stats['errors']} unexpected responses")
+            self.stdout.write(line)
+
+    # --- The measuring process of one mode ---
+
+    def serve(self, options):
+        # Nothing has connected yet, so changing the dict in place points every connection at the scratch database
+        settings.DATABASES['default']['NAME'] = options['database']
+        with override_settings(
+            ALLOWED_HOSTS=['testserver'], DEBUG=False, VOUCHER_PDF_CACHE_DIR=None, VOUCHER_PDF_ASYNC=False,
+        ):
+            requests = self.load(options)
+            # One request for each page first: template loading and the PDF engine start-up aren't measured
+            warmup = list({page: url for page, url in requests}.items())
+            if options['serve'] == 'wsgi':
+                self.run_wsgi(warmup, options['threads'])
+                started = time.perf_counter()
+                samples = self.run_wsgi(requests, options['threads'])
+            else:
+                asyncio.run(self.run_asgi(warmup, options['concurrency']))
+                started = time.perf_counter()
+                samples = asyncio.run(self.run_asgi(requests, options['concurrency']))
+            seconds = time.perf_counter() - started
+
+        pages = {}
+        for page in PAGES:
+            times = [elapsed for name, elapsed, ok in samples if name == page]
+            if times:
+                pages[page] = {
+                    'requests': len(times),
+                    'errors': sum(1 for name, _, ok in samples if name == page and not ok),
+                    'mean_ms': round(statistics.fmean(times), 2),
+                    'p50_ms': round(percentile(times, 0.5), 2),
+                    'p95_ms': round(percentile(times, 0.95), 2),
+                    'p99_ms': round(percentile(times, 0.99), 2),
+                }
+        self.stdout.write(json.dumps({
+            'mode': options['serve'],
+            'requests': len(samples),
+            'seconds': round(seconds, 3),
+            'requests_per_second': round(len(samples) / seconds, 1),
+            'pages': pages,
+        }))
+
+    @staticmethod
+    def load(options):
+        """The (page, URL) of every request, in the order they are sent; the same in both modes"""
+        rng = random.Random(options['seed'])
+        mix = parse_mix(options['mix'])
+        voucher_ids = list(Voucher.objects.order_by('?').values_list('voucher_id', flat=True)[:1000])
+        pages = rng.choices(list(mix), weights=list(mix.values()), k=options['requests'])
+        return [
+            (page, reverse(PAGES[page]) if page == 'list' else reverse(PAGES[page], args=[rng.choice(voucher_ids)]))
+            for page in pages
+        ]
+
+    # Both return (page, milliseconds, whether the status was 200) for every request
+
+    def run_wsgi(self, requests, threads):
+        from django.core.handlers.wsgi import WSGIHandler
+
+        handler = WSGIHandler()
+
+        def send(request):
+            page, url = request
+            status = []
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': url, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+                'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': 'testserver', 'REMOTE_ADDR': '127.0.0.1',
+                'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+                'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            started = time.perf_counter()
+            response = handler(environ, lambda line, headers, exc_info=None: status.append(line))
+            try:
+                for _ in response:
+                    pass
+            finally:
+                response.close()
+            return page, (time.perf_counter() - started) * 1000, status[0].startswith('200')
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            return list(pool.map(send, requests))
+
+    async def run_asgi(self, requests, concurrency):
+        from django.core.handlers.asgi import ASGIHandler
+
+        handler = ASGIHandler()
+        pending = iter(requests)
+        samples = []
+
+        async def send(page, url):
+            status = []
+            finished = asyncio.Event()
+            sent_body = False
+            parts = urlsplit(url)
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': parts.path, 'raw_path': parts.path.encode(),
+                'query_string': parts.query.encode(), 'root_path': '',
+                'headers': [(b'host', b'testserver')], 'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+            }
+
+            async def receive():
+                nonlocal sent_body
+                if not sent_body:
+                    sent_body = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # The client stays connected until the whole response is in
+                await finished.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send_message(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                    finished.set()
+
+            started = time.perf_counter()
+            await handler(scope, receive, send_message)
+            return page, (time.perf_counter() - started) * 1000, status == [200]
+
+        async def worker():
+            for page, url in pending:
+                samples.append(await send(page, url))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return samples
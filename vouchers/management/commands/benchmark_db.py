@@ -0,0 +1,164 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, connections
+
+from vouchers import services
+from vouchers.locking import write_transaction
+from vouchers.models import Voucher
+from vouchers.pagination import keyset_page
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures read throughput while vouchers are being written, for each SQLite profile in "
+        "settings.SQLITE_PROFILES. Each profile runs in a process of its own started with VMS_DB_PROFILE set, "
+        "as a server would be, on a copy of the database (VMS_DB_PATH) that is deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', action='append', choices=list(settings.SQLITE_PROFILES),
+                            help="Profile to measure (repeatable; default: all)")
+        parser.add_argument('--seconds', type=float, default=10.0, help="Duration of each run")
+        parser.add_argument('--readers', type=int, default=4, help="Processes loading list pages and vouchers")
+        parser.add_argument('--writers', type=int, default=4, help="Processes creating vouchers")
+        # Set on the process this command starts for each profile
+        parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['measure']:
+            self.stdout.write(json.dumps(self.measure(options)))
+            return
+        if connection.vendor != 'sqlite':
+            raise CommandError("benchmark_db measures the SQLite profiles; the default database is not SQLite.")
+        source = connection.settings_dict['NAME']
+        profiles = options['profile'] or list(settings.SQLITE_PROFILES)
+        self.stdout.write(
+            f"{options['readers']} readers, {options['writers']} writers, {options['seconds']:g}s per profile\n"
+        )
+        results = []
+        for name in profiles:
+            with tempfile.TemporaryDirectory() as directory:
+                copy = os.path.join(directory, 'benchmark.sqlite3')
+                # The backup API gives a consistent copy even while the app is writing to the source
+                with sqlite3.connect(source) as src, sqlite3.connect(copy) as dst:
+                    src.backup(dst)
+                results.append((name, self.run_profile(name, copy, options)))
+
+        header = f"{'profile':<12}{'reads/s':>10}{'read p50':>10}{'read p95':>10}{'writes/s':>10}{'write p95':>11}{'failed':>8}"
+        self.stdout.write(header)
+        for name, result in results:
+            self.stdout.write(
+                f"{name:<12}{result['reads'] / options['seconds']:>10.0f}"
+                f"{result['read_p50']:>8.1f}ms{result['read_p95']:>8.1f}ms"
+                f"{result['writes'] / options['seconds']:>10.0f}{result['write_p95']:>9.1f}ms{result['failed']:>8}"
+            )
+
+    def run_profile(self, name, path, options):
+        """Measures one profile in a fresh process whose settings come from the environment, as on a server"""
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'benchmark_db', '--measure',
+            '--seconds', str(options['seconds']), '--readers', str(options['readers']), '--writers', str(options['writers']),
+        ]
+        env = {**os.environ, 'VMS_DB_PROFILE': name, 'VMS_DB_PATH': path, 'VMS_PERF_LOG_LEVEL': 'ERROR'}
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f"The {name} run failed:\n{completed.stderr}")
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    # --- The measuring process of one profile ---
+
+    def measure(self, options):
+        voucher_ids = list(Voucher.objects.values_list('voucher_id', flat=True)[:1000])
+        if not voucher_ids:
+            with write_transaction():
+                voucher_ids = services.bulk_create_vouchers([self.record(n) for n in range(200)])
+        connections.close_all()
+
+        # Separate processes, as under a multi-worker server: threads would mostly measure the GIL
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        deadline = time.time() + options['seconds']
+        workers = [context.Process(target=self.read_loop, args=(voucher_ids, deadline, results))
+                   for _ in range(options['readers'])]
+        workers += [context.Process(target=self.write_loop, args=(n, deadline, results))
+                    for n in range(options['writers'])]
+        for worker in workers:
+            worker.start()
+        read_times, write_times, failed = [], [], 0
+        for _ in workers:
+            kind, times, errors = results.get()
+            (read_times if kind == 'read' else write_times).extend(times)
+            failed += errors
+        for worker in workers:
+            worker.join()
+
+        return {
+            'reads': len(read_times),
+            'read_p50': percentile(read_times, 0.5) * 1000,
+            'read_p95': percentile(read_times, 0.95) * 1000,
+            'writes': len(write_times),
+            'write_p95': percentile(write_times, 0.95) * 1000,
+            'failed': failed,
+        }
+
+    @staticmethod
+    def read_loop(voucher_ids, deadline, results):
+        """A list page plus one voucher with its items, as fast as possible until the deadline"""
+        times = []
+        while time.time() < deadline:
+            started = time.perf_counter()
+            list(keyset_page(Voucher.objects.all()))
+            voucher = Voucher.objects.with_details().get(pk=random.choice(voucher_ids))
+            list(voucher.get_child_instance().items.all())
+            times.append(time.perf_counter() - started)
+        connection.close()
+        results.put(('read', times, 0))
+
+    @classmethod
+    def write_loop(cls, worker, deadline, results):
+        """Creates vouchers through services.create_voucher() until the deadline, counting failures"""
+        times, errors, n = [], 0, worker * 1000000
+        while time.time() < deadline:
+            started = time.perf_counter()
+            try:
+                services.create_voucher(*cls.record(n))
+                times.append(time.perf_counter() - started)
+            except DatabaseError:
+                errors += 1
+            n += 1
+        connection.close()
+        results.put(('write', times, errors))
+
+    @staticmethod
+    def record(n):
+        data = {
+            'date': datetime.date.today() - datetime.timedelta(days=n % 365),
+            'payee': f"Benchmark Payee {n % 50}",
+            'memo': None,
+            'prepared_by': 'benchmark',
+        }
+        items = [
+            {'account': f"{5000 + line}", 'description': f"Benchmark line {line}", 'amount': Decimal('125.50')}
+            for line in range(3)
+        ]
+        return 'CPV', data, items
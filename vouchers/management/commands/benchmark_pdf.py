@@ -0,0 +1,103 @@
+import http.server
+import json
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vouchers.models import Voucher
+from vouchers.pdf import render_voucher_html
+from vouchers.renderer import STYLESHEET, Renderer, StaticAssets, engine
+
+from .benchmark_db import percentile
+
+
+def static_server(assets):
+    """An HTTP server on a free local port serving static files, as the site does for a fresh render's logo"""
+
+    class StaticHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            name = assets.name_for_url(self.path)
+            data = assets.get(name) if name else None
+            if data is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StaticHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders the same vouchers two ways and compares CPU and wall time per PDF: 'fresh', as every "
+        "download used to (stylesheet inline in the HTML, new font configuration, logo fetched over HTTP), "
+        "and 'reused', through a vouchers.renderer.Renderer set up once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=20, help="Vouchers to render each way")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        vouchers = [voucher.get_child_instance() for voucher in Voucher.objects.with_details()[:options['count']]]
+        if not vouchers:
+            raise CommandError("There are no vouchers to render; create some with seed_vouchers.")
+        assets = StaticAssets()
+        stylesheet = assets.get(STYLESHEET).decode()
+        html_strings = [render_voucher_html(voucher) for voucher in vouchers]
+        server = static_server(assets)
+        base_url = f'http://127.0.0.1:{server.server_port}/'
+        HTML = engine().HTML
+
+        started = time.perf_counter()
+        renderer = Renderer()
+        renderer.write_pdf(html_strings[0], base_url)
+        setup_ms = (time.perf_counter() - started) * 1000
+
+        samples = {'fresh': ([], []), 'reused': ([], [])}
+        try:
+            # Interleaved, so drift in machine load affects both the same way
+            for html_string in html_strings:
+                inline = html_string.replace('</head>', f'<style>{stylesheet}</style></head>', 1)
+                for mode, render in [
+                    ('fresh', lambda: HTML(string=inline, base_url=base_url).write_pdf()),
+                    ('reused', lambda: renderer.write_pdf(html_string, base_url)),
+                ]:
+                    cpu, wall = time.process_time(), time.perf_counter()
+                    render()
+                    samples[mode][0].append((time.process_time() - cpu) * 1000)
+                    samples[mode][1].append((time.perf_counter() - wall) * 1000)
+        finally:
+            server.shutdown()
+
+        results = {
+            mode: {
+                'cpu_mean_ms': round(statistics.fmean(cpu), 2), 'cpu_p50_ms': round(percentile(cpu, 0.5), 2),
+                'wall_mean_ms': round(statistics.fmean(wall), 2), 'wall_p95_ms': round(percentile(wall, 0.95), 2),
+            }
+            for mode, (cpu, wall) in samples.items()
+        }
+        self.stdout.write(f"{len(vouchers)} vouchers, WeasyPrint {engine().__version__}; "
+                          f"renderer set up and warmed in {setup_ms:.0f}ms")
+        self.stdout.write(f"{'':<8}{'CPU mean':>10}{'CPU p50':>10}{'wall mean':>11}{'wall p95':>10}")
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:<8}{result['cpu_mean_ms']:>8.1f}ms{result['cpu_p50_ms']:>8.1f}ms"
+                f"{result['wall_mean_ms']:>9.1f}ms{result['wall_p95_ms']:>8.1f}ms"
+            )
+        fresh, reused = results['fresh']['cpu_mean_ms'], results['reused']['cpu_mean_ms']
+        if fresh:
+            self.stdout.write(f"CPU per PDF with the reused renderer: {reused / fresh - 1:+.0%}")
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'vouchers': len(vouchers), 'setup_ms': round(setup_ms, 1), 'results': results}, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
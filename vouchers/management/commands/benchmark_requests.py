@@ -0,0 +1,235 @@
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from functools import partial
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from vouchers.models import Voucher
+from vouchers.synthetic import VoucherGenerator, seed_vouchers
+
+from .benchmark_db import percentile
+from .seed_vouchers import item_range
+
+ENDPOINTS = ['voucher_list', 'voucher_detail', 'create_voucher', 'download_voucher_pdf']
+# Slower p95s are only reported as regressions once they are this many ms slower, whatever --tolerance says
+NOISE_FLOOR_MS = 2.0
+# Seeded vouchers are dated over the last two years
+SEED_DAYS = 730
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a scratch database with synthetic vouchers up to each of --sizes and measures latency "
+        "percentiles and query counts of the main views through the test client. Writes the results as "
+        "JSON and, given --baseline, fails on regressions against an earlier run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help="Comma separated voucher counts to measure at (default: 1000,10000,100000)")
+        parser.add_argument('--requests', type=int, default=50, help="Measured requests per endpoint and size")
+        parser.add_argument('--warmup', type=int, default=5, help="Unmeasured requests per endpoint and size")
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS, dest='endpoints',
+                            help="Endpoint to measure (repeatable; default: all)")
+        parser.add_argument('--items', default='1-5', help="Items per seeded voucher, as for seed_vouchers")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--baseline', help="JSON file from an earlier run to compare against")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Allowed p95 slowdown against the baseline, as a fraction (default: 0.25)")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("benchmark_requests seeds a scratch SQLite database; the default database is not SQLite.")
+        try:
+            sizes = sorted({int(size) for size in options['sizes'].split(',')})
+        except ValueError:
+            raise CommandError("--sizes takes comma separated numbers, e.g. 1000,10000,100000.")
+        if not sizes or sizes[0] < 1:
+            raise CommandError("--sizes must all be at least 1.")
+        if options['requests'] < 1:
+            raise CommandError("--requests must be at least 1.")
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        generator = VoucherGenerator(seed=options['seed'], items=item_range(options['items']))
+        endpoints = options['endpoints'] or ENDPOINTS
+        results = []
+        with tempfile.TemporaryDirectory() as directory:
+            with self.scratch_database(os.path.join(directory, 'benchmark.sqlite3')), override_settings(
+                ALLOWED_HOSTS=['testserver'], DEBUG=False,
+                VOUCHER_PDF_CACHE_DIR=os.path.join(directory, 'pdf_cache'), VOUCHER_PDF_ASYNC=False,
+            ):
+                call_command('migrate', verbosity=0, interactive=False)
+                end_date = datetime.date.today()
+                start_date = end_date - datetime.timedelta(days=SEED_DAYS - 1)
+                for size in sizes:
+                    started = time.perf_counter()
+                    # Vouchers posted by the create_voucher runs count towards the next size
+                    for _ in seed_vouchers(generator, size - Voucher.objects.count(), start_date, end_date):
+                        pass
+                    self.stdout.write(f"Seeded {size} vouchers ({time.perf_counter() - started:.1f}s)")
+                    for endpoint in endpoints:
+                        result = self.measure(endpoint, size, generator, options)
+                        results.append(result)
+                        self.write_result(result)
+
+        report = {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'git_commit': self.git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'db_profile': getattr(settings, 'DB_PROFILE', None),
+            'requests': options['requests'],
+            'items': options['items'],
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if baseline is not None:
+            self.compare(baseline, results, options['tolerance'])
+
+    @staticmethod
+    @contextmanager
+    def scratch_database(path):
+        """Points the default database at `path`, keeping the configured profile, for the duration of the block"""
+        database = settings.DATABASES['default']
+        saved = dict(database)
+        connections.close_all()
+        # Connections are created from this dict, so changing it in place switches the database
+        database.update(NAME=path, CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=False)
+        try:
+            yield
+        finally:
+            connections.close_all()
+            database.clear()
+            database.update(saved)
+
+    def measure(self, endpoint, size, generator, options):
+        # Server errors come back as 500 responses and are counted, instead of ending the run
+        client = Client(raise_request_exception=False)
+        rng = random.Random(options['seed'])
+        voucher_ids = list(Voucher.objects.order_by('?').values_list('voucher_id', flat=True)[:1000])
+        requests = getattr(self, f'{endpoint}_requests')(client, rng, voucher_ids, generator)
+        times, queries, errors = [], [], 0
+        for n in range(options['warmup'] + options['requests']):
+            send, expected_status = next(requests)
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = send()
+                elapsed = time.perf_counter() - started
+            if response.status_code != expected_status:
+                errors += 1
+            if n >= options['warmup']:
+                times.append(elapsed * 1000)
+                queries.append(len(captured))
+        return {
+            'endpoint': endpoint,
+            'size': size,
+            'requests': len(times),
+            'errors': errors,
+            'mean_ms': round(statistics.fmean(times), 2),
+            'p50_ms': round(percentile(times, 0.5), 2),
+            'p95_ms': round(percentile(times, 0.95), 2),
+            'p99_ms': round(percentile(times, 0.99), 2),
+            'max_ms': round(max(times), 2),
+            'queries_median': statistics.median(queries),
+            'queries_max': max(queries),
+        }
+
+    # Each of these yields (function sending one request, expected status code) forever
+
+    @staticmethod
+    def voucher_list_requests(client, rng, voucher_ids, generator):
+        url = reverse('voucher_list')
+        while True:
+            yield partial(client.get, url), 200
+
+    @staticmethod
+    def voucher_detail_requests(client, rng, voucher_ids, generator):
+        while True:
+            url = reverse('voucher_detail', args=[rng.choice(voucher_ids)])
+            yield partial(client.get, url), 200
+
+    @staticmethod
+    def create_voucher_requests(client, rng, voucher_ids, generator):
+        url = reverse('create_voucher')
+        while True:
+            voucher_type, data, items = generator.record(datetime.date.today())
+            post = {'voucher_type': voucher_type, **{name: value for name, value in data.items() if value is not None}}
+            post.update({
+                'items-TOTAL_FORMS': str(len(items)), 'items-INITIAL_FORMS': '0',
+                'items-MIN_NUM_FORMS': '0', 'items-MAX_NUM_FORMS': '1000',
+            })
+            for n, item in enumerate(items):
+                post.update({f'items-{n}-{name}': str(value) for name, value in item.items()})
+            yield partial(client.post, url, post), 302
+
+    @staticmethod
+    def download_voucher_pdf_requests(client, rng, voucher_ids, generator):
+        # Mostly different vouchers, so this measures rendering more than the PDF cache
+        while True:
+            url = reverse('download_voucher_pdf', args=[rng.choice(voucher_ids)])
+            yield partial(client.get, url), 200
+
+    def write_result(self, result):
+        line = (
+            f"  {result['endpoint']:<22}p50 {result['p50_ms']:>8.1f}ms  p95 {result['p95_ms']:>8.1f}ms  "
+            f"p99 {result['p99_ms']:>8.1f}ms  queries {result['queries_median']:g} (max {result['queries_max']})"
+        )
+        if result['errors']:
+            line += self.style.ERROR(f"  {result['errors']} unexpected responses")
+        self.stdout.write(line)
+
+    def compare(self, baseline, results, tolerance):
+        """Reports changes against a baseline run; raises CommandError if anything got slower or chattier"""
+        previous = {(result['endpoint'], result['size']): result for result in baseline.get('results', [])}
+        regressions = []
+        for result in results:
+            before = previous.get((result['endpoint'], result['size']))
+            if before is None:
+                continue
+            name = f"{result['endpoint']} @ {result['size']}"
+            change = result['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0
+            self.stdout.write(
+                f"{name:<36}p95 {before['p95_ms']:.1f} -> {result['p95_ms']:.1f}ms ({change:+.0%}), "
+                f"queries {before['queries_max']} -> {result['queries_max']}"
+            )
+            if change > tolerance and result['p95_ms'] - before['p95_ms'] > NOISE_FLOOR_MS:
+                regressions.append(f"{name}: p95 {change:+.0%}")
+            if result['queries_max'] > before['queries_max']:
+                regressions.append(f"{name}: {result['queries_max']} queries, was {before['queries_max']}")
+        if regressions:
+            raise CommandError("Regressions against the baseline:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    @staticmethod
+    def git_commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,98 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh process: loads the WSGI application, then serves the first page and the first PDF
+FIRST_REQUEST_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+from django.core.servers.basehttp import get_internal_wsgi_application
+get_internal_wsgi_application()
+timings = {'startup_ms': (time.perf_counter() - started) * 1000}
+
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from vouchers.models import Voucher
+
+client = Client()
+with override_settings(ALLOWED_HOSTS=['testserver'], VOUCHER_PDF_CACHE_DIR=None, VOUCHER_PDF_ASYNC=False):
+    started = time.perf_counter()
+    client.get(reverse('voucher_list'))
+    timings['first_page_ms'] = (time.perf_counter() - started) * 1000
+    voucher_id = Voucher.objects.values_list('voucher_id', flat=True).first()
+    if voucher_id:
+        started = time.perf_counter()
+        client.get(reverse('download_voucher_pdf', args=[voucher_id]))
+        timings['first_pdf_ms'] = (time.perf_counter() - started) * 1000
+print(json.dumps(timings))
+"""
+ENGINE_IMPORT_SCRIPT = """
+import time
+started = time.perf_counter()
+import weasyprint
+print((time.perf_counter() - started) * 1000)
+"""
+MODES = [('lazy', '0'), ('preload', '1')]
+ROWS = [
+    ('engine_import_ms', "import weasyprint"),
+    ('check_ms', "manage.py check"),
+    ('startup_ms', "WSGI app loaded"),
+    ('first_page_ms', "first list page"),
+    ('first_pdf_ms', "first PDF"),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures start-up cost in fresh processes: `manage.py check`, loading the WSGI application, and the "
+        "first page and first PDF served, with VOUCHER_PDF_PRELOAD off (lazy) and on (preload, which imports "
+        "WeasyPrint at start-up as the app used to). Reports the median of --runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help="Fresh processes per measurement")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError("--runs must be at least 1.")
+        manage_py = os.path.join(settings.BASE_DIR, 'manage.py')
+        results = {}
+        for mode, preload in MODES:
+            env = {**os.environ, 'VMS_PDF_PRELOAD': preload}
+            samples = {key: [] for key, _ in ROWS}
+            for _ in range(options['runs']):
+                started = time.perf_counter()
+                self.run([sys.executable, manage_py, 'check'], env)
+                samples['check_ms'].append((time.perf_counter() - started) * 1000)
+                for key, value in json.loads(self.run([sys.executable, '-c', FIRST_REQUEST_SCRIPT], env)).items():
+                    samples[key].append(value)
+                if mode == 'lazy':
+                    samples['engine_import_ms'].append(float(self.run([sys.executable, '-c', ENGINE_IMPORT_SCRIPT], env)))
+            results[mode] = {key: round(statistics.median(values), 1) for key, values in samples.items() if values}
+
+        self.stdout.write(f"{'median of ' + str(options['runs']) + ' runs':<24}" + ''.join(f"{mode:>12}" for mode, _ in MODES))
+        for key, label in ROWS:
+            cells = [results[mode].get(key) for mode, _ in MODES]
+            self.stdout.write(f"{label:<24}" + ''.join(f"{cell:>10.1f}ms" if cell is not None else f"{'-':>12}" for cell in cells))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'runs': options['runs'], 'python': sys.version.split()[0], 'results': results}, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    @staticmethod
+    def run(command, env):
+        """Runs `command` from the project directory and returns its stdout"""
+        process = subprocess.run(command, env=env, cwd=settings.BASE_DIR, capture_output=True, text=True)
+        if process.returncode:
+            raise CommandError(f"{' '.join(command[:3])} failed:\n{process.stderr[-2000:]}")
+        return process.stdout
@@ -0,0 +1,45 @@
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand, CommandError
+
+WEBP_QUALITY = 75
+
+
+def variant_name(name, width):
+    """images/background.jpg -> images/background-960.webp"""
+    return f'{os.path.splitext(name)[0]}-{width}.webp'
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the resized WebP copies of the images in VOUCHER_IMAGE_VARIANTS next to their sources "
+        "(images/background.jpg -> images/background-960.webp, ...). Commit them with the source image; "
+        "collectstatic then hashes and serves them like any other static file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quality', type=int, default=WEBP_QUALITY, help="WebP quality, 0-100")
+
+    def handle(self, *args, **options):
+        try:
+            from PIL import Image
+        except ImportError:
+            raise CommandError("build_images needs Pillow: pip install pillow")
+
+        for name, widths in getattr(settings, 'VOUCHER_IMAGE_VARIANTS', {}).items():
+            source = finders.find(name)
+            if source is None:
+                raise CommandError(f"No static file {name}")
+            with Image.open(source) as image:
+                image = image.convert('RGB')
+                for width in widths:
+                    # Never upscale: a wider copy of a smaller source only costs bytes
+                    size = (width, round(image.height * width / image.width)) if width < image.width else image.size
+                    target = os.path.join(os.path.dirname(source), os.path.basename(variant_name(name, width)))
+                    image.resize(size, Image.LANCZOS).save(target, 'WEBP', quality=options['quality'], method=6)
+                    self.stdout.write(
+                        f"{variant_name(name, width)}: {size[0]}x{size[1]}, {os.path.getsize(target) // 1024}KB "
+                        f"(source {os.path.getsize(source) // 1024}KB)"
+                    )
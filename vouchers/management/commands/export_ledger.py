@@ -0,0 +1,39 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from vouchers import exports
+from vouchers.models import Voucher
+
+
+class Command(BaseCommand):
+    help = "Writes items joined with their vouchers (the ledger) to a CSV or XLSX file, streaming in constant memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="File to write, e.g. ledger-2025.csv or ledger-2025.xlsx")
+        parser.add_argument('--start-date', type=datetime.date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument('--end-date', type=datetime.date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument('--type', dest='voucher_type', choices=[code for code, _ in Voucher.VOUCHER_TYPE_CHOICES])
+        parser.add_argument('--payee', help="Part of the payee name")
+        parser.add_argument('--account', help="Only items posted to this account")
+        parser.add_argument('--format', choices=['csv', 'xlsx'], help="Defaults to the output file extension")
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('xlsx' if options['output'].endswith('.xlsx') else 'csv')
+        chunks = exports.stream_export(
+            file_format,
+            start_date=options['start_date'],
+            end_date=options['end_date'],
+            voucher_type=options['voucher_type'],
+            payee=options['payee'],
+            account=options['account'],
+        )
+        if file_format == 'xlsx':
+            with open(options['output'], 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        else:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
@@ -0,0 +1,60 @@
+import csv
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vouchers.importer import CheckpointMismatch, import_vouchers
+from vouchers.models import ImportCheckpoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports vouchers from a CSV or JSON Lines file (record=voucher rows, each followed by its "
+        "record=item rows). Progress is checkpointed per batch, so re-running the same file resumes it; "
+        "a file with other content under the same checkpoint name is refused."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Vouchers per transaction")
+        parser.add_argument('--checkpoint', help="Checkpoint name (default: the file name); it resumes only the same content")
+        parser.add_argument('--restart', action='store_true', help="Ignore any saved checkpoint and start over")
+        parser.add_argument('--errors', help="Write rejected vouchers to this CSV file")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist.")
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        checkpoint_name = options['checkpoint'] or os.path.basename(path)
+        if options['restart']:
+            ImportCheckpoint.objects.filter(name=checkpoint_name).delete()
+
+        started = time.perf_counter()
+        with open(path, 'rb') as f:
+            try:
+                result = import_vouchers(f, file_format, options['batch_size'], checkpoint_name)
+            except CheckpointMismatch as e:
+                raise CommandError(f"{e} Pass --restart to import this file from the start, or another --checkpoint.")
+        elapsed = time.perf_counter() - started
+
+        if options['errors'] and result.errors:
+            with open(options['errors'], 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['line', 'ref', 'field', 'error'])
+                for line_no, ref, errors in result.errors:
+                    for field, message in errors.items():
+                        writer.writerow([line_no, ref, field, message])
+        for line_no, ref, errors in result.errors[:20]:
+            self.stderr.write(f"Line {line_no}{f' ({ref})' if ref else ''}: " + '; '.join(
+                f"{field}: {message}" for field, message in errors.items()))
+        if len(result.errors) > 20:
+            self.stderr.write(f"... and {len(result.errors) - 20} more rejected vouchers")
+
+        rate = result.imported / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.imported} vouchers, rejected {result.failed} "
+            f"in {elapsed:.1f}s ({rate:.0f} vouchers/s); {result.position} records read in total."
+        ))
@@ -0,0 +1,73 @@
+import os
+import posixpath
+import re
+import tempfile
+from urllib.parse import urlsplit
+
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.templatetags.static import static
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+PAGES = ['landing_page', 'voucher_list']
+# What style.css makes a desktop browser download besides itself: (before this pipeline, now for WebP browsers)
+CSS_IMAGES = [('images/background.jpg', 'images/background-1920.webp')]
+STATIC_LINK = re.compile(r'(?:href|src)="([^"]+)"')
+
+
+def body_size(response):
+    size = len(b''.join(response.streaming_content)) if response.streaming else len(response.content)
+    response.close()
+    return size
+
+
+class Command(BaseCommand):
+    help = (
+        "Collects the static files into a scratch STATIC_ROOT and reports, for the landing and list pages, "
+        "the bytes of each local asset as the site used to serve it (original file, uncompressed, no "
+        "caching headers) and as WhiteNoise serves it now (hashed name, br/gzip, far-future max-age)."
+    )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as static_root, override_settings(
+            STATIC_ROOT=static_root, DEBUG=False, ALLOWED_HOSTS=['testserver'],
+        ):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            names = {hashed: name for name, hashed in staticfiles_storage.hashed_files.items()}
+            client = Client(HTTP_ACCEPT_ENCODING='br, gzip')
+            prefix = urlsplit(static('')).path
+            for page in PAGES:
+                response = client.get(reverse(page))
+                if response.status_code != 200:
+                    raise CommandError(f"{reverse(page)} returned {response.status_code}")
+                html = response.content.decode()
+                rows = [('page HTML', len(response.content), len(response.content), '', '')]
+                assets = [urlsplit(url).path for url in STATIC_LINK.findall(html)]
+                assets = [url for url in dict.fromkeys(assets) if url.startswith(prefix)]
+                if any(names.get(url[len(prefix):]) == 'css/style.css' for url in assets):
+                    assets += [static(image) for _, image in CSS_IMAGES]
+                before_names = {image: source for source, image in CSS_IMAGES}
+                for url in assets:
+                    name = names.get(url[len(prefix):], url[len(prefix):])
+                    original = before_names.get(name, name)
+                    label = original if original == name else f'{original} -> {posixpath.basename(name)}'
+                    served = client.get(url)
+                    rows.append((
+                        label, os.path.getsize(finders.find(original)), body_size(served),
+                        served.get('Content-Encoding', ''), served.get('Cache-Control', ''),
+                    ))
+                self.report(reverse(page), rows)
+
+    def report(self, url, rows):
+        self.stdout.write(f"\n{url}")
+        self.stdout.write(f"  {'':<48}{'before':>10}{'after':>10}  encoding  cache")
+        for name, before, after, encoding, cache in rows:
+            self.stdout.write(f"  {name:<48}{before / 1024:>8.1f}KB{after / 1024:>8.1f}KB  {encoding:<8}  {cache}")
+        before, after = sum(row[1] for row in rows), sum(row[2] for row in rows)
+        self.stdout.write(f"  {'first visit':<48}{before / 1024:>8.1f}KB{after / 1024:>8.1f}KB  {after / before - 1:+.0%}")
+        # Hashed assets are cached for good, so a repeat visit downloads just the HTML
+        self.stdout.write(f"  {'repeat visit':<48}{before / 1024:>8.1f}KB{rows[0][2] / 1024:>8.1f}KB")
@@ -0,0 +1,44 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from vouchers import batch_print
+from vouchers.models import Voucher
+
+
+class Command(BaseCommand):
+    help = "Prints the vouchers matching a filter into one PDF (one voucher per page) or a ZIP of PDFs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="File to write, e.g. audit-2025.pdf or audit-2025.zip")
+        parser.add_argument('--start-date', type=datetime.date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument('--end-date', type=datetime.date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument('--type', dest='voucher_type', choices=[code for code, _ in Voucher.VOUCHER_TYPE_CHOICES])
+        parser.add_argument('--ids', default='', help="Comma separated voucher IDs")
+        parser.add_argument('--format', choices=['pdf', 'zip'], help="Defaults to the output file extension")
+        parser.add_argument(
+            '--base-url', default=getattr(settings, 'VOUCHER_PDF_BASE_URL', None),
+            help="Site URL the logo is loaded from (default: VOUCHER_PDF_BASE_URL)",
+        )
+
+    def handle(self, *args, **options):
+        voucher_ids = [voucher_id.strip() for voucher_id in options['ids'].split(',') if voucher_id.strip()]
+        vouchers = batch_print.select_vouchers(
+            start_date=options['start_date'],
+            end_date=options['end_date'],
+            voucher_type=options['voucher_type'],
+            voucher_ids=voucher_ids,
+        )
+        if not options['base_url']:
+            raise CommandError("Pass --base-url or set VOUCHER_PDF_BASE_URL so the logo can be loaded.")
+        output_format = options['format'] or ('zip' if options['output'].endswith('.zip') else 'pdf')
+
+        count = vouchers.count()
+        if not count:
+            raise CommandError("No vouchers match that filter.")
+        if output_format == 'zip':
+            batch_print.write_zip(vouchers, options['base_url'], options['output'])
+        else:
+            batch_print.write_merged_pdf(vouchers, options['base_url'], options['output'])
+        self.stdout.write(self.style.SUCCESS(f"Printed {count} vouchers to {options['output']}"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from vouchers import navigation
+
+
+class Command(BaseCommand):
+    help = "Recomputes the previous/next links behind the arrows on the voucher page from the vouchers"
+
+    def handle(self, *args, **options):
+        written = navigation.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Navigation rebuilt: {written} links"))
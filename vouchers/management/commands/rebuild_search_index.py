@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from vouchers import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index from the voucher and item tables"
+
+    def handle(self, *args, **options):
+        if not search.available():
+            raise CommandError("The search index only exists on SQLite; run migrate first.")
+        count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} vouchers"))
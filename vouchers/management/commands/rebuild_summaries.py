@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from vouchers import reports
+
+
+class Command(BaseCommand):
+    help = "Recomputes the reporting summary tables from the vouchers, or with --verify only checks them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help="Compare the summaries with the vouchers and report differences without changing anything")
+        parser.add_argument('--show', type=int, default=20, help="Differences to list with --verify")
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            written = reports.rebuild()
+            for name, count in written.items():
+                self.stdout.write(f"{name}: {count} rows")
+            self.stdout.write(self.style.SUCCESS("Summaries rebuilt"))
+            return
+
+        problems = reports.verify()
+        for name, key, stored, expected in problems[:options['show']]:
+            self.stdout.write(f"{name} {key}: stored {stored}, expected {expected}")
+        if problems:
+            raise CommandError(f"{len(problems)} summary rows are out of step; run rebuild_summaries to fix them.")
+        self.stdout.write(self.style.SUCCESS("Summaries match the vouchers"))
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vouchers import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks the stored total and amount in words of every voucher against its items, a batch at a time "
+        "with one grouped SUM query per batch, and repairs the ones that don't match. --dry-run only reports "
+        "them; --since-last-run checks only the vouchers changed since the last run. Archived years are "
+        "read-only and not checked."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report mismatches without changing anything; the run isn't recorded")
+        parser.add_argument('--since-last-run', action='store_true',
+                            help="Check only the vouchers updated since the last recorded run (all of them if there was none)")
+        parser.add_argument('--batch-size', type=int, default=reconcile.BATCH_SIZE,
+                            help=f"Vouchers per query (default: {reconcile.BATCH_SIZE})")
+        parser.add_argument('--show', type=int, default=20, help="Mismatches to list")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        if options['since_last_run'] and reconcile.last_run_start() is None:
+            self.stdout.write("No earlier run recorded: checking every voucher")
+
+        started = time.perf_counter()
+        checked = found = 0
+        for checked, mismatches in reconcile.reconcile(
+            incremental=options['since_last_run'], dry_run=options['dry_run'], batch_size=options['batch_size'],
+        ):
+            for m in mismatches[:max(options['show'] - found, 0)]:
+                self.stdout.write(
+                    f"{m.voucher_id}: stored {m.stored_total} {m.stored_words!r}, "
+                    f"items add up to {m.total} {m.words!r}"
+                )
+            found += len(mismatches)
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{checked} vouchers checked ({time.perf_counter() - started:.1f}s)")
+
+        seconds = time.perf_counter() - started
+        if found > options['show']:
+            self.stdout.write(f"... and {found - options['show']} more")
+        if not found:
+            self.stdout.write(self.style.SUCCESS(f"{checked} vouchers checked in {seconds:.1f}s: all match their items"))
+        elif options['dry_run']:
+            raise CommandError(
+                f"{found} of {checked} vouchers don't match their items; run reconcile_vouchers without --dry-run to repair them."
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{checked} vouchers checked in {seconds:.1f}s: {found} repaired"))
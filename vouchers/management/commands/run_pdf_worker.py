@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vouchers.pdf_jobs import Worker
+
+
+class Command(BaseCommand):
+    help = "Renders queued voucher PDFs on a local process pool (used when VOUCHER_PDF_ASYNC is on)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=getattr(settings, 'VOUCHER_PDF_WORKERS', 2),
+            help="Number of render processes (default: VOUCHER_PDF_WORKERS)",
+        )
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds between queue checks")
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help="Seconds after which a running job is assumed dead and queued again")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        worker = Worker(
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            stale_after=timedelta(seconds=options['stale_after']),
+        )
+        self.stdout.write(f"Rendering PDFs with {worker.concurrency} processes")
+        worker.run(once=options['once'])
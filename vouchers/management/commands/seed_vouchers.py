@@ -0,0 +1,60 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vouchers.models import Voucher
+from vouchers.synthetic import VoucherGenerator, seed_vouchers
+
+VOUCHER_TYPES = [code for code, _ in Voucher.VOUCHER_TYPE_CHOICES]
+
+
+def item_range(value):
+    """'3' or '1-5' -> (min, max) items per voucher"""
+    low, _, high = value.partition('-')
+    try:
+        low, high = int(low), int(high or low)
+    except ValueError:
+        raise CommandError(f"--items takes a number or a range like 1-5, not {value!r}.")
+    if not 1 <= low <= high:
+        raise CommandError("--items must be at least 1, with the smaller number first.")
+    return low, high
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates realistic synthetic vouchers (BPV/BRV/CPV/CRV with items) for load testing. "
+        "Goes through the same bulk insert as import_vouchers, so the search index and summaries are kept up to date."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int, help="Number of vouchers to create")
+        parser.add_argument('--items', default='1-5', help="Items per voucher: a number or a range like 1-5")
+        parser.add_argument('--type', action='append', choices=VOUCHER_TYPES, dest='types',
+                            help="Voucher type to generate (repeatable; default: all, in realistic proportions)")
+        parser.add_argument('--days', type=int, default=365, help="Spread the dates over this many days up to --end-date")
+        parser.add_argument('--end-date', type=datetime.date.fromisoformat, help="Last voucher date (default: today)")
+        parser.add_argument('--payees', type=int, default=300, help="Number of distinct payees")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed gives the same vouchers")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Vouchers per transaction")
+
+    def handle(self, *args, **options):
+        if options['count'] < 1:
+            raise CommandError("count must be at least 1.")
+        end_date = options['end_date'] or datetime.date.today()
+        start_date = end_date - datetime.timedelta(days=max(options['days'] - 1, 0))
+        generator = VoucherGenerator(
+            seed=options['seed'], items=item_range(options['items']),
+            voucher_types=options['types'], payees=options['payees'],
+        )
+
+        started = time.perf_counter()
+        inserted = 0
+        for inserted in seed_vouchers(generator, options['count'], start_date, end_date, options['batch_size']):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{inserted} vouchers")
+        elapsed = time.perf_counter() - started
+        rate = inserted / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {inserted} vouchers dated {start_date} to {end_date} in {elapsed:.1f}s ({rate:.0f} vouchers/s)."
+        ))
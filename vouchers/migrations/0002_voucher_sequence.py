@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:06
+
+from django.db import migrations, models
+
+
+def seed_sequences(apps, schema_editor):
+    """Start every counter after the highest number already issued"""
+    Voucher = apps.get_model('vouchers', 'Voucher')
+    VoucherSequence = apps.get_model('vouchers', 'VoucherSequence')
+    highest = {}
+    for voucher_id in Voucher.objects.values_list('voucher_id', flat=True).iterator():
+        parts = voucher_id.split('-')
+        fiscal_year = int(parts[1]) if len(parts) == 3 else 0
+        key = (parts[0], fiscal_year)
+        highest[key] = max(highest.get(key, 0), int(parts[-1]))
+    VoucherSequence.objects.bulk_create(
+        VoucherSequence(voucher_type=voucher_type, fiscal_year=fiscal_year, last_number=number)
+        for (voucher_type, fiscal_year), number in highest.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoucherSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('voucher_type', models.CharField(max_length=3)),
+                ('fiscal_year', models.PositiveSmallIntegerField(default=0)),
+                ('last_number', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('voucher_type', 'fiscal_year'), name='unique_voucher_sequence')],
+            },
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0002_voucher_sequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='voucher',
+            index=models.Index(fields=['-date', '-voucher_id'], name='voucher_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0003_voucher_date_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PdfRenderJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('base_url', models.CharField(max_length=255)),
+                ('cache_key', models.CharField(blank=True, max_length=64)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('voucher', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pdf_jobs', to='vouchers.voucher')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='pdf_job_status_idx')],
+            },
+        ),
+    ]
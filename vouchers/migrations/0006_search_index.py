@@ -0,0 +1,135 @@
+"""
+Full-text search index (SQLite FTS5).
+
+vouchers_search holds one row per voucher: its ID, payee, memo, prepared_by
+and the account and description of every item. Its rowid comes from
+vouchers_search_doc, which gives each voucher a stable integer id (the implicit
+rowid of vouchers_voucher can change on VACUUM). Triggers keep both tables in
+step with every write, including raw bulk inserts that bypass signals.
+Other database backends get nothing here and fall back to icontains.
+"""
+from django.db import migrations
+
+# Items text for one voucher, as stored in the items column
+ITEMS_TEXT = (
+    "coalesce((SELECT group_concat(i.account || ' ' || i.description, char(10)) "
+    "FROM vouchers_item i WHERE i.voucher_id = {}), '')"
+)
+DOC_ID = "(SELECT id FROM vouchers_search_doc WHERE voucher_id = {})"
+
+TABLES_SQL = [
+    """
+    CREATE VIRTUAL TABLE vouchers_search USING fts5(
+        voucher_id, payee, memo, prepared_by, items,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    """
+    CREATE TABLE vouchers_search_doc (
+        id integer NOT NULL PRIMARY KEY,
+        voucher_id varchar(15) NOT NULL UNIQUE
+    )
+    """,
+]
+
+# Triggers on vouchers_voucher. SQLite drops them whenever a migration rebuilds that table
+# (e.g. adding a NOT NULL column), so such migrations create them again from this list.
+VOUCHER_TRIGGERS_SQL = [
+    # Bulk inserts add the doc rows themselves and index the whole batch in one statement
+    # (search.bulk_indexing()), which is several times faster than a trigger per row
+    f"""
+    CREATE TRIGGER vouchers_search_voucher_insert AFTER INSERT ON vouchers_voucher
+    WHEN NOT EXISTS (SELECT 1 FROM vouchers_search_doc WHERE voucher_id = new.voucher_id) BEGIN
+        INSERT INTO vouchers_search_doc (voucher_id) VALUES (new.voucher_id);
+        INSERT INTO vouchers_search (rowid, voucher_id, payee, memo, prepared_by, items)
+        VALUES ({DOC_ID.format('new.voucher_id')}, new.voucher_id, new.payee, coalesce(new.memo, ''), new.prepared_by,
+                {ITEMS_TEXT.format('new.voucher_id')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER vouchers_search_voucher_update AFTER UPDATE OF payee, memo, prepared_by ON vouchers_voucher
+    WHEN old.payee IS NOT new.payee OR old.memo IS NOT new.memo OR old.prepared_by IS NOT new.prepared_by BEGIN
+        UPDATE vouchers_search SET payee = new.payee, memo = coalesce(new.memo, ''), prepared_by = new.prepared_by
+        WHERE rowid = {DOC_ID.format('new.voucher_id')};
+    END
+    """,
+    f"""
+    CREATE TRIGGER vouchers_search_voucher_delete AFTER DELETE ON vouchers_voucher BEGIN
+        DELETE FROM vouchers_search WHERE rowid = {DOC_ID.format('old.voucher_id')};
+        DELETE FROM vouchers_search_doc WHERE voucher_id = old.voucher_id;
+    END
+    """,
+]
+
+ITEM_TRIGGERS_SQL = [
+    # New items are appended rather than re-reading every item of the voucher
+    f"""
+    CREATE TRIGGER vouchers_search_item_insert AFTER INSERT ON vouchers_item BEGIN
+        UPDATE vouchers_search
+        SET items = CASE WHEN items = '' THEN '' ELSE items || char(10) END || new.account || ' ' || new.description
+        WHERE rowid = {DOC_ID.format('new.voucher_id')};
+    END
+    """,
+    f"""
+    CREATE TRIGGER vouchers_search_item_update AFTER UPDATE OF account, description, voucher_id ON vouchers_item
+    WHEN old.account IS NOT new.account OR old.description IS NOT new.description OR old.voucher_id IS NOT new.voucher_id BEGIN
+        UPDATE vouchers_search SET items = {ITEMS_TEXT.format('old.voucher_id')}
+        WHERE rowid = {DOC_ID.format('old.voucher_id')};
+        UPDATE vouchers_search SET items = {ITEMS_TEXT.format('new.voucher_id')}
+        WHERE rowid = {DOC_ID.format('new.voucher_id')};
+    END
+    """,
+    f"""
+    CREATE TRIGGER vouchers_search_item_delete AFTER DELETE ON vouchers_item BEGIN
+        UPDATE vouchers_search SET items = {ITEMS_TEXT.format('old.voucher_id')}
+        WHERE rowid = {DOC_ID.format('old.voucher_id')};
+    END
+    """,
+]
+
+CREATE_SQL = TABLES_SQL + VOUCHER_TRIGGERS_SQL + ITEM_TRIGGERS_SQL
+
+POPULATE_SQL = [
+    "INSERT INTO vouchers_search_doc (voucher_id) SELECT voucher_id FROM vouchers_voucher ORDER BY voucher_id",
+    f"""
+    INSERT INTO vouchers_search (rowid, voucher_id, payee, memo, prepared_by, items)
+    SELECT d.id, v.voucher_id, v.payee, coalesce(v.memo, ''), v.prepared_by, {ITEMS_TEXT.format('v.voucher_id')}
+    FROM vouchers_search_doc d JOIN vouchers_voucher v ON v.voucher_id = d.voucher_id
+    """,
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS vouchers_search_item_delete",
+    "DROP TRIGGER IF EXISTS vouchers_search_item_update",
+    "DROP TRIGGER IF EXISTS vouchers_search_item_insert",
+    "DROP TRIGGER IF EXISTS vouchers_search_voucher_delete",
+    "DROP TRIGGER IF EXISTS vouchers_search_voucher_update",
+    "DROP TRIGGER IF EXISTS vouchers_search_voucher_insert",
+    "DROP TABLE IF EXISTS vouchers_search_doc",
+    "DROP TABLE IF EXISTS vouchers_search",
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_SQL + POPULATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0005_import_checkpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
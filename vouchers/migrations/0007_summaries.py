@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:35
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncMonth
+
+
+def fill_summaries(apps, schema_editor):
+    """Sums up the vouchers that already exist"""
+    Voucher = apps.get_model('vouchers', 'Voucher')
+    Item = apps.get_model('vouchers', 'Item')
+    AccountDailySummary = apps.get_model('vouchers', 'AccountDailySummary')
+    PayeeMonthlySummary = apps.get_model('vouchers', 'PayeeMonthlySummary')
+    total_field = DecimalField(max_digits=16, decimal_places=2)
+    AccountDailySummary.objects.bulk_create(
+        (AccountDailySummary(**row) for row in Item.objects.values(
+            'account', date=F('voucher__date'), voucher_type=F('voucher__voucher_type'),
+        ).annotate(total=Sum('amount', output_field=total_field), item_count=Count('id')).order_by().iterator()),
+        batch_size=5000,
+    )
+    PayeeMonthlySummary.objects.bulk_create(
+        (PayeeMonthlySummary(**row) for row in Voucher.objects.values(
+            'payee', 'voucher_type', month=TruncMonth('date'),
+        ).annotate(total=Sum('total_amount', output_field=total_field), voucher_count=Count('voucher_id')).order_by().iterator()),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0006_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountDailySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(max_length=100)),
+                ('date', models.DateField()),
+                ('voucher_type', models.CharField(choices=[('BPV', 'Bank Payment'), ('BRV', 'Bank Receipt'), ('CPV', 'Cash Payment'), ('CRV', 'Cash Receipt')], max_length=3)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('item_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date'], name='account_summary_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('account', 'date', 'voucher_type'), name='unique_account_daily_summary')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PayeeMonthlySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payee', models.CharField(max_length=255)),
+                ('month', models.DateField()),
+                ('voucher_type', models.CharField(choices=[('BPV', 'Bank Payment'), ('BRV', 'Bank Receipt'), ('CPV', 'Cash Payment'), ('CRV', 'Cash Receipt')], max_length=3)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('voucher_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['month'], name='payee_summary_month_idx')],
+                'constraints': [models.UniqueConstraint(fields=('payee', 'month', 'voucher_type'), name='unique_payee_monthly_summary')],
+            },
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
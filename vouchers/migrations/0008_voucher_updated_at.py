@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:02
+
+import importlib
+
+import django.utils.timezone
+from django.db import migrations, models
+
+search_index = importlib.import_module('vouchers.migrations.0006_search_index')
+
+
+def create_voucher_triggers(apps, schema_editor):
+    # Adding the column rebuilds vouchers_voucher on SQLite, which drops the search index triggers on it
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for name in ['insert', 'update', 'delete']:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS vouchers_search_voucher_{name}')
+    for sql in search_index.VOUCHER_TRIGGERS_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0007_summaries'),
+    ]
+
+    operations = [
+        # Both ways: removing the column on unapply rebuilds the table too
+        migrations.RunPython(migrations.RunPython.noop, create_voucher_triggers),
+        migrations.AddField(
+            model_name='voucher',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(create_voucher_triggers, migrations.RunPython.noop),
+    ]
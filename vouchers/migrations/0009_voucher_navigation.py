@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_navigation(apps, schema_editor):
+    """Links the vouchers that already exist, in (date, voucher_id) order overall and within each type"""
+    Voucher = apps.get_model('vouchers', 'Voucher')
+    VoucherNavigation = apps.get_model('vouchers', 'VoucherNavigation')
+    rows = []
+    for scope, chain_fields in [('date', []), ('type', ['voucher_type'])]:
+        chains = {}
+        for values in Voucher.objects.order_by('date', 'voucher_id').values_list(*chain_fields, 'voucher_id').iterator():
+            chains.setdefault(values[:-1], []).append(values[-1])
+        for voucher_ids in chains.values():
+            for position, voucher_id in enumerate(voucher_ids):
+                rows.append(VoucherNavigation(
+                    voucher_id=voucher_id, scope=scope,
+                    prev_id=voucher_ids[position - 1] if position else None,
+                    next_id=voucher_ids[position + 1] if position + 1 < len(voucher_ids) else None,
+                ))
+    VoucherNavigation.objects.bulk_create(rows, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0008_voucher_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoucherNavigation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('date', 'All vouchers by date'), ('type', 'Same type by date')], max_length=4)),
+                ('prev_id', models.CharField(blank=True, max_length=15, null=True)),
+                ('next_id', models.CharField(blank=True, max_length=15, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='voucher',
+            index=models.Index(fields=['voucher_type', 'date', 'voucher_id'], name='voucher_type_date_id_idx'),
+        ),
+        migrations.AddField(
+            model_name='vouchernavigation',
+            name='voucher',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='navigation', to='vouchers.voucher'),
+        ),
+        migrations.AddConstraint(
+            model_name='vouchernavigation',
+            constraint=models.UniqueConstraint(fields=('voucher', 'scope'), name='unique_voucher_navigation'),
+        ),
+        migrations.RunPython(fill_navigation, migrations.RunPython.noop),
+    ]
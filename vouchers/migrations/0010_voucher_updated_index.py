@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0009_voucher_navigation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='voucher',
+            index=models.Index(fields=['updated_at', 'voucher_id'], name='voucher_updated_id_idx'),
+        ),
+    ]
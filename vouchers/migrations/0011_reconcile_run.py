@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0010_voucher_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconcileRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(auto_now_add=True)),
+                ('incremental', models.BooleanField(default=False)),
+                ('checked', models.PositiveIntegerField(default=0)),
+                ('repaired', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:37
+
+import importlib
+
+from django.db import migrations, models
+
+search_index = importlib.import_module('vouchers.migrations.0006_search_index')
+
+
+def drop_search_index(apps, schema_editor):
+    # Altering the primary key rebuilds vouchers_voucher and the tables pointing at it on SQLite,
+    # which drops the triggers; the index is dropped first and built again for the new IDs below
+    search_index.drop_search_index(apps, schema_editor)
+
+
+def create_search_index(apps, schema_editor):
+    search_index.create_search_index(apps, schema_editor)
+
+
+def renumber(digits):
+    """Pads the number of every voucher ID, and every column holding one, to `digits` digits"""
+    def run(apps, schema_editor):
+        Voucher = apps.get_model('vouchers', 'Voucher')
+        VoucherNavigation = apps.get_model('vouchers', 'VoucherNavigation')
+        renamed = []
+        for voucher_id in Voucher.objects.values_list('voucher_id', flat=True).iterator():
+            prefix, _, number = voucher_id.rpartition('-')
+            new_id = f"{prefix}-{int(number):0{digits}d}"
+            if new_id != voucher_id:
+                renamed.append((new_id, voucher_id))
+        if not renamed:
+            return
+
+        columns = [(Voucher._meta.db_table, 'voucher_id')]
+        # The bank child tables (voucher_ptr_id), items, navigation rows and PDF jobs
+        for model in apps.get_app_config('vouchers').get_models():
+            columns += [
+                (model._meta.db_table, field.column) for field in model._meta.local_fields
+                if field.is_relation and field.related_model is Voucher
+            ]
+        columns += [(VoucherNavigation._meta.db_table, 'prev_id'), (VoucherNavigation._meta.db_table, 'next_id')]
+        quote = schema_editor.quote_name
+        # Foreign key checks are off until the migration ends, so the tables can be renamed one by one
+        with schema_editor.connection.cursor() as cursor:
+            for table, column in columns:
+                cursor.executemany(
+                    f"UPDATE {quote(table)} SET {quote(column)} = %s WHERE {quote(column)} = %s", renamed,
+                )
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0011_reconcile_run'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_search_index, create_search_index),
+        migrations.AlterField(
+            model_name='voucher',
+            name='voucher_id',
+            field=models.CharField(editable=False, max_length=20, primary_key=True, serialize=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='vouchernavigation',
+            name='next_id',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AlterField(
+            model_name='vouchernavigation',
+            name='prev_id',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.RunPython(renumber(8), renumber(5)),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
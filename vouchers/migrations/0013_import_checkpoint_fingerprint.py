@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0012_widen_voucher_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importcheckpoint',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -1,8 +1,79 @@
 # vouchers/models.py
+from django.conf import settings
 from django.db import models, transaction
+from django.db.models import F
 from django.urls import reverse
 from django.utils import timezone
-from num2words import num2words
+from . import words
+
+def fiscal_year_for(date):
+    """Returns the fiscal year (the calendar year it starts in) that a date falls in"""
+    start_month = getattr(settings, 'VOUCHER_FISCAL_YEAR_START_MONTH', 7)
+    return date.year if date.month >= start_month else date.year - 1
+
+
+# --- Per-type counters used to hand out voucher numbers ---
+class VoucherSequence(models.Model):
+    voucher_type = models.CharField(max_length=3)
+    # 0 when numbering runs continuously instead of restarting every fiscal year
+    fiscal_year = models.PositiveSmallIntegerField(default=0)
+    last_number = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['voucher_type', 'fiscal_year'], name='unique_voucher_sequence'),
+        ]
+
+    @classmethod
+    def reserve(cls, voucher_type, count=1, fiscal_year=0):
+        """
+        Atomically reserves `count` consecutive numbers and returns the first one.
+        The UPDATE takes the row (SQLite: database) write lock, so parallel
+        callers can never be handed the same number.
+        """
+        sequence = cls.objects.filter(voucher_type=voucher_type, fiscal_year=fiscal_year)
+        with transaction.atomic():
+            if not sequence.update(last_number=F('last_number') + count):
+                cls.objects.get_or_create(voucher_type=voucher_type, fiscal_year=fiscal_year)
+                sequence.update(last_number=F('last_number') + count)
+            last_number = sequence.values_list('last_number', flat=True).get()
+        return last_number - count + 1
+
+    def __str__(self):
+        if self.fiscal_year:
+            return f"{self.voucher_type} FY{self.fiscal_year}: {self.last_number}"
+        return f"{self.voucher_type}: {self.last_number}"
+
+
+class VoucherQuerySet(models.QuerySet):
+    def with_details(self):
+        """
+        Loads the bank fields of both child models in the same query (LEFT JOINs)
+        and the items in one more, however many vouchers are fetched.
+        """
+        return self.select_related('bankpaymentvoucher', 'bankreceiptvoucher').prefetch_related('items')
+
+    def typed(self):
+        """Returns the vouchers as their child instances, loaded with with_details()"""
+        return [voucher.get_child_instance() for voucher in self.with_details()]
+
+    def matching(self, start_date=None, end_date=None, voucher_type=None, voucher_ids=None, payee=None, account=None):
+        """Filters used by batch printing and exports; empty values are ignored"""
+        vouchers = self
+        if start_date:
+            vouchers = vouchers.filter(date__gte=start_date)
+        if end_date:
+            vouchers = vouchers.filter(date__lte=end_date)
+        if voucher_type:
+            vouchers = vouchers.filter(voucher_type=voucher_type)
+        if voucher_ids:
+            vouchers = vouchers.filter(voucher_id__in=voucher_ids)
+        if payee:
+            vouchers = vouchers.filter(payee__icontains=payee)
+        if account:
+            vouchers = vouchers.filter(models.Exists(Item.objects.filter(voucher=models.OuterRef('pk'), account=account)))
+        return vouchers
+
 
 # --- The Parent Model for ALL Vouchers ---
 class Voucher(models.Model):
@@ -14,7 +85,7 @@ class Voucher(models.Model):
     ]
     
     # Custom Primary Key
-    voucher_id = models.CharField(max_length=15, primary_key=True, unique=True, editable=False)
+    voucher_id = models.CharField(max_length=20, primary_key=True, unique=True, editable=False)
     
     # Common Fields
     voucher_type = models.CharField(max_length=3, choices=VOUCHER_TYPE_CHOICES)
@@ -26,14 +97,33 @@ class Voucher(models.Model):
     # Auto-calculated Fields
     total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
     amount_in_words = models.CharField(max_length=255, blank=True, editable=False)
+    # Set on every save and when an item changes (signals.py); the detail page's ETag and fragment cache key
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = VoucherQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Matches the voucher list ordering so keyset pages are a single index range scan
+            models.Index(fields=['-date', '-voucher_id'], name='voucher_date_id_idx'),
+            # The same order within each type, which navigation.py seeks along for type-scoped links
+            models.Index(fields=['voucher_type', 'date', 'voucher_id'], name='voucher_type_date_id_idx'),
+            # The API's change feed pages through vouchers in this order (api.changes())
+            models.Index(fields=['updated_at', 'voucher_id'], name='voucher_updated_id_idx'),
+        ]
 
     def get_child_instance(self):
         """Returns the actual child instance (e.g., BankPaymentVoucher)"""
         if self.voucher_type == 'BPV':
-            return self.bankpaymentvoucher
-        if self.voucher_type == 'BRV':
-            return self.bankreceiptvoucher
-        return self # For CPV and CRV
+            child = self.bankpaymentvoucher
+        elif self.voucher_type == 'BRV':
+            child = self.bankreceiptvoucher
+        else:
+            return self # For CPV and CRV
+        # Hand over prefetched items so child.items.all doesn't query again
+        if hasattr(self, '_prefetched_objects_cache'):
+            child._prefetched_objects_cache = self._prefetched_objects_cache
+        return child
 
     def get_voucher_type_display_full(self):
         """Returns the full name like 'Bank Payment Voucher'"""
@@ -46,29 +136,45 @@ class Voucher(models.Model):
         total = self.items.aggregate(total=models.Sum('amount'))['total'] or 0.00
         return total
 
+    @classmethod
+    def sequence_key(cls, voucher_type, date):
+        """Returns the (voucher_type, fiscal_year) pair that numbers a voucher"""
+        if getattr(settings, 'VOUCHER_NUMBERING_PER_FISCAL_YEAR', False):
+            return voucher_type, fiscal_year_for(date)
+        return voucher_type, 0
+
+    # Numbers are zero-padded to this many digits, so IDs of the same type sort as text in number order
+    ID_DIGITS = 8
+
+    @classmethod
+    def format_voucher_id(cls, voucher_type, number, fiscal_year=0):
+        if fiscal_year:
+            return f"{voucher_type}-{fiscal_year}-{number:0{cls.ID_DIGITS}d}"
+        return f"{voucher_type}-{number:0{cls.ID_DIGITS}d}"
+
+    @classmethod
+    def canonical_voucher_id(cls, voucher_id):
+        """The ID padded to ID_DIGITS, e.g. for a link to a live voucher from before IDs were widened"""
+        prefix, _, number = voucher_id.rpartition('-')
+        if not prefix or not number.isdigit():
+            return voucher_id
+        return f"{prefix}-{int(number):0{cls.ID_DIGITS}d}"
+
+    @classmethod
+    def reserve_voucher_ids(cls, voucher_type, date, count=1):
+        """Reserves a block of `count` voucher IDs in one atomic increment (for bulk inserts)"""
+        voucher_type, fiscal_year = cls.sequence_key(voucher_type, date)
+        first = VoucherSequence.reserve(voucher_type, count, fiscal_year)
+        return [cls.format_voucher_id(voucher_type, n, fiscal_year) for n in range(first, first + count)]
+
     def save(self, *args, **kwargs):
         # Generate custom Voucher ID on first save
         if not self.voucher_id:
-            with transaction.atomic():
-                last_voucher = Voucher.objects.filter(voucher_type=self.voucher_type).order_by('voucher_id').last()
-                if last_voucher:
-                    last_number = int(last_voucher.voucher_id.split('-')[-1])
-                    new_number = last_number + 1
-                else:
-                    new_number = 1
-                self.voucher_id = f"{self.voucher_type}-{new_number:05d}"
-
-        # Calculate total amount and amount in words
-        # Note: This is best done *after* items are saved. We'll call save() again from the view.
+            self.voucher_id = self.reserve_voucher_ids(self.voucher_type, self.date)[0]
+
+        # Amount in words follows the total, which services.create_voucher() sets before the first save
         if self.total_amount > 0:
-            rupees = int(self.total_amount)
-            paisas = int((self.total_amount - rupees) * 100)
-            words = f"{num2words(rupees, lang='en_IN').title()} Rupees"
-            if paisas > 0:
-                words += f" and {num2words(paisas, lang='en_IN').title()} Paisas"
-            else:
-                words += " only"
-            self.amount_in_words = words
+            self.amount_in_words = words.amount_in_words(self.total_amount)
 
         super().save(*args, **kwargs)
 
@@ -102,4 +208,130 @@ class Item(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
 
     def __str__(self):
-        return f"Item for {self.voucher.voucher_id} - {self.description}"
\ No newline at end of file
+        # voucher_id is the column on this row: self.voucher would load the voucher
+        return f"Item for {self.voucher_id} - {self.description}"
+
+# --- Previous/next links behind the arrows on the voucher page, kept up to date by navigation.py ---
+class VoucherNavigation(models.Model):
+    DATE = 'date'
+    TYPE = 'type'
+    SCOPE_CHOICES = [
+        (DATE, 'All vouchers by date'),
+        (TYPE, 'Same type by date'),
+    ]
+
+    voucher = models.ForeignKey(Voucher, related_name='navigation', on_delete=models.CASCADE)
+    scope = models.CharField(max_length=4, choices=SCOPE_CHOICES)
+    # Plain voucher IDs, so deleting a voucher doesn't cascade into its neighbours' rows
+    prev_id = models.CharField(max_length=20, null=True, blank=True)
+    next_id = models.CharField(max_length=20, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['voucher', 'scope'], name='unique_voucher_navigation'),
+        ]
+
+    def __str__(self):
+        return f"{self.voucher_id} ({self.scope}): {self.prev_id} <- -> {self.next_id}"
+
+# --- Queue of PDF renders handed off to the background worker (manage.py run_pdf_worker) ---
+class PdfRenderJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    voucher = models.ForeignKey(Voucher, related_name='pdf_jobs', on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    # Site root the logo is fetched from, captured from the request that queued the job
+    base_url = models.CharField(max_length=255)
+    cache_key = models.CharField(max_length=64, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='pdf_job_status_idx'),
+        ]
+
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def __str__(self):
+        return f"PDF of {self.voucher_id} ({self.status})"
+
+
+# --- Progress of a bulk import (manage.py import_vouchers), committed with each batch so it can resume ---
+class ImportCheckpoint(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    # SHA-256 of the file the records were read from; only the same file can resume from here
+    fingerprint = models.CharField(max_length=64, blank=True)
+    # Voucher records read so far (imported or rejected); a resumed import skips this many
+    position = models.PositiveIntegerField(default=0)
+    imported = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+
+# --- A run of manage.py reconcile_vouchers that repaired what it found; the next incremental run starts from it ---
+class ReconcileRun(models.Model):
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(auto_now_add=True)
+    # Only the vouchers changed since the run before were checked
+    incremental = models.BooleanField(default=False)
+    checked = models.PositiveIntegerField(default=0)
+    repaired = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Reconciled {self.checked} vouchers at {self.started_at:%Y-%m-%d %H:%M}"
+
+
+# --- Reporting rollups, updated in the transaction that writes the vouchers (reports.py, signals.py) ---
+class AccountDailySummary(models.Model):
+    account = models.CharField(max_length=100)
+    date = models.DateField()
+    voucher_type = models.CharField(max_length=3, choices=Voucher.VOUCHER_TYPE_CHOICES)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    item_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'date', 'voucher_type'], name='unique_account_daily_summary'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='account_summary_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.account} {self.date} {self.voucher_type}: {self.total}"
+
+
+class PayeeMonthlySummary(models.Model):
+    payee = models.CharField(max_length=255)
+    # First day of the month
+    month = models.DateField()
+    voucher_type = models.CharField(max_length=3, choices=Voucher.VOUCHER_TYPE_CHOICES)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    voucher_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['payee', 'month', 'voucher_type'], name='unique_payee_monthly_summary'),
+        ]
+        indexes = [
+            models.Index(fields=['month'], name='payee_summary_month_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.payee} {self.month:%Y-%m} {self.voucher_type}: {self.total}"
@@ -0,0 +1,225 @@
+# vouchers/navigation.py
+"""
+Stored previous/next links for the arrows on the voucher page.
+
+VoucherNavigation holds, for every voucher and scope, the IDs of the vouchers
+just before and after it by (date, voucher_id): the 'date' scope runs through
+all vouchers, 'type' through those of the same voucher type. The detail view
+reads the links together with the voucher, so drawing the arrows costs no
+queries of its own.
+
+The links are kept up to date on write. link() finds the vouchers either side
+of the new ones and rewrites only the links that change, so adding a voucher
+costs one read and two or three writes however many vouchers there are.
+signals.py links vouchers saved through the ORM (and moves them if their date or
+type is edited) and joins up the neighbours of deleted ones;
+services.bulk_create_vouchers() links its batches. Anything else (raw SQL) is
+put right by `manage.py rebuild_navigation`.
+"""
+from collections import namedtuple
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import OuterRef, Q, Subquery
+
+from . import locking
+from .models import Voucher, VoucherNavigation
+
+BATCH_SIZE = 5000
+# Scope -> the field vouchers must share to be in the same chain (None: one chain of all vouchers)
+SCOPES = {
+    VoucherNavigation.DATE: None,
+    VoucherNavigation.TYPE: 'voucher_type',
+}
+DATE_FIELD = Voucher._meta.get_field('date')
+# A VoucherNavigation row as link() and unlink() write it, without building model instances
+Link = namedtuple('Link', ['voucher_id', 'scope', 'prev_id', 'next_id'], defaults=[None, None])
+
+
+def default_scope():
+    return getattr(settings, 'VOUCHER_NAVIGATION_SCOPE', VoucherNavigation.DATE)
+
+
+def entry(voucher):
+    """The (voucher_id, voucher_type, date) that link() takes for a saved voucher"""
+    # A voucher saved with the default date still holds a datetime
+    return voucher.voucher_id, voucher.voucher_type, DATE_FIELD.to_python(voucher.date)
+
+
+def _before(date, voucher_id, inclusive=False):
+    """Vouchers ordered before (date, voucher_id)"""
+    same_date = Q(voucher_id__lte=voucher_id) if inclusive else Q(voucher_id__lt=voucher_id)
+    # `date <= d` on its own, so the database can seek the (date, voucher_id) indexes instead of scanning them
+    return Q(date__lte=date) & (Q(date__lt=date) | same_date)
+
+
+def _after(date, voucher_id, inclusive=False):
+    """Vouchers ordered after (date, voucher_id)"""
+    same_date = Q(voucher_id__gte=voucher_id) if inclusive else Q(voucher_id__gt=voucher_id)
+    return Q(date__gte=date) & (Q(date__gt=date) | same_date)
+
+
+def _neighbour(scope, newer):
+    """Subquery for the ID of the voucher just before (newer=False) or after an outer voucher in `scope`"""
+    partition = SCOPES[scope]
+    vouchers = Voucher.objects.all()
+    if partition:
+        vouchers = vouchers.filter(**{partition: OuterRef(partition)})
+    if newer:
+        vouchers = vouchers.filter(_after(OuterRef('date'), OuterRef('voucher_id'))).order_by('date', 'voucher_id')
+    else:
+        vouchers = vouchers.filter(_before(OuterRef('date'), OuterRef('voucher_id'))).order_by('-date', '-voucher_id')
+    return Subquery(vouchers.values('voucher_id')[:1])
+
+
+def _groups(entries):
+    """{(scope, partition value): entries of that chain, in order}"""
+    groups = {}
+    for voucher_id, voucher_type, date in sorted(entries, key=lambda e: (e[2], e[0])):
+        fields = {'voucher_type': voucher_type}
+        for scope, partition in SCOPES.items():
+            groups.setdefault((scope, fields.get(partition)), []).append((voucher_id, date))
+    return groups
+
+
+def link(entries):
+    """
+    Adds saved vouchers, given as entry() tuples, to every chain. Between the
+    vouchers either side of the new ones only links to or from a new voucher
+    change: two old vouchers next to each other were linked already.
+    """
+    # The neighbours are read and relinked under the write lock, so another writer can't link to them in between
+    with locking.write_transaction():
+        _link(list(entries))
+
+
+def _link(entries):
+    groups = _groups(entries)
+    if not groups:
+        return
+    new_ids = {voucher_id for voucher_id, _, _ in entries}
+
+    # The old vouchers just outside each run of new ones, for every chain in one query
+    ends = {voucher_id for group in groups.values() for voucher_id in (group[0][0], group[-1][0])}
+    annotations = {}
+    for scope in SCOPES:
+        annotations[f'{scope}_before'] = _neighbour(scope, newer=False)
+        annotations[f'{scope}_after'] = _neighbour(scope, newer=True)
+    bounds = {
+        row['voucher_id']: row
+        for row in Voucher.objects.filter(pk__in=ends).annotate(**annotations).values('voucher_id', *annotations)
+    }
+
+    rows, next_links, prev_links = {}, [], []
+    for (scope, value), group in groups.items():
+        (first_id, first_date), (last_id, last_date) = group[0], group[-1]
+        if len(group) == 1:
+            run = [first_id]
+        else:
+            # Old vouchers can sit between the new ones
+            vouchers = Voucher.objects.filter(_after(first_date, first_id, inclusive=True))
+            vouchers = vouchers.filter(_before(last_date, last_id, inclusive=True))
+            if SCOPES[scope]:
+                vouchers = vouchers.filter(**{SCOPES[scope]: value})
+            run = list(vouchers.order_by('date', 'voucher_id').values_list('voucher_id', flat=True))
+        chain = [bounds[first_id][f'{scope}_before'], *run, bounds[last_id][f'{scope}_after']]
+        for position in range(1, len(chain) - 1):
+            prev_id, voucher_id, next_id = chain[position - 1:position + 2]
+            if voucher_id in new_ids:
+                rows[(voucher_id, scope)] = Link(voucher_id=voucher_id, scope=scope, prev_id=prev_id, next_id=next_id)
+                if prev_id is not None and prev_id not in new_ids:
+                    next_links.append(Link(voucher_id=prev_id, scope=scope, next_id=voucher_id))
+                if next_id is not None and next_id not in new_ids:
+                    prev_links.append(Link(voucher_id=next_id, scope=scope, prev_id=voucher_id))
+
+    _save(rows.values(), ['prev_id', 'next_id'])
+    _save(next_links, ['next_id'])
+    _save(prev_links, ['prev_id'])
+
+
+def _save(links, fields):
+    """
+    Inserts the Links, or on an existing (voucher, scope) row sets just `fields`.
+    One INSERT ... ON CONFLICT DO UPDATE run by executemany, like reports._add():
+    on an import, bulk_create took longer building instances and SQL than the writes.
+    """
+    if not links:
+        return
+    connection = connections[router.db_for_write(VoucherNavigation)]
+    quote = connection.ops.quote_name
+    column = {name: quote(VoucherNavigation._meta.get_field(name).column) for name in ['voucher', *Link._fields[1:]]}
+    columns = list(column.values())
+    sql = 'INSERT INTO {} ({}) VALUES ({}) ON CONFLICT ({}) DO UPDATE SET {}'.format(
+        quote(VoucherNavigation._meta.db_table),
+        ', '.join(columns),
+        ', '.join(['%s'] * len(columns)),
+        ', '.join(columns[:2]),
+        ', '.join(f'{column[name]} = excluded.{column[name]}' for name in fields),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, links)
+
+
+def unlink(voucher_ids):
+    """Takes vouchers out of every chain, linking up the vouchers either side of them"""
+    with locking.write_transaction():
+        _unlink(voucher_ids)
+
+
+def _unlink(voucher_ids):
+    rows = VoucherNavigation.objects.filter(voucher_id__in=voucher_ids)
+    removed = {(row.voucher_id, row.scope): row for row in rows}
+    next_links, prev_links = [], []
+    for (voucher_id, scope), row in removed.items():
+        prev_id, next_id = row.prev_id, row.next_id
+        # Skip over removed vouchers next to this one; the end vouchers of a removed run link to each other
+        while (prev_id, scope) in removed:
+            prev_id = removed[(prev_id, scope)].prev_id
+        while (next_id, scope) in removed:
+            next_id = removed[(next_id, scope)].next_id
+        if prev_id is not None and (row.prev_id, scope) not in removed:
+            next_links.append(Link(voucher_id=prev_id, scope=scope, next_id=next_id))
+        if next_id is not None and (row.next_id, scope) not in removed:
+            prev_links.append(Link(voucher_id=next_id, scope=scope, prev_id=prev_id))
+    rows.delete()
+    _save(next_links, ['next_id'])
+    _save(prev_links, ['prev_id'])
+
+
+def relink(voucher):
+    """Moves an edited voucher to where its date and type now put it"""
+    with locking.write_transaction():
+        _unlink([voucher.voucher_id])
+        _link([entry(voucher)])
+
+
+def rebuild():
+    """Replaces every link with ones recomputed from the vouchers; returns the number of rows written"""
+    written = 0
+    with transaction.atomic():
+        VoucherNavigation.objects.all().delete()
+        for scope, partition in SCOPES.items():
+            fields = [partition] if partition else []
+            vouchers = Voucher.objects.order_by(*fields, 'date', 'voucher_id').values_list(*fields, 'voucher_id')
+            rows = _chain_rows(scope, vouchers.iterator(chunk_size=BATCH_SIZE))
+            while batch := list(islice(rows, BATCH_SIZE)):
+                VoucherNavigation.objects.bulk_create(batch)
+                written += len(batch)
+    return written
+
+
+def _chain_rows(scope, vouchers):
+    """VoucherNavigation rows for (*partition values, voucher_id) tuples sorted into chain order"""
+    previous = current = None
+    for values in vouchers:
+        chain, voucher_id = values[:-1], values[-1]
+        if current is not None:
+            same_chain = current[0] == chain
+            yield VoucherNavigation(
+                voucher_id=current[1], scope=scope, prev_id=previous, next_id=voucher_id if same_chain else None,
+            )
+            previous = current[1] if same_chain else None
+        current = (chain, voucher_id)
+    if current is not None:
+        yield VoucherNavigation(voucher_id=current[1], scope=scope, prev_id=previous, next_id=None)
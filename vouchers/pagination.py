@@ -0,0 +1,115 @@
+# vouchers/pagination.py
+"""
+Keyset ("seek") pagination for the voucher list.
+
+Pages are addressed by an opaque cursor holding the (date, voucher_id) of the
+row at the edge of the current page, so every page is a single indexed range
+query instead of COUNT(*) plus a growing OFFSET.
+"""
+import base64
+import datetime
+
+from django.db.models import Q, Sum
+
+from .models import VoucherSequence
+
+
+def encode_cursor(voucher):
+    raw = f"{voucher.date.isoformat()}|{voucher.voucher_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Returns (date, voucher_id) from a cursor, or None if it is missing or malformed"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        date, voucher_id = raw.split('|', 1)
+        return datetime.date.fromisoformat(date), voucher_id
+    except ValueError:
+        return None
+
+
+def approximate_count(voucher_type=None):
+    """Number of voucher IDs ever issued (of one type), read from the sequence table (deleted vouchers still count)"""
+    return _sequences(voucher_type).aggregate(total=Sum('last_number'))['total'] or 0
+
+
+async def aapproximate_count(voucher_type=None):
+    """approximate_count() with the async ORM"""
+    return (await _sequences(voucher_type).aaggregate(total=Sum('last_number')))['total'] or 0
+
+
+def _sequences(voucher_type):
+    sequences = VoucherSequence.objects.all()
+    if voucher_type:
+        sequences = sequences.filter(voucher_type=voucher_type)
+    return sequences
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def keyset_page(queryset, after=None, before=None, per_page=10):
+    """
+    Returns a KeysetPage of `queryset` ordered newest first by (date, voucher_id).
+    `after` pages forward from a row, `before` pages back towards the newest rows.
+    One extra row is fetched to know whether another page exists.
+    """
+    rows, backwards, forwards = _keyset_query(queryset, after, before, per_page)
+    return _keyset_result(list(rows), backwards, forwards, per_page)
+
+
+async def akeyset_page(queryset, after=None, before=None, per_page=10):
+    """keyset_page() with the async ORM"""
+    rows, backwards, forwards = _keyset_query(queryset, after, before, per_page)
+    return _keyset_result([row async for row in rows], backwards, forwards, per_page)
+
+
+def _keyset_query(queryset, after, before, per_page):
+    """(the rows to fetch for a page, whether they run backwards, whether the page comes after another)"""
+    after, before = decode_cursor(after), decode_cursor(before)
+
+    if before:
+        date, voucher_id = before
+        rows = (
+            queryset.filter(Q(date__gt=date) | Q(date=date, voucher_id__gt=voucher_id))
+            .order_by('date', 'voucher_id')[:per_page + 1]
+        )
+        return rows, True, False
+
+    if after:
+        date, voucher_id = after
+        queryset = queryset.filter(Q(date__lt=date) | Q(date=date, voucher_id__lt=voucher_id))
+    return queryset.order_by('-date', '-voucher_id')[:per_page + 1], False, bool(after)
+
+
+def _keyset_result(rows, backwards, forwards, per_page):
+    more = len(rows) > per_page
+    if backwards:
+        rows = rows[:per_page][::-1]
+        next_cursor = encode_cursor(rows[-1]) if rows else None
+        previous_cursor = encode_cursor(rows[0]) if rows and more else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    rows = rows[:per_page]
+    next_cursor = encode_cursor(rows[-1]) if rows and more else None
+    previous_cursor = encode_cursor(rows[0]) if rows and forwards else None
+    return KeysetPage(rows, next_cursor, previous_cursor)
@@ -0,0 +1,48 @@
+# vouchers/pdf.py
+import os
+from contextlib import ExitStack
+from itertools import islice
+
+from django.template.loader import render_to_string
+
+from . import renderer
+
+PRINT_TEMPLATE = 'vouchers/voucher_print_template.html'
+BATCH_PRINT_TEMPLATE = 'vouchers/voucher_batch_print.html'
+PRINT_PARTIALS = [
+    'vouchers/partials/voucher_print_page.html',
+]
+# Static files that end up in the PDF; a change to any of them changes every PDF
+PRINT_ASSETS = [renderer.STYLESHEET, 'images/logo.png']
+
+
+def pdf_filename(voucher):
+    return f"{voucher.voucher_id}_{voucher.date}.pdf"
+
+
+def render_voucher_html(voucher):
+    return render_to_string(PRINT_TEMPLATE, {'voucher': voucher})
+
+
+def render_voucher_pdf(voucher, base_url):
+    """Renders a typed voucher (see Voucher.get_child_instance) to PDF bytes"""
+    # The base_url is crucial for finding the logo image.
+    return renderer.write_pdf(render_voucher_html(voucher), base_url)
+
+
+def render_batch_pdf(vouchers, base_url, target, chunk_size=200):
+    """
+    Renders typed vouchers into one PDF written to `target` (a path or file object), one voucher per page.
+    `vouchers` can be a generator. Every `chunk_size` of them are laid out as one document and joined to
+    the ones before (pdf_merge.py), so memory doesn't grow with the number of vouchers.
+    """
+    from .pdf_merge import PdfMerger
+
+    vouchers = iter(vouchers)
+    with ExitStack() as stack:
+        if isinstance(target, (str, os.PathLike)):
+            target = stack.enter_context(open(target, 'wb'))
+        merger = PdfMerger(target)
+        while chunk := list(islice(vouchers, chunk_size)):
+            merger.append(renderer.write_pdf(render_to_string(BATCH_PRINT_TEMPLATE, {'vouchers': chunk}), base_url))
+        merger.close()
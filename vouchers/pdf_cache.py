@@ -0,0 +1,146 @@
+# vouchers/pdf_cache.py
+"""
+On-disk cache of rendered voucher PDFs.
+
+Files are named <voucher_id>-<content key>.pdf, where the key hashes everything
+that ends up on the page: the voucher and child fields, its items, and the
+print template and static assets it uses. Editing a voucher therefore gives it
+a new key on its own; the signal handlers only clean up the files left behind.
+Once the directory grows past VOUCHER_PDF_CACHE_MAX_BYTES the least recently
+served files are deleted first. Sizing the directory means listing it, so a
+process only does that every VOUCHER_PDF_CACHE_EVICT_EVERY files it writes;
+in between the cache can run over by that many files.
+"""
+import hashlib
+import itertools
+import os
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.template.loader import get_template
+
+from .models import Voucher
+from .pdf import PRINT_TEMPLATE, PRINT_PARTIALS, PRINT_ASSETS, render_voucher_pdf
+
+
+# Files written by this process; next() on a count is atomic, so threads don't need a lock
+_puts = itertools.count(1)
+
+
+def cache_dir():
+    """Returns the cache directory, or None when caching is switched off"""
+    directory = getattr(settings, 'VOUCHER_PDF_CACHE_DIR', None)
+    return Path(directory) if directory else None
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return f"{path}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+@lru_cache(maxsize=16)
+def _hash_files(signatures):
+    digest = hashlib.sha256()
+    for signature in signatures:
+        digest.update(signature.encode())
+        with open(signature.rsplit(':', 2)[0], 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def template_version():
+    """Hash of the print templates and their assets; only re-read when one of them changes on disk"""
+    paths = [get_template(name).origin.name for name in [PRINT_TEMPLATE] + PRINT_PARTIALS]
+    paths += [finders.find(asset) for asset in PRINT_ASSETS]
+    signatures = tuple(_file_signature(path) for path in paths if path)
+    return _hash_files(signatures) + str(getattr(settings, 'VOUCHER_PDF_CACHE_VERSION', ''))
+
+
+def content_key(voucher):
+    """Key for a typed voucher loaded with Voucher.objects.with_details()"""
+    digest = hashlib.sha256(template_version().encode())
+    for field in voucher._meta.concrete_fields:
+        digest.update(f"{field.attname}={field.value_to_string(voucher)}\x1f".encode())
+    for item in voucher.items.all():
+        digest.update(f"{item.pk}|{item.account}|{item.description}|{item.amount}\x1e".encode())
+    return digest.hexdigest()[:32]
+
+
+def _path(voucher_id, key):
+    return cache_dir() / f"{voucher_id}-{key}.pdf"
+
+
+def get(voucher_id, key):
+    """Returns cached PDF bytes, or None on a miss"""
+    path = _path(voucher_id, key)
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    # Bump the mtime so eviction sees this file as recently used
+    os.utime(path)
+    return data
+
+
+def put(voucher_id, key, data):
+    directory = cache_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    # Write to a temp file and rename, so readers never see a half-written PDF
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, _path(voucher_id, key))
+    if next(_puts) % max(getattr(settings, 'VOUCHER_PDF_CACHE_EVICT_EVERY', 50), 1) == 0:
+        evict()
+
+
+def invalidate(voucher_id):
+    """Deletes every cached PDF of a voucher"""
+    directory = cache_dir()
+    if directory is None or not directory.exists():
+        return
+    for path in directory.glob(f"{voucher_id}-*.pdf"):
+        path.unlink(missing_ok=True)
+
+
+def evict():
+    """Deletes the least recently used files until the cache fits in VOUCHER_PDF_CACHE_MAX_BYTES"""
+    max_bytes = getattr(settings, 'VOUCHER_PDF_CACHE_MAX_BYTES', 200 * 1024 * 1024)
+    entries = []
+    for path in cache_dir().glob('*.pdf'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def get_or_render(voucher, base_url, key=None):
+    """Returns the PDF bytes of a typed voucher, rendering and storing them on a miss"""
+    if cache_dir() is None:
+        return render_voucher_pdf(voucher, base_url)
+    key = key or content_key(voucher)
+    data = get(voucher.voucher_id, key)
+    if data is None:
+        data = render_voucher_pdf(voucher, base_url)
+        put(voucher.voucher_id, key, data)
+    return data
+
+
+def warm(voucher_id):
+    """Renders a voucher into the cache ahead of the first download (needs VOUCHER_PDF_BASE_URL)"""
+    base_url = getattr(settings, 'VOUCHER_PDF_BASE_URL', None)
+    if cache_dir() is None or not base_url:
+        return
+    voucher = Voucher.objects.with_details().filter(pk=voucher_id).first()
+    if voucher is not None:
+        get_or_render(voucher.get_child_instance(), base_url)
@@ -0,0 +1,124 @@
+# vouchers/pdf_jobs.py
+"""
+Background PDF rendering.
+
+Requests add a PdfRenderJob row instead of running WeasyPrint themselves, and
+`manage.py run_pdf_worker` claims queued rows and renders them on a local
+process pool. The database is the queue and the PDF cache holds the results,
+so no message broker is needed.
+"""
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import timedelta
+
+from django import db
+from django.conf import settings
+from django.utils import timezone
+
+from . import locking, pdf_cache, renderer
+from .models import Voucher, PdfRenderJob
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = [PdfRenderJob.QUEUED, PdfRenderJob.RUNNING]
+
+
+class QueueFull(Exception):
+    """Raised when VOUCHER_PDF_QUEUE_LIMIT jobs are already waiting or running"""
+
+
+def async_enabled():
+    return getattr(settings, 'VOUCHER_PDF_ASYNC', False) and pdf_cache.cache_dir() is not None
+
+
+def enqueue(voucher_id, base_url):
+    """Returns the unfinished job for a voucher, or queues a new one"""
+    # Under the write lock, so concurrent requests can't both pass the check and queue past the limit
+    with locking.write_transaction():
+        job = PdfRenderJob.objects.filter(voucher_id=voucher_id, status__in=ACTIVE_STATUSES).first()
+        if job is not None:
+            return job
+        limit = getattr(settings, 'VOUCHER_PDF_QUEUE_LIMIT', 100)
+        if PdfRenderJob.objects.filter(status__in=ACTIVE_STATUSES).count() >= limit:
+            raise QueueFull()
+        return PdfRenderJob.objects.create(voucher_id=voucher_id, base_url=base_url)
+
+
+def queue_position(job):
+    """Number of queued jobs ahead of this one (0 once it is running or finished)"""
+    if job.status != PdfRenderJob.QUEUED:
+        return 0
+    return PdfRenderJob.objects.filter(status=PdfRenderJob.QUEUED, created_at__lt=job.created_at).count()
+
+
+def _init_process():
+    # Connections inherited from the parent process must not be shared across the fork
+    db.connections.close_all()
+    # Pool processes exist to render, so load the engine before the first job arrives
+    renderer.preload()
+
+
+def render_job(job_id):
+    """Runs in a pool process: renders one job into the PDF cache and returns its key"""
+    job = PdfRenderJob.objects.get(pk=job_id)
+    voucher = Voucher.objects.with_details().get(pk=job.voucher_id).get_child_instance()
+    key = pdf_cache.content_key(voucher)
+    pdf_cache.get_or_render(voucher, job.base_url, key=key)
+    return key
+
+
+class Worker:
+    def __init__(self, concurrency=2, poll_interval=1.0, stale_after=timedelta(minutes=10)):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.running = {}
+
+    def requeue_stale(self):
+        """Puts jobs back in the queue whose worker died while rendering them"""
+        cutoff = timezone.now() - self.stale_after
+        PdfRenderJob.objects.filter(status=PdfRenderJob.RUNNING, started_at__lt=cutoff).update(
+            status=PdfRenderJob.QUEUED, started_at=None
+        )
+
+    def claim(self, limit):
+        """Marks up to `limit` queued jobs as running; the conditional UPDATE keeps two workers off the same job"""
+        claimed = []
+        queued = PdfRenderJob.objects.filter(status=PdfRenderJob.QUEUED).order_by('created_at')
+        for job_id in queued.values_list('pk', flat=True)[:limit]:
+            if PdfRenderJob.objects.filter(pk=job_id, status=PdfRenderJob.QUEUED).update(
+                status=PdfRenderJob.RUNNING, started_at=timezone.now()
+            ):
+                claimed.append(job_id)
+        return claimed
+
+    def finish(self, job_id, future):
+        fields = {'finished_at': timezone.now()}
+        try:
+            fields.update(status=PdfRenderJob.DONE, cache_key=future.result())
+        except Exception as e:
+            logger.exception("Rendering PDF job %s failed", job_id)
+            fields.update(status=PdfRenderJob.FAILED, error=str(e))
+        PdfRenderJob.objects.filter(pk=job_id).update(**fields)
+
+    def run(self, once=False):
+        self.requeue_stale()
+        # Children must not inherit the parent's open SQLite connection
+        db.connections.close_all()
+        # Forked children start with Django set up; spawned ones (the default on macOS, and on Linux from
+        # Python 3.14) would import this module before the app registry is ready
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=self.concurrency, mp_context=context, initializer=_init_process) as pool:
+            while True:
+                for job_id in self.claim(self.concurrency - len(self.running)):
+                    self.running[pool.submit(render_job, job_id)] = job_id
+                if once and not self.running:
+                    return
+                if self.running:
+                    done, _ = wait(self.running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.finish(self.running.pop(future), future)
+                else:
+                    time.sleep(self.poll_interval)
@@ -0,0 +1,111 @@
+# vouchers/pdf_merge.py
+"""
+Joining PDFs page by page into one file without holding them in memory.
+
+Batch printing renders a few hundred vouchers per WeasyPrint document, so the
+layout of a whole print run is never in memory at once, and the documents are
+joined here. PdfMerger writes the objects of each appended PDF's pages
+(content streams, fonts, images) to the output as soon as it is given them,
+renumbered after the ones before; all it keeps is each object's offset for the
+cross-reference table and the list of pages. Catalog entries of the parts
+(outlines, named destinations, metadata) are not carried over: voucher PDFs
+have none that matter.
+
+The parts are read with pypdf. pdf.py imports this module only when a batch is
+printed, so nothing else loads pypdf.
+"""
+import gc
+from io import BytesIO
+
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, StreamObject
+
+PAGES_NUMBER, CATALOG_NUMBER = 1, 2
+
+
+def _reference(number):
+    return IndirectObject(number, 0, None)
+
+
+class PdfMerger:
+    def __init__(self, target):
+        """`target` is a binary file object opened for writing"""
+        self.target = target
+        self.start = target.tell()
+        self.offsets = {}  # object number -> offset from the start of the file
+        self.kids = []  # object numbers of the pages, in order
+        self.next_number = CATALOG_NUMBER + 1
+        # The second line marks the file as binary, as the PDF spec recommends
+        target.write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+
+    def append(self, data):
+        """Adds the pages of a PDF (bytes) after those appended before"""
+        reader = PdfReader(BytesIO(data))
+        numbers = {}  # object number in this part -> in the output
+        pending = []
+
+        def renumber(reference):
+            if reference.idnum not in numbers:
+                numbers[reference.idnum] = self.next_number
+                self.next_number += 1
+                pending.append(reference)
+            return _reference(numbers[reference.idnum])
+
+        # reader.pages carry the attributes they inherit from the part's page tree (resources, media box)
+        pages = {page.indirect_reference.idnum: page for page in reader.pages}
+        self.kids += [renumber(page.indirect_reference).idnum for page in pages.values()]
+        # Copying an object reaches the ones it refers to (fonts, images), which join the queue
+        while pending:
+            reference = pending.pop()
+            page = pages.get(reference.idnum)
+            copy = self._copy(reference.get_object() if page is None else page, renumber)
+            if page is not None:
+                copy[NameObject('/Parent')] = _reference(PAGES_NUMBER)
+            self._write(numbers[reference.idnum], copy)
+        # The reader's objects refer back to it, so only the cycle collector frees them; left to run
+        # when it would, a few parts' worth pile up in between
+        del reader, pages
+        gc.collect()
+
+    def close(self):
+        """Writes the page tree, catalog and cross-reference table that finish the file"""
+        self._write(PAGES_NUMBER, DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(_reference(number) for number in self.kids),
+            NameObject('/Count'): NumberObject(len(self.kids)),
+        }))
+        self._write(CATALOG_NUMBER, DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): _reference(PAGES_NUMBER),
+        }))
+        xref = self.target.tell() - self.start
+        lines = [f'xref\n0 {self.next_number}\n', '0000000000 65535 f \n']
+        lines += [f'{self.offsets[number]:010d} 00000 n \n' for number in range(1, self.next_number)]
+        lines.append(f'trailer\n<< /Size {self.next_number} /Root {CATALOG_NUMBER} 0 R >>\nstartxref\n{xref}\n%%EOF\n')
+        self.target.write(''.join(lines).encode('ascii'))
+
+    def _copy(self, obj, renumber):
+        """`obj` with its references renumbered; stream data is copied as it is, still encoded"""
+        if isinstance(obj, IndirectObject):
+            return renumber(obj)
+        if isinstance(obj, DictionaryObject):
+            # A page's /Parent is the part's page tree, which isn't copied: append() points it at the new one
+            items = [
+                (key, self._copy(value, renumber)) for key, value in obj.items()
+                if not (key == '/Parent' and obj.get('/Type') == '/Page')
+            ]
+            if isinstance(obj, StreamObject):
+                copy = obj.__class__()
+                copy._data = obj._data
+                copy.update(items)
+                return copy
+            return DictionaryObject(items)
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._copy(value, renumber) for value in obj)
+        return obj
+
+    def _write(self, number, obj):
+        self.offsets[number] = self.target.tell() - self.start
+        self.target.write(f'{number} 0 obj\n'.encode('ascii'))
+        obj.write_to_stream(self.target)
+        self.target.write(b'\nendobj\n')
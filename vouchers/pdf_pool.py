@@ -0,0 +1,82 @@
+# vouchers/pdf_pool.py
+"""
+A bounded thread pool for the PDFs the async views render.
+
+Under ASGI the pages are served from one event loop, and Django runs sync code
+on a shared pool of threads. A WeasyPrint render takes that thread for as long
+as it lays out the document, so a burst of PDF downloads would hold up list
+and detail pages queued behind it. The async PDF view hands renders to this
+pool instead: VOUCHER_PDF_RENDER_THREADS threads do nothing else, each with its
+own renderer.Renderer, and at most VOUCHER_PDF_RENDER_BACKLOG more renders wait
+for one. Past that run() raises Busy and the view answers 503, as it does when
+the background job queue is full.
+
+Renders are given vouchers already loaded with their items, so the pool
+threads never open database connections.
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+
+
+class Busy(Exception):
+    """Raised when every pool thread is rendering and VOUCHER_PDF_RENDER_BACKLOG renders are waiting"""
+
+
+_lock = threading.Lock()
+_executor = None
+_pending = 0  # renders running or waiting
+
+
+def threads():
+    return getattr(settings, 'VOUCHER_PDF_RENDER_THREADS', 2)
+
+
+def backlog():
+    return getattr(settings, 'VOUCHER_PDF_RENDER_BACKLOG', 8)
+
+
+def executor():
+    """The pool, started on first use"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=threads(), thread_name_prefix='vms-pdf')
+        return _executor
+
+
+def _release(future):
+    global _pending
+    with _lock:
+        _pending -= 1
+
+
+async def run(func, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) on the pool and returns its result; raises Busy
+    if the backlog is full. A render keeps its place until it finishes, even if
+    the request waiting for it is cancelled.
+    """
+    global _pending
+    pool = executor()
+    with _lock:
+        if _pending >= threads() + backlog():
+            raise Busy()
+        _pending += 1
+    # The copied context carries the request's timings (performance.timed) over to the pool thread
+    future = pool.submit(contextvars.copy_context().run, partial(func, *args, **kwargs))
+    future.add_done_callback(_release)
+    return await asyncio.wrap_future(future)
+
+
+def shutdown():
+    """Waits for running renders and stops the pool; the next run() starts a new one"""
+    global _executor
+    with _lock:
+        pool, _executor = _executor, None
+    if pool is not None:
+        pool.shutdown(wait=True)
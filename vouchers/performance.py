@@ -0,0 +1,245 @@
+# vouchers/performance.py
+"""
+Per-request timing of SQL, template rendering and PDF rendering.
+
+PerformanceMiddleware times every request and splits the time into phases:
+SQL (every query, through an execute wrapper on each connection), template rendering
+(the TimedDjangoTemplates backend) and WeasyPrint (pdf.py). Each response gets
+a Server-Timing header, which browser dev tools show next to the request, and
+a key=value line is logged to 'vouchers.performance' (at WARNING for requests
+slower than VOUCHER_SLOW_REQUEST_MS, DEBUG otherwise). Durations also go into
+per-view histograms, served by views.metrics in Prometheus text format.
+
+The phases can overlap: a query run lazily from a template counts towards both
+SQL and template time. A streaming response is timed up to its first byte.
+Under ASGI the middleware runs async, and the timings follow the request's
+context into the ORM's threads and the PDF pool (pdf_pool.py).
+With VOUCHER_PERF_METRICS off the middleware takes itself out of the chain, and
+the template and PDF hooks cost one context variable lookup each.
+"""
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('total', 'sql', 'template', 'pdf')
+
+_current = contextvars.ContextVar('vouchers_request_timings', default=None)
+
+
+class RequestTimings:
+    """Seconds spent in each phase of one request, and the number of queries"""
+
+    def __init__(self):
+        self.total = self.sql = self.template = self.pdf = 0.0
+        self.queries = 0
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += time.perf_counter() - started
+            self.queries += 1
+
+    def server_timing(self):
+        """The Server-Timing header value (durations in milliseconds)"""
+        return ', '.join([
+            f'db;dur={self.sql * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template * 1000:.1f};desc="Templates"',
+            f'pdf;dur={self.pdf * 1000:.1f};desc="PDF rendering"',
+            f'total;dur={self.total * 1000:.1f}',
+        ])
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """Counts a query towards the request it runs for, if that request is being timed"""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings.execute_wrapper(execute, sql, params, many, context)
+
+
+def instrument(connection, **kwargs):
+    """Adds execute_wrapper to a connection, once; also a receiver of connection_created"""
+    if execute_wrapper not in connection.execute_wrappers:
+        # First, as connection.execute_wrapper() blocks take theirs off the end
+        connection.execute_wrappers.insert(0, execute_wrapper)
+
+
+@contextmanager
+def timed(phase):
+    """Adds the time spent in the block to `phase` of the current request; a no-op outside an instrumented request"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(timings, phase, getattr(timings, phase) + time.perf_counter() - started)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, with rendering time counted towards the current request"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+# --- Histograms of this process, exported by prometheus_text() ---
+
+class Histogram:
+    def __init__(self):
+        # One count per bucket plus the overflow (+Inf) bucket; made cumulative on export
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+
+_lock = threading.Lock()
+_histograms = {}  # (view, phase) -> Histogram
+_requests = {}  # (view, status) -> count
+_queries = {}  # view -> count
+
+
+def record(view, status, timings):
+    with _lock:
+        for phase in PHASES:
+            histogram = _histograms.get((view, phase))
+            if histogram is None:
+                histogram = _histograms[(view, phase)] = Histogram()
+            histogram.observe(getattr(timings, phase))
+        _requests[(view, status)] = _requests.get((view, status), 0) + 1
+        _queries[view] = _queries.get(view, 0) + timings.queries
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _requests.clear()
+        _queries.clear()
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text():
+    """All metrics recorded by this process, in the Prometheus text exposition format"""
+    with _lock:
+        histograms = {key: (list(histogram.counts), histogram.sum) for key, histogram in _histograms.items()}
+        requests = dict(_requests)
+        queries = dict(_queries)
+
+    lines = [
+        '# HELP vms_request_phase_seconds Time spent handling requests, by view and phase (total, sql, template, pdf).',
+        '# TYPE vms_request_phase_seconds histogram',
+    ]
+    for (view, phase), (counts, total) in sorted(histograms.items()):
+        labels = f'view="{_label(view)}",phase="{phase}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), counts):
+            cumulative += count
+            lines.append(f'vms_request_phase_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'vms_request_phase_seconds_sum{{{labels}}} {total}')
+        lines.append(f'vms_request_phase_seconds_count{{{labels}}} {cumulative}')
+    lines += ['# HELP vms_requests_total Requests handled, by view and status code.', '# TYPE vms_requests_total counter']
+    lines += [
+        f'vms_requests_total{{view="{_label(view)}",status="{status}"}} {count}'
+        for (view, status), count in sorted(requests.items())
+    ]
+    lines += ['# HELP vms_sql_queries_total SQL queries run, by view.', '# TYPE vms_sql_queries_total counter']
+    lines += [f'vms_sql_queries_total{{view="{_label(view)}"}} {count}' for view, count in sorted(queries.items())]
+    return '\n'.join(lines) + '\n'
+
+
+class PerformanceMiddleware:
+    """Put first in MIDDLEWARE, so the total includes the other middleware. Runs async under ASGI."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'VOUCHER_PERF_METRICS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        connection_created.connect(instrument)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        # Connections opened before the middleware was set up
+        for connection in connections.all():
+            instrument(connection)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        timings.total = time.perf_counter() - started
+        return self.report(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        timings.total = time.perf_counter() - started
+        return self.report(request, response, timings)
+
+    def report(self, request, response, timings):
+        match = request.resolver_match
+        # URL names keep the label set small; requests that resolved to no view share one label
+        if match:
+            view = match.view_name or f'{match.func.__module__}.{match.func.__qualname__}'
+        else:
+            view = 'unresolved'
+        record(view, response.status_code, timings)
+        response['Server-Timing'] = timings.server_timing()
+        slow = timings.total * 1000 >= getattr(settings, 'VOUCHER_SLOW_REQUEST_MS', 500)
+        logger.log(
+            logging.WARNING if slow else logging.DEBUG,
+            'view=%s method=%s status=%s total_ms=%.1f sql_ms=%.1f queries=%d template_ms=%.1f pdf_ms=%.1f',
+            view, request.method, response.status_code, timings.total * 1000, timings.sql * 1000,
+            timings.queries, timings.template * 1000, timings.pdf * 1000,
+            extra={
+                'view': view, 'method': request.method, 'status': response.status_code,
+                'total_ms': timings.total * 1000, 'sql_ms': timings.sql * 1000, 'queries': timings.queries,
+                'template_ms': timings.template * 1000, 'pdf_ms': timings.pdf * 1000,
+            },
+        )
+        return response
@@ -0,0 +1,135 @@
+# vouchers/reconcile.py
+"""
+Checking the stored total_amount and amount_in_words of vouchers against their items.
+
+Both are worked out when a voucher is created (services.py) and stored on it.
+Items changed afterwards (in the admin, by raw SQL) leave them as they were:
+the item signals only move the voucher's updated_at. check() goes through the
+vouchers in primary key order, BATCH_SIZE at a time, and compares each batch
+with one SUM(amount) ... GROUP BY voucher_id query over its items, so a million
+vouchers cost a few hundred indexed queries instead of one per voucher.
+
+repair() puts mismatches right with bulk_update, under the write lock and
+after checking them again there, since the check itself runs outside a
+transaction. Repaired vouchers get a new updated_at, so their pages, PDFs and
+the API change feed pick up the new amounts, and the payee summaries (which
+add up totals) move by the difference.
+
+`manage.py reconcile_vouchers` records each run that repairs as a
+ReconcileRun. An incremental run checks only the vouchers whose updated_at is
+after the previous run started (less OVERLAP), which takes in every item
+changed through the ORM; changes made by raw SQL need a full run.
+"""
+import datetime
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import locking, reports
+from .models import Voucher, Item, ReconcileRun
+from .words import amounts_in_words
+
+# Vouchers per query; the IDs of a batch go into one IN (...), under SQLite's old 999 parameter limit
+BATCH_SIZE = 900
+# updated_at is stamped before a write commits, so an incremental run looks back this far past the last run's start
+OVERLAP = datetime.timedelta(minutes=5)
+ZERO = Decimal('0.00')
+
+Mismatch = namedtuple('Mismatch', [
+    'voucher_id', 'voucher_type', 'date', 'payee', 'stored_total', 'stored_words', 'total', 'words',
+])
+
+
+def expected_words(totals):
+    """What amount_in_words should hold for each total: empty unless the total is above zero"""
+    return [words if total > 0 else '' for total, words in zip(totals, amounts_in_words(totals))]
+
+
+def _compare(rows):
+    """Mismatches among voucher rows (voucher_id, voucher_type, date, payee, total_amount, amount_in_words)"""
+    if not rows:
+        return []
+    sums = dict(
+        Item.objects.filter(voucher_id__in=[row[0] for row in rows])
+        .values('voucher_id').annotate(total=Sum('amount', output_field=reports.TOTAL_FIELD))
+        .order_by().values_list('voucher_id', 'total')
+    )
+    # SQLite's SUM drops trailing zeros
+    totals = [sums.get(row[0], ZERO).quantize(ZERO) for row in rows]
+    return [
+        Mismatch(*row, total, words)
+        for row, total, words in zip(rows, totals, expected_words(totals))
+        if (row[4], row[5]) != (total, words)
+    ]
+
+
+def _rows(vouchers):
+    return vouchers.values_list('voucher_id', 'voucher_type', 'date', 'payee', 'total_amount', 'amount_in_words')
+
+
+def check(since=None, batch_size=BATCH_SIZE):
+    """Yields (vouchers checked so far, mismatches) for each batch of vouchers: all of them, or those updated from `since`"""
+    vouchers = Voucher.objects.all()
+    if since is not None:
+        vouchers = vouchers.filter(updated_at__gte=since)
+    checked, last_id = 0, None
+    while True:
+        # Keyset batches: each query starts after the last ID of the one before, however far in it is
+        batch = vouchers.filter(pk__gt=last_id) if last_id is not None else vouchers
+        rows = list(_rows(batch.order_by('voucher_id'))[:batch_size])
+        if not rows:
+            return
+        checked += len(rows)
+        last_id = rows[-1][0]
+        yield checked, _compare(rows)
+
+
+def repair(voucher_ids):
+    """Writes the total and words of the vouchers where they still don't match their items; returns the mismatches fixed"""
+    with locking.write_transaction():
+        mismatches = _compare(list(_rows(Voucher.objects.filter(pk__in=voucher_ids))))
+        if not mismatches:
+            return []
+        now = timezone.now()
+        Voucher.objects.bulk_update(
+            [
+                Voucher(voucher_id=m.voucher_id, total_amount=m.total, amount_in_words=m.words, updated_at=now)
+                for m in mismatches
+            ],
+            ['total_amount', 'amount_in_words', 'updated_at'],
+        )
+        changed = [m for m in mismatches if m.stored_total != m.total]
+        # The payee summaries add up the stored totals: take the old ones out and put the new ones in
+        reports.record_vouchers([(m.voucher_type, m.date, m.payee, m.stored_total, []) for m in changed], sign=-1)
+        reports.record_vouchers([(m.voucher_type, m.date, m.payee, m.total, []) for m in changed])
+    return mismatches
+
+
+def last_run_start():
+    """When the last recorded run started, or None if there hasn't been one"""
+    return ReconcileRun.objects.order_by('-started_at').values_list('started_at', flat=True).first()
+
+
+def reconcile(incremental=False, dry_run=False, batch_size=BATCH_SIZE):
+    """
+    Checks the vouchers (with `incremental`, those changed since the last run)
+    and unless `dry_run` repairs them. Yields (checked so far, mismatches of
+    the batch) as it goes; a run that repairs is recorded when it finishes.
+    """
+    started_at = timezone.now()
+    since = None
+    if incremental:
+        last_start = last_run_start()
+        since = last_start - OVERLAP if last_start else None
+    checked = repaired = 0
+    for checked, mismatches in check(since, batch_size):
+        if mismatches and not dry_run:
+            mismatches = repair([m.voucher_id for m in mismatches])
+            repaired += len(mismatches)
+        yield checked, mismatches
+    if not dry_run:
+        ReconcileRun.objects.create(
+            started_at=started_at, incremental=since is not None, checked=checked, repaired=repaired,
+        )
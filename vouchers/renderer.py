@@ -0,0 +1,174 @@
+# vouchers/renderer.py
+"""
+The PDF engine (WeasyPrint), loaded on first use and set up once per thread.
+
+Importing WeasyPrint pulls in cffi bindings to Pango, HarfBuzz and fontconfig
+and a stack of Python packages, several hundred milliseconds before a single
+page is laid out. Nothing imports it at module level, so loading the URLconf,
+management commands and tests that never render a PDF don't pay for it.
+
+What every voucher PDF shares is prepared once and kept in a Renderer: the
+print stylesheet (static/css/voucher_print.css) parsed into a CSS object, the
+FontConfiguration that has already resolved its fonts, decoded images, and the
+static files the templates link to (the logo), which the url_fetcher serves
+from memory instead of fetching them over HTTP from the site itself. Each
+thread gets its own Renderer, as FontConfiguration is not thread-safe.
+
+Long-lived web workers can take the start-up cost before their first PDF
+request: with VOUCHER_PDF_PRELOAD on, VouchersConfig.ready() calls preload().
+The run_pdf_worker processes always preload. `manage.py benchmark_startup`
+and `benchmark_pdf` measure the difference.
+"""
+import mimetypes
+import os
+import posixpath
+import threading
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.exceptions import SuspiciousFileOperation
+from django.templatetags.static import static
+from django.utils._os import safe_join
+
+from .performance import timed
+
+# The print templates' stylesheet, applied by the renderer rather than linked from the HTML
+STYLESHEET = 'css/voucher_print.css'
+
+_local = threading.local()
+
+
+def engine():
+    """The weasyprint module, imported on the first call"""
+    import weasyprint
+    return weasyprint
+
+
+class StaticAssets:
+    """Static files read once and kept in memory; re-read when the file on disk changes"""
+
+    def __init__(self):
+        self._files = {}  # name -> (path, mtime_ns, bytes)
+
+    def get(self, name):
+        """Returns the bytes of a static file, or None if there is no such file"""
+        path = self.find(name)
+        if path is None:
+            return None
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._files.get(name)
+        if cached is None or cached[:2] != (path, mtime):
+            with open(path, 'rb') as f:
+                cached = self._files[name] = (path, mtime, f.read())
+        return cached[2]
+
+    @staticmethod
+    def find(name):
+        """
+        The path of a static file, including collected ones under hashed names
+        (images/logo.<hash>.png), or None: names outside the static directories
+        and directories are not static files.
+        """
+        try:
+            path = finders.find(name)
+            if path is None and settings.STATIC_ROOT:
+                path = safe_join(settings.STATIC_ROOT, name)
+        except SuspiciousFileOperation:
+            return None
+        return path if path and os.path.isfile(path) else None
+
+    def name_for_url(self, url):
+        """The static file name a URL points to (e.g. images/logo.png), or None if it is not under STATIC_URL"""
+        prefix = urlsplit(static('')).path
+        path = unquote(urlsplit(url).path)
+        if not path.startswith(prefix):
+            return None
+        name = posixpath.normpath(path[len(prefix):])
+        if name.startswith(('..', '/')):
+            return None
+        return name
+
+
+def url_fetcher(assets):
+    """A WeasyPrint url_fetcher that serves static files from `assets` and leaves other URLs to WeasyPrint"""
+    urls = engine().urls
+
+    def static_file(url):
+        """(bytes, content type) of the static file at `url`, or (None, None)"""
+        name = assets.name_for_url(url)
+        data = assets.get(name) if name else None
+        if data is None:
+            return None, None
+        return data, mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    if hasattr(urls, 'URLFetcher'):
+        # Newer WeasyPrint: fetchers are URLFetcher subclasses returning URLFetcherResponse
+        class StaticURLFetcher(urls.URLFetcher):
+            def fetch(self, url, headers=None):
+                data, content_type = static_file(url)
+                if data is None:
+                    return super().fetch(url, headers)
+                return urls.URLFetcherResponse(url, data, {'Content-Type': content_type})
+
+        return StaticURLFetcher()
+
+    def fetch(url):
+        data, content_type = static_file(url)
+        if data is None:
+            return urls.default_url_fetcher(url)
+        return {'string': data, 'mime_type': content_type, 'redirected_url': url}
+
+    return fetch
+
+
+class Renderer:
+    """Renders HTML to PDF with the stylesheet, fonts, images and static files prepared once"""
+
+    def __init__(self):
+        weasyprint = engine()
+        from weasyprint.text.fonts import FontConfiguration
+
+        self.assets = StaticAssets()
+        self.url_fetcher = url_fetcher(self.assets)
+        self.font_config = FontConfiguration()
+        # Decoded images, shared by every document this renderer writes
+        self.image_cache = {}
+        self._stylesheet = None
+        self._stylesheet_source = None
+        self.weasyprint = weasyprint
+
+    def stylesheet(self):
+        """The parsed print stylesheet; parsed again only if the file has changed"""
+        source = self.assets.get(STYLESHEET)
+        if source is not self._stylesheet_source:
+            self._stylesheet = self.weasyprint.CSS(
+                string=source.decode(), font_config=self.font_config, url_fetcher=self.url_fetcher,
+            )
+            self._stylesheet_source = source
+        return self._stylesheet
+
+    def write_pdf(self, html_string, base_url, target=None):
+        document = self.weasyprint.HTML(string=html_string, base_url=base_url, url_fetcher=self.url_fetcher)
+        return document.write_pdf(
+            target, stylesheets=[self.stylesheet()], font_config=self.font_config, cache=self.image_cache,
+        )
+
+
+def get_renderer():
+    """This thread's Renderer, created on first use"""
+    renderer = getattr(_local, 'renderer', None)
+    if renderer is None:
+        renderer = _local.renderer = Renderer()
+    return renderer
+
+
+def write_pdf(html_string, base_url, target=None):
+    """Renders an HTML string to PDF bytes, or into `target` (a path or file object) and returns None"""
+    with timed('pdf'):
+        return get_renderer().write_pdf(html_string, base_url, target)
+
+
+def preload():
+    """Sets up this thread's renderer and renders a throwaway page, so the first real PDF is as fast as the rest"""
+    get_renderer().write_pdf('<p>VMS</p>', None)
@@ -0,0 +1,251 @@
+# vouchers/reports.py
+"""
+Reporting from summary tables.
+
+AccountDailySummary (account x day x voucher type) and PayeeMonthlySummary
+(payee x month x voucher type) hold running totals. record_vouchers() adds to
+them in the transaction that creates the vouchers (services.bulk_create_vouchers),
+and signals.py keeps them in step with every voucher and item saved or deleted
+through the ORM: a new voucher is added, an edit that changes its date, payee,
+type or total moves it, and an item added, edited or deleted changes its
+account's row by the difference (record_items()). The reports below read only
+these tables, so what they cost depends on the period shown, not on how much
+history the ledger holds.
+
+Amounts changed in ways that send no signals (QuerySet.update(), bulk_create(),
+raw SQL) are found by `manage.py rebuild_summaries --verify` and put right by a
+rebuild.
+
+The rows of archived fiscal years (archive.py) stay here, so the reports cover
+them, but their vouchers are no longer in the live tables: they were checked
+when the year was archived, and rebuild() and verify() leave them alone.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncMonth
+
+from . import archive
+from .models import Voucher, Item, AccountDailySummary, PayeeMonthlySummary, fiscal_year_for
+
+BATCH_SIZE = 5000
+CENT = Decimal('0.01')
+# Payments debit the accounts on their items, receipts credit them
+DEBIT_TYPES = {'BPV', 'CPV'}
+CREDIT_TYPES = {'BRV', 'CRV'}
+
+DATE_FIELD = Voucher._meta.get_field('date')
+TOTAL_AMOUNT_FIELD = Voucher._meta.get_field('total_amount')
+# Room for sums of many amounts, which would overflow the fields being summed
+TOTAL_FIELD = DecimalField(max_digits=16, decimal_places=2)
+
+
+def voucher_entry(voucher, items=None):
+    """The (voucher_type, date, payee, total, [(account, amount)]) that record_vouchers() takes for a saved voucher"""
+    if items is None:
+        items = voucher.items.values_list('account', 'amount')
+    # total_amount is still the float default on a voucher that has never been reloaded
+    return voucher.voucher_type, voucher.date, voucher.payee, TOTAL_AMOUNT_FIELD.to_python(voucher.total_amount), items
+
+
+def record_vouchers(entries, sign=1):
+    """
+    Adds vouchers to the summaries (or, with sign=-1, takes them out). `entries`
+    are (voucher_type, date, payee, total, items) with items as (account, amount)
+    pairs. Rows are summed here first and then upserted with one statement per table.
+    """
+    accounts = defaultdict(lambda: [Decimal('0.00'), 0])
+    payees = defaultdict(lambda: [Decimal('0.00'), 0])
+    for voucher_type, date, payee, total, items in entries:
+        # A voucher saved with the default date still holds a datetime
+        date = DATE_FIELD.to_python(date)
+        row = payees[(payee, date.replace(day=1), voucher_type)]
+        row[0] += sign * total
+        row[1] += sign
+        for account, amount in items:
+            row = accounts[(account, date, voucher_type)]
+            row[0] += sign * amount
+            row[1] += sign
+    _add(AccountDailySummary, ['account', 'date', 'voucher_type'], ['total', 'item_count'], accounts)
+    _add(PayeeMonthlySummary, ['payee', 'month', 'voucher_type'], ['total', 'voucher_count'], payees)
+
+
+def record_items(added=(), removed=()):
+    """
+    Adds items to AccountDailySummary and takes others out, for the items of
+    vouchers already recorded. Items are (voucher_type, date, account, amount);
+    only the net difference is written, with one upsert.
+    """
+    accounts = defaultdict(lambda: [Decimal('0.00'), 0])
+    for items, sign in [(removed, -1), (added, 1)]:
+        for voucher_type, date, account, amount in items:
+            row = accounts[(account, DATE_FIELD.to_python(date), voucher_type)]
+            row[0] += sign * amount
+            row[1] += sign
+    # An item edited without changing its account or amount leaves nothing to write
+    changed = {key: row for key, row in accounts.items() if row != [0, 0]}
+    _add(AccountDailySummary, ['account', 'date', 'voucher_type'], ['total', 'item_count'], changed)
+
+
+def _add(model, key_fields, sum_fields, sums):
+    """INSERT ... ON CONFLICT DO UPDATE that adds `sums` ({key: [values]}) to the existing rows"""
+    if not sums:
+        return
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    fields = [model._meta.get_field(name) for name in key_fields + sum_fields]
+    columns = [quote(field.column) for field in fields]
+    sql = 'INSERT INTO {} ({}) VALUES ({}) ON CONFLICT ({}) DO UPDATE SET {}'.format(
+        table,
+        ', '.join(columns),
+        ', '.join(['%s'] * len(columns)),
+        ', '.join(columns[:len(key_fields)]),
+        ', '.join(f'{column} = {table}.{column} + excluded.{column}' for column in columns[len(key_fields):]),
+    )
+    # Keys and sums are plain str/date/Decimal/int values, which every backend adapts as they are
+    params = [[*key, *values] for key, values in sums.items()]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+# --- Recomputing the summaries from the vouchers and items (the slow way) ---
+
+def computed_account_rows(start=None):
+    """Per account, day and type from the items of vouchers dated from `start` (all of them if None)"""
+    items = Item.objects.filter(voucher__date__gte=start) if start else Item.objects.all()
+    return items.values(
+        'account', date=F('voucher__date'), voucher_type=F('voucher__voucher_type'),
+    ).annotate(total=Sum('amount', output_field=TOTAL_FIELD), item_count=Count('id')).order_by()
+
+
+def computed_payee_rows(start=None):
+    """Per payee, month and type from the vouchers dated from `start` (all of them if None)"""
+    vouchers = Voucher.objects.filter(date__gte=start) if start else Voucher.objects.all()
+    return vouchers.values(
+        'payee', 'voucher_type', month=TruncMonth('date'),
+    ).annotate(total=Sum('total_amount', output_field=TOTAL_FIELD), voucher_count=Count('voucher_id')).order_by()
+
+
+# (model, key fields with the date field second, summed fields, rows recomputed from the vouchers)
+SUMMARIES = [
+    (AccountDailySummary, ['account', 'date', 'voucher_type'], ['total', 'item_count'], computed_account_rows),
+    (PayeeMonthlySummary, ['payee', 'month', 'voucher_type'], ['total', 'voucher_count'], computed_payee_rows),
+]
+
+
+def rounded_rows(computed_rows, start=None):
+    """The rows of a computed_*_rows() function with totals rounded to cents; SQLite sums decimals as floats"""
+    for row in computed_rows(start).iterator(chunk_size=BATCH_SIZE):
+        row['total'] = row['total'].quantize(CENT)
+        yield row
+
+
+def stored_rows(model, date_field, start=None):
+    """The summary rows from `start` on; archived years start on the first of a month, so months never straddle it"""
+    return model.objects.filter(**{f'{date_field}__gte': start}) if start else model.objects.all()
+
+
+def rebuild():
+    """Replaces the summaries of the open years with totals recomputed from the vouchers; returns {model name: rows written}"""
+    written = {}
+    start = archive.open_from()
+    with transaction.atomic():
+        for model, key_fields, _, computed_rows in SUMMARIES:
+            stored_rows(model, key_fields[1], start).delete()
+            rows = rounded_rows(computed_rows, start)
+            written[model.__name__] = 0
+            while batch := list(islice(rows, BATCH_SIZE)):
+                model.objects.bulk_create(model(**row) for row in batch)
+                written[model.__name__] += len(batch)
+    return written
+
+
+def verify():
+    """
+    Compares the summaries of the open years with totals recomputed from the
+    vouchers. Returns a list of (model name, key, stored (total, count),
+    expected (total, count)) for every row that differs; rows whose vouchers
+    were all deleted count as zero.
+    """
+    zero = (Decimal('0.00'), 0)
+    problems = []
+    start = archive.open_from()
+    for model, key_fields, sum_fields, computed_rows in SUMMARIES:
+        stored = {
+            tuple(row[name] for name in key_fields): tuple(row[name] for name in sum_fields)
+            for row in stored_rows(model, key_fields[1], start).values(*key_fields, *sum_fields).iterator(chunk_size=BATCH_SIZE)
+        }
+        for row in rounded_rows(computed_rows, start):
+            key = tuple(row[name] for name in key_fields)
+            expected = tuple(row[name] for name in sum_fields)
+            actual = stored.pop(key, zero)
+            if actual != expected:
+                problems.append((model.__name__, key, actual, expected))
+        problems.extend((model.__name__, key, actual, zero) for key, actual in stored.items() if actual != zero)
+    return problems
+
+
+# --- Reports (summary tables only) ---
+
+def year_to_date(today=None):
+    """(first day of the current fiscal year, today)"""
+    today = today or datetime.date.today()
+    start_month = getattr(settings, 'VOUCHER_FISCAL_YEAR_START_MONTH', 7)
+    return datetime.date(fiscal_year_for(today), start_month, 1), today
+
+
+def trial_balance(start_date, end_date):
+    """
+    Per account, the debits (payment vouchers), credits (receipt vouchers) and
+    their difference between two dates, plus a totals row.
+    """
+    totals = (
+        AccountDailySummary.objects.filter(date__range=(start_date, end_date))
+        .values('account', 'voucher_type').annotate(total=Sum('total', output_field=TOTAL_FIELD), items=Sum('item_count'))
+        .filter(items__gt=0).order_by('account')
+    )
+    accounts = {}
+    for row in totals:
+        account = accounts.setdefault(row['account'], {
+            'account': row['account'], 'debit': Decimal('0.00'), 'credit': Decimal('0.00'),
+        })
+        if row['voucher_type'] in DEBIT_TYPES:
+            account['debit'] += row['total']
+        elif row['voucher_type'] in CREDIT_TYPES:
+            account['credit'] += row['total']
+    rows = list(accounts.values())
+    for row in rows:
+        row['balance'] = row['debit'] - row['credit']
+    debit = sum((row['debit'] for row in rows), Decimal('0.00'))
+    credit = sum((row['credit'] for row in rows), Decimal('0.00'))
+    return rows, {'debit': debit, 'credit': credit, 'balance': debit - credit}
+
+
+def period_totals(start_date, end_date, period='month'):
+    """Totals per day or month and voucher type: [(period start, {voucher_type: total}, total)]"""
+    summaries = AccountDailySummary.objects.filter(date__range=(start_date, end_date))
+    if period == 'month':
+        summaries = summaries.annotate(period=TruncMonth('date'))
+    else:
+        summaries = summaries.annotate(period=F('date'))
+    periods = {}
+    for row in summaries.values('period', 'voucher_type').annotate(total=Sum('total', output_field=TOTAL_FIELD)).order_by('period'):
+        periods.setdefault(row['period'], {})[row['voucher_type']] = row['total']
+    return [(start, by_type, sum(by_type.values(), Decimal('0.00'))) for start, by_type in periods.items()]
+
+
+def payee_totals(start_date, end_date, voucher_type=None, limit=100):
+    """The payees with the largest totals over the months from start_date to end_date"""
+    summaries = PayeeMonthlySummary.objects.filter(month__range=(start_date.replace(day=1), end_date))
+    if voucher_type:
+        summaries = summaries.filter(voucher_type=voucher_type)
+    return list(
+        summaries.values('payee').annotate(total=Sum('total', output_field=TOTAL_FIELD), voucher_count=Sum('voucher_count'))
+        .filter(voucher_count__gt=0).order_by('-total')[:limit]
+    )
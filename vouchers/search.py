@@ -0,0 +1,204 @@
+# vouchers/search.py
+"""
+Full-text search over vouchers and their items.
+
+On SQLite the text lives in the FTS5 table vouchers_search (see migration
+0006_search_index), kept in sync by triggers, so a query is an index lookup
+ranked with bm25. Bare words match as prefixes ("acme pay" finds "Acme Payroll"),
+"quoted text" matches as a phrase, and all terms must match. Other backends
+fall back to icontains filters, which scan the tables.
+
+Ranking is over the newest MAX_CANDIDATES matches only: a query that matches a
+large share of the ledger returns the best of its recent matches in a few
+milliseconds instead of scoring every row.
+
+Each archived fiscal year (archive.py) has an index of its own. Results come
+from the live index first and then from the archives, newest year first, until
+there are enough.
+"""
+import re
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from . import archive
+from .models import Voucher, Item
+
+SEARCH_TABLE = 'vouchers_search'
+# bm25 weights for voucher_id, payee, memo, prepared_by, items
+RANK_WEIGHTS = (10.0, 8.0, 2.0, 1.0, 4.0)
+MAX_RESULTS = 100
+MAX_CANDIDATES = 2000
+
+TERM = re.compile(r'"([^"]*)"?|(\S+)')
+WORD = re.compile(r'\w+')
+
+# Indexes the vouchers whose doc rows match the WHERE clause appended to it
+INDEX_SQL = """
+    INSERT INTO vouchers_search (rowid, voucher_id, payee, memo, prepared_by, items)
+    SELECT d.id, v.voucher_id, v.payee, coalesce(v.memo, ''), v.prepared_by,
+           coalesce((SELECT group_concat(i.account || ' ' || i.description, char(10))
+                     FROM vouchers_item i WHERE i.voucher_id = v.voucher_id), '')
+    FROM vouchers_search_doc d JOIN vouchers_voucher v ON v.voucher_id = d.voucher_id
+"""
+REBUILD_SQL = [
+    "DELETE FROM vouchers_search",
+    "DELETE FROM vouchers_search_doc",
+    "INSERT INTO vouchers_search_doc (voucher_id) SELECT voucher_id FROM vouchers_voucher ORDER BY voucher_id",
+    INDEX_SQL,
+    "INSERT INTO vouchers_search (vouchers_search) VALUES ('optimize')",
+]
+
+
+def available(using=DEFAULT_DB_ALIAS):
+    """True when the FTS5 index exists (SQLite with migration 0006 applied, or an archive)"""
+    database = connections[using]
+    return database.vendor == 'sqlite' and SEARCH_TABLE in database.introspection.table_names()
+
+
+def build_query(text):
+    """
+    Turns what a user typed into an FTS5 query, or '' if there is nothing to search for.
+    Every term is quoted, so FTS5 operators and column filters in the input are just text.
+    """
+    terms = []
+    for phrase, word in TERM.findall(text):
+        if phrase:
+            words = WORD.findall(phrase)
+            if words:
+                terms.append('"{}"'.format(' '.join(words)))
+        else:
+            # "BPV-00000012" is two tokens to FTS5, so it becomes the phrase "BPV 00000012", prefix-matched
+            words = WORD.findall(word)
+            if words:
+                terms.append('"{}"*'.format(' '.join(words)))
+    return ' '.join(terms)
+
+
+def _snippet(texts, words, width=80):
+    """
+    Returns an HTML excerpt of the first text that contains one of `words` (as a
+    word prefix), with the matches in <mark>. Done here rather than with FTS5's
+    snippet(), which expands prefix terms again for every row.
+    """
+    pattern = re.compile(r'\b(?:{})\w*'.format('|'.join(re.escape(word) for word in words)), re.IGNORECASE)
+    for text in texts:
+        text = ' '.join(text.split())
+        match = pattern.search(text)
+        if match is None:
+            continue
+        start = max(0, match.start() - width // 4)
+        excerpt = text[start:start + width]
+        parts, position = [], 0
+        for hit in pattern.finditer(excerpt):
+            parts += [escape(excerpt[position:hit.start()]), '<mark>', escape(hit.group()), '</mark>']
+            position = hit.end()
+        parts.append(escape(excerpt[position:]))
+        prefix = '…' if start else ''
+        suffix = '…' if start + width < len(text) else ''
+        return mark_safe(prefix + ''.join(parts) + suffix)
+    return None
+
+
+def search(text, limit=50):
+    """
+    Returns up to `limit` vouchers matching `text`, best match first. Each has
+    `search_snippet`, an excerpt of the matching text with the hits in <mark>
+    (None on the fallback backend).
+    """
+    limit = min(limit, MAX_RESULTS)
+    query = build_query(text)
+    if not query:
+        return []
+    results = []
+    for using in [DEFAULT_DB_ALIAS, *archive.databases()]:
+        if len(results) >= limit:
+            break
+        if available(using):
+            results += _search(using, query, text, limit - len(results))
+        else:
+            results += _search_fallback(using, text, limit - len(results))
+    return results
+
+
+def _search(using, query, text, limit):
+    with connections[using].cursor() as cursor:
+        # Only the newest MAX_CANDIDATES matches are scored, which keeps a very common
+        # term nearly as cheap as a rare one
+        cursor.execute(
+            f"""
+            WITH candidates AS (
+                SELECT rowid AS id, bm25(vouchers_search, {', '.join(map(str, RANK_WEIGHTS))}) AS score
+                FROM vouchers_search WHERE vouchers_search MATCH %s
+                ORDER BY rowid DESC LIMIT %s
+            ), best AS (
+                SELECT id, score FROM candidates ORDER BY score LIMIT %s
+            )
+            SELECT s.voucher_id, s.payee, s.items, s.memo, s.prepared_by
+            FROM best JOIN vouchers_search s ON s.rowid = best.id
+            ORDER BY best.score
+            """,
+            [query, MAX_CANDIDATES, limit],
+        )
+        hits = cursor.fetchall()
+
+    vouchers = Voucher.objects.using(using).in_bulk([hit[0] for hit in hits])
+    words = WORD.findall(text)
+    results = []
+    for voucher_id, *texts in hits:
+        voucher = vouchers.get(voucher_id)
+        if voucher is not None:
+            voucher.search_snippet = _snippet(texts + [voucher_id], words)
+            results.append(voucher)
+    return results
+
+
+def _search_fallback(using, text, limit):
+    vouchers = Voucher.objects.using(using)
+    for word in WORD.findall(text):
+        item_matches = Item.objects.filter(voucher=OuterRef('pk')).filter(
+            Q(account__icontains=word) | Q(description__icontains=word)
+        )
+        vouchers = vouchers.filter(
+            Q(voucher_id__icontains=word) | Q(payee__icontains=word) | Q(memo__icontains=word)
+            | Q(prepared_by__icontains=word) | Exists(item_matches)
+        )
+    results = list(vouchers.order_by('-date', '-voucher_id')[:limit])
+    for voucher in results:
+        voucher.search_snippet = None
+    return results
+
+
+def rebuild():
+    """Rebuilds the whole index from the voucher and item tables; returns the number of vouchers indexed"""
+    with transaction.atomic(), connection.cursor() as cursor:
+        for sql in REBUILD_SQL:
+            cursor.execute(sql)
+        cursor.execute("SELECT count(*) FROM vouchers_search_doc")
+        return cursor.fetchone()[0]
+
+
+@contextmanager
+def bulk_indexing(voucher_ids):
+    """
+    Wraps the insert of many new vouchers (services.bulk_create_vouchers). Their doc
+    rows go in first, which tells the insert trigger to leave them alone, and on the
+    way out the whole batch is indexed with one INSERT ... SELECT. Use inside the
+    transaction that inserts the vouchers.
+    """
+    if not available():
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT coalesce(max(id), 0) FROM vouchers_search_doc")
+        last_id = cursor.fetchone()[0]
+        cursor.executemany(
+            "INSERT INTO vouchers_search_doc (voucher_id) VALUES (%s)",
+            [[voucher_id] for voucher_id in voucher_ids],
+        )
+    yield
+    with connection.cursor() as cursor:
+        cursor.execute(INDEX_SQL + " WHERE d.id > %s", [last_id])
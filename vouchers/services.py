@@ -0,0 +1,149 @@
+# vouchers/services.py
+from decimal import Decimal
+
+from django.db import connections, router
+from django.utils import timezone
+
+from .models import Voucher, BankPaymentVoucher, BankReceiptVoucher, Item
+from . import locking, navigation, reports, search
+from .words import amounts_in_words
+
+# Voucher types that are stored in a child table, with the extra fields each one needs
+CHILD_MODELS = {
+    'BPV': (BankPaymentVoucher, ['bank', 'cheque_no']),
+    'BRV': (BankReceiptVoucher, ['bank', 'inst_type', 'inst_no']),
+}
+COMMON_FIELDS = ['date', 'payee', 'memo', 'prepared_by']
+ITEM_FIELDS = ['account', 'description', 'amount']
+
+
+def build_voucher(voucher_type, data):
+    """Returns an unsaved Voucher (or the right child model) built from cleaned form data"""
+    fields = {name: data.get(name) for name in COMMON_FIELDS}
+    if voucher_type in CHILD_MODELS:
+        model, extra_fields = CHILD_MODELS[voucher_type]
+        fields.update({name: data.get(name) for name in extra_fields})
+        return model(voucher_type=voucher_type, **fields)
+    return Voucher(voucher_type=voucher_type, **fields)
+
+
+def create_voucher(voucher_type, data, items_data):
+    """
+    Creates a voucher and all of its items in one transaction.
+    The total (and so the amount in words) is worked out in memory before the
+    single INSERT, the items go in with one bulk_create, and the reporting
+    summaries are updated in the same transaction: the voucher by its post_save
+    signal, the items (which bulk_create sends no signals for) here.
+    """
+    voucher = build_voucher(voucher_type, data)
+    items = [Item(**{name: row[name] for name in ITEM_FIELDS}) for row in items_data]
+    voucher.total_amount = sum((item.amount for item in items), Decimal('0.00'))
+
+    with locking.write_transaction():
+        # force_insert skips the UPDATE Django would otherwise try first on every table
+        voucher.save(force_insert=(Voucher,))
+        for item in items:
+            item.voucher = voucher
+        Item.objects.bulk_create(items)
+        reports.record_items(added=[(voucher.voucher_type, voucher.date, item.account, item.amount) for item in items])
+    return voucher
+
+
+def create_voucher_from_forms(voucher_type, voucher_form, item_formset):
+    """Creates a voucher from an already validated VoucherForm and ItemFormSet"""
+    items_data = [
+        form.cleaned_data for form in item_formset.forms
+        if form.cleaned_data and not form.cleaned_data.get('DELETE')
+    ]
+    return create_voucher(voucher_type, voucher_form.cleaned_data, items_data)
+
+
+def _insert_rows(model, rows):
+    """
+    Inserts plain dicts of attname -> value into a model's own table with one
+    executemany, skipping model instances, signals and save() altogether.
+    Missing columns get the field default, or the current time for auto_now(_add)
+    fields; an auto-increment id is left to the database.
+    Also used for child tables, which Django's bulk_create refuses for multi-table inherited models.
+    """
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    fields = [field for field in model._meta.local_concrete_fields if field is not model._meta.auto_field]
+    now = timezone.now()
+    defaults = {
+        field.attname: now if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+        else field.get_default()
+        for field in fields
+    }
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(model._meta.db_table),
+        ', '.join(quote(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    # Text columns take the cleaned str values as they are; only dates, times and decimals are converted
+    text_types = {'CharField', 'TextField'}
+    converters = [
+        None if (field.target_field if field.is_relation else field).get_internal_type() in text_types
+        else field.get_db_prep_save
+        for field in fields
+    ]
+    params = [
+        [
+            value if convert is None else convert(value, connection)
+            for convert, value in zip(converters, [row.get(field.attname, defaults[field.attname]) for field in fields])
+        ]
+        for row in rows
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def bulk_create_vouchers(records):
+    """
+    Inserts many new vouchers with their items using one statement per table.
+    `records` is a list of (voucher_type, data, items): cleaned voucher fields
+    (COMMON_FIELDS plus the child's bank fields) and a list of item dicts
+    (ITEM_FIELDS). Voucher IDs are reserved in one block per numbering sequence
+    and totals/words are worked out here; the search index, reporting
+    summaries and navigation links are updated too. Returns the new voucher
+    IDs in order. Call inside locking.write_transaction().
+    """
+    by_sequence = {}
+    for index, (voucher_type, data, _) in enumerate(records):
+        by_sequence.setdefault(Voucher.sequence_key(voucher_type, data['date']), []).append(index)
+    voucher_ids = [None] * len(records)
+    for (voucher_type, _), indexes in by_sequence.items():
+        reserved = Voucher.reserve_voucher_ids(voucher_type, records[indexes[0]][1]['date'], len(indexes))
+        for index, voucher_id in zip(indexes, reserved):
+            voucher_ids[index] = voucher_id
+
+    totals = [sum((item['amount'] for item in items), Decimal('0.00')) for _, _, items in records]
+    parents, children, item_rows = [], {model: [] for model, _ in CHILD_MODELS.values()}, []
+    for voucher_id, total, words, (voucher_type, data, items) in zip(voucher_ids, totals, amounts_in_words(totals), records):
+        parent = {name: data.get(name) for name in COMMON_FIELDS}
+        parent.update(voucher_id=voucher_id, voucher_type=voucher_type, total_amount=total,
+                      amount_in_words=words if total > 0 else '')
+        parents.append(parent)
+        if voucher_type in CHILD_MODELS:
+            model, extra_fields = CHILD_MODELS[voucher_type]
+            child = {name: data.get(name) for name in extra_fields}
+            child['voucher_ptr_id'] = voucher_id
+            children[model].append(child)
+        for item in items:
+            item_rows.append({'voucher_id': voucher_id, **{name: item[name] for name in ITEM_FIELDS}})
+
+    with search.bulk_indexing(voucher_ids):
+        _insert_rows(Voucher, parents)
+        for model, rows in children.items():
+            if rows:
+                _insert_rows(model, rows)
+        if item_rows:
+            _insert_rows(Item, item_rows)
+    reports.record_vouchers(
+        (voucher_type, data['date'], data.get('payee'), total, [(item['account'], item['amount']) for item in items])
+        for total, (voucher_type, data, items) in zip(totals, records)
+    )
+    navigation.link(
+        (voucher_id, voucher_type, data['date']) for voucher_id, (voucher_type, data, _) in zip(voucher_ids, records)
+    )
+    return voucher_ids
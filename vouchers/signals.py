@@ -0,0 +1,131 @@
+# vouchers/signals.py
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import navigation, pdf_cache, reports
+from .models import Voucher, BankPaymentVoucher, BankReceiptVoucher, Item
+
+VOUCHER_MODELS = [Voucher, BankPaymentVoucher, BankReceiptVoucher]
+# The voucher fields its summary rows are keyed on or add up; the navigation links follow the first two
+STORED_FIELDS = ['voucher_type', 'date', 'payee', 'total_amount']
+# An item as reports.record_items() takes it, read with its voucher's fields
+ITEM_ENTRY = ['voucher__voucher_type', 'voucher__date', 'account', 'amount']
+
+
+def deleting_voucher(origin):
+    """Whether a delete started from a voucher or a queryset of them, so its items go with it"""
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return issubclass(model, Voucher)
+
+
+def saved_changes(voucher):
+    """{field: (value before, value saved)} for the STORED_FIELDS that a voucher's save has just changed"""
+    changes = {}
+    for name, before in (voucher.__dict__.get('_stored_values') or {}).items():
+        saved = voucher._meta.get_field(name).to_python(getattr(voucher, name))
+        if saved != before:
+            changes[name] = (before, saved)
+    return changes
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def item_changed(sender, instance, origin=None, **kwargs):
+    if deleting_voucher(origin):
+        return
+    pdf_cache.invalidate(instance.voucher_id)
+    # The items are part of the voucher's page: a new updated_at changes its ETag and fragment cache key
+    Voucher.objects.filter(pk=instance.voucher_id).update(updated_at=timezone.now())
+
+
+def voucher_saved(sender, instance, created=False, raw=False, **kwargs):
+    pdf_cache.invalidate(instance.voucher_id)
+    if created:
+        navigation.link([navigation.entry(instance)])
+    elif {'date', 'voucher_type'} & saved_changes(instance).keys():
+        navigation.relink(instance)
+    if not raw and getattr(settings, 'VOUCHER_PDF_CACHE_WARM_ON_SAVE', False):
+        # Wait for the commit so the items saved after the voucher are on the PDF too
+        transaction.on_commit(lambda: pdf_cache.warm(instance.voucher_id))
+
+
+def voucher_deleted(sender, instance, **kwargs):
+    pdf_cache.invalidate(instance.voucher_id)
+
+
+@receiver(pre_save, sender=Item)
+def load_stored_item(sender, instance, raw=False, **kwargs):
+    # What the summaries hold for the item until this save; a new item isn't in them yet
+    if not raw and not instance._state.adding:
+        instance._stored_entry = Item.objects.filter(pk=instance.pk).values_list(*ITEM_ENTRY).first()
+
+
+@receiver(post_save, sender=Item)
+def update_item_summaries(sender, instance, raw=False, **kwargs):
+    stored = instance.__dict__.pop('_stored_entry', None)
+    if raw:
+        return
+    # Read back rather than taken from the instance: update_fields may have left some fields unsaved
+    saved = Item.objects.filter(pk=instance.pk).values_list(*ITEM_ENTRY).get()
+    reports.record_items(added=[saved], removed=[stored] if stored else [])
+
+
+@receiver(post_delete, sender=Item)
+def remove_item_from_summaries(sender, instance, origin=None, **kwargs):
+    if deleting_voucher(origin):
+        # The voucher's pre_delete took it out of the summaries with its items
+        return
+    voucher = Voucher.objects.filter(pk=instance.voucher_id).values_list('voucher_type', 'date').first()
+    if voucher:
+        reports.record_items(removed=[(*voucher, instance.account, instance.amount)])
+
+
+def load_stored_voucher(sender, instance, raw=False, update_fields=None, **kwargs):
+    # The STORED_FIELDS being saved, as they are stored until this save, for saved_changes()
+    fields = [name for name in STORED_FIELDS if update_fields is None or name in update_fields]
+    instance._stored_values = None
+    if not raw and not instance._state.adding and fields:
+        instance._stored_values = Voucher.objects.filter(pk=instance.pk).values(*fields).first()
+
+
+def update_voucher_summaries(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        # Its items are saved after it, and add themselves
+        reports.record_vouchers([reports.voucher_entry(instance, items=[])])
+        return
+    changes = saved_changes(instance)
+    if not changes:
+        return
+    saved = {name: instance._meta.get_field(name).to_python(getattr(instance, name)) for name in STORED_FIELDS}
+    before = {**saved, **{name: value for name, (value, _) in changes.items()}}
+    items = []
+    if {'date', 'voucher_type'} & changes.keys():
+        # The items' rows are keyed on the voucher's date and type too
+        items = list(instance.items.values_list('account', 'amount'))
+    reports.record_vouchers([(*(before[name] for name in STORED_FIELDS), items)], sign=-1)
+    reports.record_vouchers([(*(saved[name] for name in STORED_FIELDS), items)])
+
+
+@receiver(pre_delete, sender=Voucher)
+def remove_from_summaries(sender, instance, **kwargs):
+    # Sent for the Voucher row of child vouchers too, and before the items are deleted
+    reports.record_vouchers([reports.voucher_entry(instance)], sign=-1)
+
+
+@receiver(pre_delete, sender=Voucher)
+def remove_from_navigation(sender, instance, **kwargs):
+    # Its neighbours are linked to each other before its own links go with it (CASCADE)
+    navigation.unlink([instance.voucher_id])
+
+
+for model in VOUCHER_MODELS:
+    pre_save.connect(load_stored_voucher, sender=model)
+    post_save.connect(voucher_saved, sender=model)
+    post_save.connect(update_voucher_summaries, sender=model)
+    post_delete.connect(voucher_deleted, sender=model)
@@ -0,0 +1,51 @@
+# vouchers/storage.py
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """
+    collectstatic writes every static file under a content-hashed name, which
+    WhiteNoise serves with a far-future Cache-Control, and adds .gz/.br copies
+    of text files. Until collectstatic has written a manifest (development,
+    tests) the plain names are used, as ManifestStaticFilesStorage does with DEBUG on.
+    """
+
+    def stored_name(self, name):
+        # static('') is the STATIC_URL prefix, which renderer.StaticAssets matches URLs against
+        if not name or not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoiseMiddleware that also runs async. WhiteNoise's own middleware is
+    sync only, and under ASGI Django would run every request below it, async
+    views included, through a thread to fit it in the chain.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # Looks for the file on disk (DEBUG)
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            # Opening the file and stat()ing it is blocking I/O
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
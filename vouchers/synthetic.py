@@ -0,0 +1,121 @@
+# vouchers/synthetic.py
+"""
+Synthetic vouchers for load tests and benchmarks (manage.py seed_vouchers,
+benchmark_requests).
+
+The records look like a real ledger rather than uniform noise: a few payees
+account for most vouchers, payments go to expense accounts and receipts come
+from income accounts, amounts are skewed towards small values, and dates run
+forwards so voucher numbers rise with the date as they do in practice. A fixed
+seed gives the same data every time, so benchmark runs can be compared.
+"""
+import datetime
+import itertools
+import random
+from decimal import Decimal
+
+from .locking import write_transaction
+from .services import bulk_create_vouchers
+
+# Share of each voucher type, roughly as in a small office's books
+TYPE_WEIGHTS = {'CPV': 45, 'BPV': 30, 'CRV': 15, 'BRV': 10}
+
+PAYEE_NAMES = [
+    'Acme', 'Apex', 'Bluewater', 'Cedar', 'Crescent', 'Delta', 'Eastern', 'Falcon', 'Frontier', 'Galaxy',
+    'Granite', 'Harbor', 'Horizon', 'Indus', 'Jade', 'Karakoram', 'Lakeside', 'Meridian', 'Northstar', 'Oasis',
+    'Orient', 'Pinnacle', 'Quantum', 'Ravi', 'Summit', 'Sunrise', 'Tristar', 'Unity', 'Vertex', 'Zenith',
+]
+PAYEE_KINDS = [
+    'Traders', 'Enterprises', 'Logistics', 'Stationers', 'Electric', 'Motors', 'Builders', 'Foods',
+    'Textiles', 'Pharma', 'Printers', 'Travels', 'Communications', 'Services', 'Supplies',
+]
+PREPARERS = ['Ahmed', 'Bilal', 'Fatima', 'Hina', 'Imran', 'Sana', 'Usman', 'Zara']
+BANKS = ['HBL', 'MCB', 'UBL', 'Meezan Bank', 'Allied Bank', 'Bank Alfalah', 'Standard Chartered']
+INSTRUMENT_TYPES = ['Cheque', 'Pay Order', 'Demand Draft', 'Online Transfer']
+
+# (account, descriptions) charged by payment vouchers
+EXPENSE_ACCOUNTS = [
+    ('5010', ['Office rent', 'Warehouse rent']),
+    ('5020', ['Electricity bill', 'Gas bill', 'Water bill']),
+    ('5030', ['Salaries', 'Overtime', 'Staff bonus']),
+    ('5040', ['Printing and stationery', 'Toner cartridges', 'Photocopy paper']),
+    ('5050', ['Fuel', 'Vehicle repairs', 'Tyres']),
+    ('5060', ['Travel', 'Hotel stay', 'Daily allowance']),
+    ('5070', ['Internet charges', 'Mobile bills', 'Courier charges']),
+    ('5080', ['Repairs and maintenance', 'Cleaning supplies']),
+    ('5090', ['Entertainment', 'Refreshments']),
+    ('1510', ['Computer equipment', 'Office furniture']),
+]
+# (account, descriptions) credited by receipt vouchers
+INCOME_ACCOUNTS = [
+    ('4010', ['Sales', 'Cash sales']),
+    ('4020', ['Service charges', 'Consultancy fee']),
+    ('4030', ['Rental income']),
+    ('4040', ['Bank profit']),
+    ('1210', ['Receipt against invoice', 'Advance from customer']),
+]
+MEMOS = [None, None, None, 'Paid in full', 'Part payment', 'As per quotation', 'Month end adjustment', 'Approved by manager']
+
+
+class VoucherGenerator:
+    """
+    Produces (voucher_type, data, items) records as services.bulk_create_vouchers()
+    takes them. `items` is the (min, max) number of items per voucher.
+    """
+
+    def __init__(self, seed=0, items=(1, 5), voucher_types=None, payees=300):
+        self.random = random.Random(seed)
+        self.items = items
+        types = voucher_types or list(TYPE_WEIGHTS)
+        self.voucher_types = types
+        self.type_weights = list(itertools.accumulate(TYPE_WEIGHTS[code] for code in types))
+        names = [f"{name} {kind}" for name, kind in itertools.product(PAYEE_NAMES, PAYEE_KINDS)]
+        self.random.shuffle(names)
+        self.payees = names[:payees]
+        # Zipf-like: the n-th payee is used about 1/n as often as the first
+        self.payee_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(self.payees) + 1)))
+
+    def amount(self):
+        """Skewed towards small amounts: mostly hundreds to tens of thousands, now and then much more"""
+        return Decimal(min(self.random.lognormvariate(8, 1.5), 5_000_000)).quantize(Decimal('0.01'))
+
+    def record(self, date):
+        rng = self.random
+        voucher_type = rng.choices(self.voucher_types, cum_weights=self.type_weights)[0]
+        data = {
+            'date': date,
+            'payee': rng.choices(self.payees, cum_weights=self.payee_weights)[0],
+            'memo': rng.choice(MEMOS),
+            'prepared_by': rng.choice(PREPARERS),
+        }
+        if voucher_type == 'BPV':
+            data.update(bank=rng.choice(BANKS), cheque_no=str(rng.randint(100000, 999999)))
+        elif voucher_type == 'BRV':
+            data.update(bank=rng.choice(BANKS), inst_type=rng.choice(INSTRUMENT_TYPES),
+                        inst_no=str(rng.randint(100000, 999999)))
+        accounts = EXPENSE_ACCOUNTS if voucher_type in ('BPV', 'CPV') else INCOME_ACCOUNTS
+        items = []
+        for _ in range(rng.randint(*self.items)):
+            account, descriptions = rng.choice(accounts)
+            items.append({'account': account, 'description': rng.choice(descriptions), 'amount': self.amount()})
+        return voucher_type, data, items
+
+    def records(self, count, start_date, end_date):
+        """`count` records with dates spread evenly from start_date to end_date, in date order"""
+        days = (end_date - start_date).days
+        for n in range(count):
+            yield self.record(start_date + datetime.timedelta(days=days * n // max(count, 1)))
+
+
+def seed_vouchers(generator, count, start_date, end_date, batch_size=5000):
+    """
+    Inserts `count` generated vouchers with bulk_create_vouchers(), one write
+    transaction per batch. Yields the number inserted so far after each batch.
+    """
+    records = generator.records(count, start_date, end_date)
+    inserted = 0
+    while batch := list(itertools.islice(records, batch_size)):
+        with write_transaction():
+            bulk_create_vouchers(batch)
+        inserted += len(batch)
+        yield inserted
@@ -1,3 +1,1156 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import datetime
+import itertools
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import SkipTest
 
-# Create your tests here.
+import brotli
+import pypdf
+from asgiref.sync import async_to_sync
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.db.models import Count
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import ResolverMatch, reverse
+from django.utils import timezone
+
+from . import (
+    archive, batch_print, exports, importer, locking, navigation, pagination, pdf, pdf_cache, pdf_jobs, pdf_merge, pdf_pool, performance, reconcile,
+    renderer, reports, search, services, synthetic, views, words,
+)
+from .forms import VoucherForm
+from .models import (
+    Voucher, BankPaymentVoucher, BankReceiptVoucher, Item, VoucherNavigation, VoucherSequence, AccountDailySummary,
+    PayeeMonthlySummary, PdfRenderJob, ReconcileRun,
+)
+
+
+def make_voucher(model=Voucher, items=3, **fields):
+    fields.setdefault('date', datetime.date(2025, 8, 1))
+    fields.setdefault('payee', 'Acme Traders')
+    fields.setdefault('prepared_by', 'Clerk')
+    voucher = model(**fields)
+    voucher.save()
+    Item.objects.bulk_create(
+        Item(voucher=voucher, account='1001', description=f'Line {n}', amount=Decimal('10.00'))
+        for n in range(items)
+    )
+    return voucher
+
+
+class VoucherNumberingTests(TestCase):
+    """Voucher IDs come from VoucherSequence, one by one or in reserved blocks"""
+
+    def test_reserved_block_does_not_overlap_single_saves(self):
+        date = datetime.date(2025, 8, 1)
+        first = make_voucher(voucher_type='CPV', items=0).pk
+        block = Voucher.reserve_voucher_ids('CPV', date, 5)
+        last = make_voucher(voucher_type='CPV', items=0).pk
+        self.assertEqual([first, *block, last], [f'CPV-{n:08d}' for n in range(1, 8)])
+        self.assertEqual(VoucherSequence.objects.get(voucher_type='CPV').last_number, 7)
+        # Other types are numbered on their own
+        self.assertEqual(Voucher.reserve_voucher_ids('CRV', date, 2), ['CRV-00000001', 'CRV-00000002'])
+
+    def test_ids_sort_in_number_order_past_99999(self):
+        VoucherSequence.objects.create(voucher_type='CPV', last_number=99998)
+        created = [make_voucher(voucher_type='CPV', items=0).pk for _ in range(3)]
+        self.assertEqual(created, ['CPV-00099999', 'CPV-00100000', 'CPV-00100001'])
+        self.assertEqual(list(Voucher.objects.order_by('voucher_id').values_list('pk', flat=True)), created)
+
+    def test_unpadded_id_redirects(self):
+        voucher = make_voucher(voucher_type='CPV', items=0)
+        self.assertRedirects(self.client.get('/vouchers/CPV-00001/'), voucher.get_absolute_url(), status_code=301)
+        self.assertEqual(self.client.get('/vouchers/CPV-00002/').status_code, 404)
+
+
+class WordsTests(SimpleTestCase):
+    """Amounts in words match num2words' Indian English wording, exactly for Decimals"""
+
+    def test_numbers_match_num2words(self):
+        from num2words import num2words
+
+        numbers = [0, 1, 19, 20, 21, 99, 100, 101, 110, 999, 1000, 1001, 1099, 99_999, 1_00_000, 1_00_001,
+                   99_99_999, 1_00_00_000, 1_00_00_099, 999_99_99_999]
+        for number in numbers:
+            with self.subTest(number=number):
+                self.assertEqual(words.number_in_words(number), num2words(number, lang='en_IN').title())
+
+    def test_crore_counts_above_999(self):
+        # Past num2words' limit of 999 crore; the count of crores is worded like any other number
+        self.assertEqual(words.number_in_words(1000_00_00_000), 'One Thousand Crore')
+        self.assertEqual(words.number_in_words(1234_56_78_901),
+                         'One Thousand, Two Hundred And Thirty-Four Crore, Fifty-Six Lakh, '
+                         'Seventy-Eight Thousand, Nine Hundred And One')
+        self.assertEqual(words.number_in_words(1_00_000_00_00_000), 'One Lakh Crore')
+
+    def test_paisas(self):
+        self.assertEqual(words.amount_in_words(Decimal('0.01')), 'Zero Rupees and One Paisas')
+        self.assertEqual(words.amount_in_words(Decimal('10.10')), 'Ten Rupees and Ten Paisas')
+        self.assertEqual(words.amount_in_words(Decimal('1234567.89')),
+                         'Twelve Lakh, Thirty-Four Thousand, Five Hundred And Sixty-Seven Rupees '
+                         'and Eighty-Nine Paisas')
+        self.assertEqual(words.amount_in_words(Decimal('1000.00')), 'One Thousand Rupees only')
+
+    def test_batch_keeps_order(self):
+        amounts = [Decimal('30.00'), Decimal('0.50'), Decimal('30.00'), Decimal('7.00')]
+        self.assertEqual(words.amounts_in_words(amounts), [words.amount_in_words(amount) for amount in amounts])
+        self.assertEqual(words.amounts_in_words(amounts)[:2], ['Thirty Rupees only', 'Zero Rupees and Fifty Paisas'])
+
+
+class CreateVoucherTests(TestCase):
+    """The new-voucher page writes a voucher and all its lines in a fixed number of queries"""
+
+    def post(self, lines, deleted=()):
+        data = {
+            'voucher_type': 'BPV', 'date': '2025-08-01', 'payee': 'Zephyr Logistics', 'prepared_by': 'Clerk',
+            'bank': 'HBL', 'cheque_no': '1234',
+            'items-TOTAL_FORMS': str(lines), 'items-INITIAL_FORMS': '0',
+        }
+        for n in range(lines):
+            data.update({f'items-{n}-account': f'10{n % 10:02d}', f'items-{n}-description': f'Line {n}',
+                         f'items-{n}-amount': '10.10'})
+            if n in deleted:
+                data[f'items-{n}-DELETE'] = 'on'
+        return self.client.post(reverse('create_voucher'), data)
+
+    def test_bank_payment_voucher(self):
+        response = self.post(3, deleted={1})
+        voucher = BankPaymentVoucher.objects.get()
+        self.assertRedirects(response, voucher.get_absolute_url())
+        self.assertEqual((voucher.voucher_type, voucher.payee, voucher.bank, voucher.cheque_no),
+                         ('BPV', 'Zephyr Logistics', 'HBL', '1234'))
+        self.assertEqual(list(voucher.items.order_by('pk').values_list('description', 'amount')),
+                         [('Line 0', Decimal('10.10')), ('Line 2', Decimal('10.10'))])
+        self.assertEqual(voucher.total_amount, Decimal('20.20'))
+        self.assertEqual(voucher.amount_in_words, 'Twenty Rupees and Twenty Paisas')
+
+    def test_queries_do_not_grow_with_lines(self):
+        self.post(1)  # The voucher sequence row and the summary rows exist from here on
+        for lines in [2, 50]:
+            with self.assertNumQueries(16):
+                self.assertEqual(self.post(lines).status_code, 302)
+        self.assertEqual(Item.objects.count(), 53)
+
+
+class KeysetPaginationTests(TestCase):
+    """The voucher list pages forward and back by cursor through every voucher exactly once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Three vouchers a day, so pages break in the middle of a date
+        for n in range(25):
+            make_voucher(voucher_type='CPV', items=0, date=datetime.date(2025, 8, 1) + datetime.timedelta(days=n // 3))
+        cls.ordered = list(Voucher.objects.order_by('-date', '-voucher_id').values_list('pk', flat=True))
+
+    def ids(self, page):
+        return [voucher.pk for voucher in page]
+
+    def test_forward_and_back_round_trip(self):
+        pages = [pagination.keyset_page(Voucher.objects.all())]
+        while pages[-1].has_next():
+            pages.append(pagination.keyset_page(Voucher.objects.all(), after=pages[-1].next_cursor))
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([pk for page in pages for pk in self.ids(page)], self.ordered)
+        self.assertFalse(pages[0].has_previous())
+
+        back = [pages[-1]]
+        while back[-1].has_previous():
+            back.append(pagination.keyset_page(Voucher.objects.all(), before=back[-1].previous_cursor))
+        self.assertEqual([self.ids(page) for page in reversed(back)], [self.ids(page) for page in pages])
+
+    def test_before_after_after(self):
+        first = pagination.keyset_page(Voucher.objects.all())
+        second = pagination.keyset_page(Voucher.objects.all(), after=first.next_cursor)
+        again = pagination.keyset_page(Voucher.objects.all(), before=second.previous_cursor)
+        self.assertEqual(self.ids(again), self.ids(first))
+        self.assertFalse(again.has_previous())
+        self.assertEqual(again.next_cursor, first.next_cursor)
+
+    def test_bad_cursors_give_the_first_page(self):
+        first = self.ids(pagination.keyset_page(Voucher.objects.all()))
+        not_a_date = base64.urlsafe_b64encode(b'yesterday|CPV-00000001').decode()
+        for cursor in ['', '***', 'bm9waXBl', not_a_date, '\u00e9t\u00e9']:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.ids(pagination.keyset_page(Voucher.objects.all(), after=cursor)), first)
+                self.assertEqual(self.ids(pagination.keyset_page(Voucher.objects.all(), before=cursor)), first)
+        self.assertEqual(self.client.get(reverse('voucher_list'), {'after': '***'}).status_code, 200)
+
+    def test_exact_count_link_keeps_the_page(self):
+        cursor = pagination.keyset_page(Voucher.objects.all()).next_cursor
+        response = self.client.get(reverse('voucher_list'), {'after': cursor})
+        self.assertContains(response, f'href="?after={cursor}&amp;count=exact"')
+        response = self.client.get(reverse('voucher_list'), {'after': cursor, 'count': 'exact'})
+        self.assertContains(response, '25 vouchers')
+        self.assertEqual([v.pk for v in response.context['page_obj']], self.ordered[10:20])
+
+
+class VoucherQueryCountTests(TestCase):
+    """Guards against N+1 queries when loading typed vouchers with their items"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bpv = make_voucher(BankPaymentVoucher, bank='HBL', cheque_no='1234')
+        cls.brv = make_voucher(BankReceiptVoucher, bank='MCB', inst_type='Cheque', inst_no='99')
+        cls.cpv = make_voucher(voucher_type='CPV')
+
+    def test_single_voucher_loads_in_two_queries(self):
+        with self.assertNumQueries(2):
+            voucher = Voucher.objects.with_details().get(pk=self.bpv.pk).get_child_instance()
+            self.assertEqual(voucher.cheque_no, '1234')
+            self.assertEqual(len(voucher.items.all()), 3)
+
+    def test_many_vouchers_load_in_two_queries(self):
+        for _ in range(20):
+            make_voucher(BankReceiptVoucher, bank='MCB', inst_type='Cheque', inst_no='1')
+        with self.assertNumQueries(2):
+            vouchers = Voucher.objects.typed()
+            for voucher in vouchers:
+                list(voucher.items.all())
+                if voucher.voucher_type == 'BRV':
+                    voucher.inst_no
+        self.assertEqual(len(vouchers), 23)
+
+    def test_detail_query_count_does_not_grow_with_items(self):
+        url = reverse('voucher_detail', args=[self.brv.pk])
+        with self.assertNumQueries(3) as first:
+            self.client.get(url)
+        # Saved one by one, so the signals move updated_at and the cached fragment is not reused
+        for _ in range(50):
+            Item.objects.create(voucher=self.brv, account='1001', description='Extra', amount=Decimal('1.00'))
+        with self.assertNumQueries(len(first)):
+            response = self.client.get(url)
+        self.assertContains(response, 'Extra')
+
+
+class PdfCacheTests(TestCase):
+    """Rendered PDFs are cached by content key, which is also the download's ETag"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(VOUCHER_PDF_CACHE_DIR=directory.name, VOUCHER_PDF_ASYNC=False))
+        self.voucher = make_voucher(BankPaymentVoucher, bank='HBL', cheque_no='1234')
+
+    def key(self):
+        return pdf_cache.content_key(Voucher.objects.with_details().get(pk=self.voucher.pk).get_child_instance())
+
+    def test_key_follows_the_content(self):
+        key = self.key()
+        self.assertEqual(self.key(), key)
+        BankPaymentVoucher.objects.filter(pk=self.voucher.pk).update(cheque_no='5678')
+        self.assertNotEqual(self.key(), key)
+        key = self.key()
+        Item.objects.filter(voucher=self.voucher).update(amount=Decimal('11.00'))
+        self.assertNotEqual(self.key(), key)
+
+    def test_cached_pdf_etag_and_304(self):
+        key = self.key()
+        pdf_cache.put(self.voucher.pk, key, b'%PDF-cached')
+        url = reverse('download_voucher_pdf', args=[self.voucher.pk])
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response.content), (200, b'%PDF-cached'))
+        self.assertEqual(response['ETag'], f'"{key}"')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=f'"{key}"').status_code, 304)
+
+    def test_edits_remove_the_cached_files(self):
+        pdf_cache.put(self.voucher.pk, self.key(), b'%PDF-old')
+        Item.objects.create(voucher=self.voucher, account='2002', description='Late', amount=Decimal('5.00'))
+        self.assertIsNone(pdf_cache.get(self.voucher.pk, self.key()))
+        self.assertEqual(list(pdf_cache.cache_dir().glob('*.pdf')), [])
+
+        pdf_cache.put(self.voucher.pk, self.key(), b'%PDF-old')
+        self.voucher.delete()
+        self.assertEqual(list(pdf_cache.cache_dir().glob('*.pdf')), [])
+
+    def test_eviction_runs_every_few_puts(self):
+        def put(n):
+            pdf_cache.put(f'CPV-{n}', 'key', b'x' * 100)
+            # Oldest first, whatever the file system's mtime resolution
+            os.utime(pdf_cache._path(f'CPV-{n}', 'key'), (n, n))
+
+        def cached():
+            return sorted(path.name[:-8] for path in pdf_cache.cache_dir().glob('*.pdf'))
+
+        self.addCleanup(setattr, pdf_cache, '_puts', pdf_cache._puts)
+        pdf_cache._puts = itertools.count(1)
+        with override_settings(VOUCHER_PDF_CACHE_MAX_BYTES=250, VOUCHER_PDF_CACHE_EVICT_EVERY=3):
+            for n in range(1, 6):
+                put(n)
+            # The third put brought the cache back under 250 bytes; the next two are over it until the sixth
+            self.assertEqual(cached(), ['CPV-2', 'CPV-3', 'CPV-4', 'CPV-5'])
+            put(6)
+        self.assertEqual(cached(), ['CPV-5', 'CPV-6'])
+
+
+class PdfJobTests(TestCase):
+    """With VOUCHER_PDF_ASYNC on, uncached PDFs are queued for run_pdf_worker, up to VOUCHER_PDF_QUEUE_LIMIT"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(
+            VOUCHER_PDF_CACHE_DIR=directory.name, VOUCHER_PDF_ASYNC=True, VOUCHER_PDF_QUEUE_LIMIT=1,
+        ))
+        self.first, self.second = make_voucher(voucher_type='CPV'), make_voucher(voucher_type='CPV')
+
+    def test_download_queues_a_job_until_the_limit(self):
+        response = self.client.get(reverse('download_voucher_pdf', args=[self.first.pk]))
+        self.assertEqual(response.status_code, 202)
+        job = PdfRenderJob.objects.get()
+        self.assertContains(response, reverse('pdf_job_status', args=[job.pk]), status_code=202)
+        # Asking again waits on the same job
+        self.assertEqual(pdf_jobs.enqueue(self.first.pk, 'http://testserver/'), job)
+
+        response = self.client.get(reverse('download_voucher_pdf', args=[self.second.pk]))
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '5'))
+        with self.assertRaises(pdf_jobs.QueueFull):
+            pdf_jobs.enqueue(self.second.pk, 'http://testserver/')
+
+        status = self.client.get(reverse('pdf_job_status', args=[job.pk])).json()
+        self.assertEqual((status['status'], status['queue_position'], status['download_url']), ('queued', 0, None))
+        PdfRenderJob.objects.filter(pk=job.pk).update(status=PdfRenderJob.DONE)
+        status = self.client.get(reverse('pdf_job_status', args=[job.pk])).json()
+        self.assertEqual(status['download_url'], reverse('download_voucher_pdf', args=[self.first.pk]))
+        # Finished jobs no longer count against the limit
+        pdf_jobs.enqueue(self.second.pk, 'http://testserver/')
+
+    def test_worker_claims_each_job_once(self):
+        job = pdf_jobs.enqueue(self.first.pk, 'http://testserver/')
+        worker = pdf_jobs.Worker()
+        self.assertEqual(worker.claim(2), [job.pk])
+        self.assertEqual(worker.claim(2), [])
+        PdfRenderJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - datetime.timedelta(hours=1))
+        worker.requeue_stale()
+        self.assertEqual(worker.claim(2), [job.pk])
+
+    def test_queue_endpoint_takes_an_api_token_not_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        url = reverse('queue_voucher_pdf', args=[self.first.pk])
+        with override_settings(VOUCHER_API_TOKEN='secret'):
+            self.assertEqual(client.post(url).status_code, 403)
+            response = client.post(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status_url'], reverse('pdf_job_status', args=[response.json()['id']]))
+
+    def test_queue_endpoint_needs_csrf_without_a_token(self):
+        client = Client(enforce_csrf_checks=True)
+        url = reverse('queue_voucher_pdf', args=[self.first.pk])
+        with override_settings(VOUCHER_API_TOKEN=None):
+            # A form on another site, posting with the visitor's cookies
+            self.assertEqual(client.post(url, HTTP_ORIGIN='https://evil.example').status_code, 403)
+            self.assertEqual(client.post(url, HTTP_AUTHORIZATION='Bearer anything').status_code, 403)
+            self.assertFalse(PdfRenderJob.objects.exists())
+            client.get(reverse('create_voucher'))
+            response = client.post(url, HTTP_X_CSRFTOKEN=client.cookies[settings.CSRF_COOKIE_NAME].value)
+        self.assertEqual(response.status_code, 202)
+
+
+class BatchPrintTests(TestCase):
+    """Batch printing writes one PDF page or one ZIP entry per voucher"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.enterContext(override_settings(VOUCHER_PDF_CACHE_DIR=os.path.join(directory.name, 'cache')))
+        self.vouchers = [make_voucher(voucher_type='CPV', date=datetime.date(2025, 8, day)) for day in (1, 2, 3)]
+
+    @staticmethod
+    def blank_pdf(*widths):
+        writer = pypdf.PdfWriter()
+        for width in widths:
+            writer.add_blank_page(width=width, height=100)
+        output = BytesIO()
+        writer.write(output)
+        return output.getvalue()
+
+    def test_merger_joins_the_pages_in_order(self):
+        output = BytesIO()
+        merger = pdf_merge.PdfMerger(output)
+        for part in [self.blank_pdf(101, 102), self.blank_pdf(103), self.blank_pdf(104, 105, 106)]:
+            merger.append(part)
+        merger.close()
+        reader = pypdf.PdfReader(BytesIO(output.getvalue()), strict=True)
+        self.assertEqual([page.mediabox.width for page in reader.pages], [101, 102, 103, 104, 105, 106])
+
+    def test_zip_has_a_pdf_per_voucher(self):
+        # Cached PDFs are used as they are, so nothing is rendered
+        for voucher in batch_print.iter_typed(Voucher.objects.all()):
+            pdf_cache.put(voucher.pk, pdf_cache.content_key(voucher), f'%PDF {voucher.pk}'.encode())
+        path = os.path.join(self.directory, 'august.zip')
+        call_command('print_vouchers', path, '--start-date', '2025-08-02', '--base-url', 'http://testserver/',
+                     stdout=StringIO())
+        with zipfile.ZipFile(path) as archive:
+            self.assertEqual(
+                {name: archive.read(name) for name in archive.namelist()},
+                {f'{v.pk}_{v.date}.pdf': f'%PDF {v.pk}'.encode() for v in self.vouchers[1:]},
+            )
+
+    def test_merged_pdf_has_a_page_per_voucher(self):
+        try:
+            renderer.engine()
+        except (ImportError, OSError):
+            raise SkipTest("WeasyPrint can't be loaded here")
+        output = BytesIO()
+        pdf.render_batch_pdf(batch_print.iter_typed(batch_print.select_vouchers()), 'http://testserver/', output,
+                             chunk_size=2)
+        reader = pypdf.PdfReader(BytesIO(output.getvalue()), strict=True)
+        self.assertEqual(len(reader.pages), 3)
+        self.assertIn(self.vouchers[2].pk, reader.pages[2].extract_text())
+
+
+class ConditionalGetTests(TestCase):
+    """Unchanged voucher pages are answered with 304s and cached fragments"""
+
+    def setUp(self):
+        cache.clear()
+        self.voucher = make_voucher(voucher_type='CPV')
+        self.url = reverse('voucher_detail', args=[self.voucher.pk])
+
+    def test_unchanged_detail_page(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        with self.assertNumQueries(1):
+            self.assertContains(self.client.get(self.url), 'Line 2')
+
+    def test_item_change_invalidates_the_page(self):
+        etag = self.client.get(self.url)['ETag']
+        Item.objects.create(voucher=self.voucher, account='2002', description='Late addition', amount=Decimal('5.00'))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Late addition')
+
+    def test_unchanged_list_page(self):
+        url = reverse('voucher_list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.voucher.payee = 'Renamed'
+        self.voucher.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class AsyncViewTests(TestCase):
+    """The async views served under ASGI answer as the sync ones do"""
+
+    def setUp(self):
+        cache.clear()
+        self.voucher = make_voucher(voucher_type='CPV')
+        self.factory = RequestFactory()
+
+    def test_detail_page(self):
+        url = reverse('voucher_detail', args=[self.voucher.pk])
+        sync_response = views.voucher_detail(self.factory.get(url), self.voucher.pk)
+        cache.clear()
+        # The fragment is read from the cache here, so a miss loads the voucher in the view
+        with self.assertNumQueries(3):
+            response = async_to_sync(views.voucher_detail_async)(self.factory.get(url), self.voucher.pk)
+        self.assertEqual(response['ETag'], sync_response['ETag'])
+        self.assertContains(response, 'Line 2')
+        with self.assertNumQueries(1):
+            cached = async_to_sync(views.voucher_detail_async)(self.factory.get(url), self.voucher.pk)
+        self.assertEqual(cached.content, response.content)
+        not_modified = async_to_sync(views.voucher_detail_async)(
+            self.factory.get(url, HTTP_IF_NONE_MATCH=response['ETag']), self.voucher.pk,
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_list_page(self):
+        url = reverse('voucher_list')
+        sync_response = views.voucher_list(self.factory.get(url))
+        response = async_to_sync(views.voucher_list_async)(self.factory.get(url))
+        self.assertEqual(response['ETag'], sync_response['ETag'])
+        self.assertContains(response, self.voucher.pk)
+
+    def test_pdf_pool_is_bounded(self):
+        release = threading.Event()
+        with override_settings(VOUCHER_PDF_RENDER_THREADS=1, VOUCHER_PDF_RENDER_BACKLOG=0):
+            pdf_pool.shutdown()
+            self.addCleanup(pdf_pool.shutdown)
+            self.addCleanup(release.set)
+
+            async def render_two():
+                first = asyncio.ensure_future(pdf_pool.run(release.wait))
+                await asyncio.sleep(0)
+                with self.assertRaises(pdf_pool.Busy):
+                    await pdf_pool.run(release.wait)
+                release.set()
+                return await first
+
+            self.assertTrue(async_to_sync(render_two)())
+            self.assertEqual(async_to_sync(pdf_pool.run)(sum, [1, 2]), 3)
+
+
+class NavigationTests(TestCase):
+    """Stored previous/next links match the (date, voucher_id) order after every kind of write"""
+
+    def links(self):
+        return set(VoucherNavigation.objects.values_list('voucher_id', 'scope', 'prev_id', 'next_id'))
+
+    def assertLinksUpToDate(self):
+        stored = self.links()
+        navigation.rebuild()
+        self.assertEqual(stored, self.links())
+
+    def test_links_follow_writes(self):
+        # Out of date order, so new vouchers land between old ones
+        vouchers = [
+            make_voucher(voucher_type=voucher_type, date=datetime.date(2025, 8, day), items=0)
+            for voucher_type, day in [('CPV', 5), ('CRV', 1), ('CPV', 3), ('CRV', 5), ('CPV', 1)]
+        ]
+        self.assertLinksUpToDate()
+        services.bulk_create_vouchers([
+            (voucher_type, {'date': datetime.date(2025, 8, day), 'payee': 'Payee', 'memo': None, 'prepared_by': 'Clerk'}, [])
+            for voucher_type, day in [('CRV', 2), ('CPV', 4), ('CPV', 2), ('CRV', 9), ('CPV', 3)]
+        ])
+        self.assertLinksUpToDate()
+
+        vouchers[2].date = datetime.date(2025, 7, 30)
+        vouchers[2].save()
+        self.assertLinksUpToDate()
+        vouchers[0].delete()
+        Voucher.objects.filter(date=datetime.date(2025, 8, 3)).delete()
+        self.assertLinksUpToDate()
+
+    def test_only_date_and_type_changes_relink(self):
+        first, second = [make_voucher(voucher_type='CPV', date=datetime.date(2025, 8, day), items=0) for day in [1, 2]]
+        second.memo = 'Edited'
+        with CaptureQueriesContext(connection) as queries:
+            second.save()
+            # Set to what it already is
+            second.date = datetime.date(2025, 8, 2)
+            second.save(update_fields=['date', 'memo'])
+        self.assertFalse([q for q in queries if 'vouchers_vouchernavigation' in q['sql']])
+
+        second.voucher_type = 'CRV'
+        with CaptureQueriesContext(connection) as queries:
+            second.save()
+        self.assertTrue([q for q in queries if 'vouchers_vouchernavigation' in q['sql']])
+        self.assertLinksUpToDate()
+        self.assertEqual(VoucherNavigation.objects.get(voucher=first, scope='type').next_id, None)
+
+    def test_detail_page_arrows(self):
+        first, second, third = [
+            make_voucher(voucher_type=voucher_type, date=datetime.date(2025, 8, day), items=0)
+            for voucher_type, day in [('CPV', 1), ('CRV', 2), ('CPV', 3)]
+        ]
+        response = self.client.get(reverse('voucher_detail', args=[second.pk]))
+        self.assertEqual((response.context['prev_id'], response.context['next_id']), (first.pk, third.pk))
+        cache.clear()
+        # The lookup, then the voucher and its items for the page body: the arrows cost nothing more
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('voucher_detail', args=[third.pk]) + '?nav=type')
+        self.assertEqual((response.context['prev_id'], response.context['next_id']), (first.pk, None))
+        self.assertContains(response, f'href="{reverse("voucher_detail", args=[first.pk])}?nav=type"')
+
+
+@override_settings(VOUCHER_API_SYNC_LAG_SECONDS=0)
+class ApiTests(TestCase):
+    """The JSON API fetches in a fixed number of queries and pages through changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bpv = make_voucher(BankPaymentVoucher, bank='HBL', cheque_no='1234')
+        cls.brv = make_voucher(BankReceiptVoucher, bank='MCB', inst_type='Cheque', inst_no='99')
+        cls.cpv = make_voucher(voucher_type='CPV', items=0)
+
+    def test_batch_fetch(self):
+        url = reverse('api_vouchers')
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'ids': f'{self.brv.pk},{self.bpv.pk},CPV-99999'})
+        data = response.json()
+        self.assertEqual([voucher['voucher_id'] for voucher in data['vouchers']], [self.brv.pk, self.bpv.pk])
+        self.assertEqual(data['missing'], ['CPV-99999'])
+        self.assertEqual(data['vouchers'][0]['inst_no'], '99')
+        self.assertNotIn('cheque_no', data['vouchers'][0])
+        self.assertEqual(len(data['vouchers'][1]['items']), 3)
+
+        for _ in range(20):
+            make_voucher(voucher_type='CRV')
+        ids = list(Voucher.objects.values_list('pk', flat=True))
+        with self.assertNumQueries(2):
+            response = self.client.post(url, {'ids': ids}, content_type='application/json')
+        self.assertEqual(len(response.json()['vouchers']), 23)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'ids': ids, 'fields': 'voucher_id,payee'})
+        self.assertEqual(response.json()['vouchers'][0], {'voucher_id': ids[0], 'payee': 'Acme Traders'})
+        response = self.client.get(url, {'ids': ids, 'fields': 'voucher_id,payee'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        self.assertEqual(self.client.get(url, {'ids': ids, 'fields': 'salary'}).status_code, 400)
+        with self.settings(VOUCHER_API_BATCH_LIMIT=10):
+            self.assertEqual(self.client.get(url, {'ids': ids}).status_code, 400)
+
+    def test_change_feed(self):
+        url = reverse('api_voucher_changes')
+        seen, cursor, more = [], None, True
+        while more:
+            data = self.client.get(url, {'after': cursor or '', 'limit': 2, 'fields': 'voucher_id'}).json()
+            seen += [voucher['voucher_id'] for voucher in data['vouchers']]
+            cursor, more = data['cursor'], data['more']
+        self.assertCountEqual(seen, [self.bpv.pk, self.brv.pk, self.cpv.pk])
+        self.assertEqual(self.client.get(url, {'after': cursor}).json()['vouchers'], [])
+
+        Item.objects.create(voucher=self.bpv, account='2002', description='Bank charges', amount=Decimal('2.00'))
+        data = self.client.get(url, {'after': cursor}).json()
+        self.assertEqual([voucher['voucher_id'] for voucher in data['vouchers']], [self.bpv.pk])
+        self.assertEqual(len(data['vouchers'][0]['items']), 4)
+        self.assertEqual(self.client.get(url, {'after': 'garbage'}).status_code, 400)
+
+    @override_settings(VOUCHER_API_TOKEN='s3cret')
+    def test_token_is_required_when_set(self):
+        url = reverse('api_voucher', args=[self.cpv.pk])
+        self.assertEqual(self.client.get(url).status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.json()['voucher_id'], self.cpv.pk)
+
+
+class AdminTests(TestCase):
+    """Admin changelists never count or load whole tables"""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+
+    def test_changelists(self):
+        bpv = make_voucher(BankPaymentVoucher, bank='HBL', cheque_no='1234', payee='Zephyr Logistics')
+        for _ in range(5):
+            make_voucher(voucher_type='CPV')
+        for name in ['vouchers_voucher_changelist', 'vouchers_bankpaymentvoucher_changelist', 'vouchers_item_changelist']:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(f'admin:{name}'))
+            self.assertEqual(response.status_code, 200)
+            counts = [query['sql'] for query in queries if 'COUNT(' in query['sql']]
+            self.assertEqual(counts, [], name)
+
+        response = self.client.get(reverse('admin:vouchers_voucher_changelist'), {'q': 'zeph'})
+        self.assertEqual(list(response.context['cl'].result_list), [Voucher.objects.get(pk=bpv.pk)])
+        response = self.client.get(reverse('admin:vouchers_voucher_changelist'), {'voucher_type__exact': 'CPV'})
+        self.assertEqual(response.context['cl'].result_count, 5)
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'term': bpv.pk, 'app_label': 'vouchers', 'model_name': 'item', 'field_name': 'voucher',
+        })
+        self.assertEqual([result['id'] for result in response.json()['results']], [bpv.pk])
+
+    def test_item_str_does_not_query(self):
+        item = Item.objects.get(pk=make_voucher(items=1).items.get().pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(str(item), f'Item for {item.voucher_id} - Line 0')
+
+
+class StaticFilesTests(TestCase):
+    """Collected static files are served by the app under hashed names, compressed and cached for good"""
+
+    def test_collected_assets(self):
+        with tempfile.TemporaryDirectory() as static_root, override_settings(STATIC_ROOT=static_root, DEBUG=False):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            client = Client(HTTP_ACCEPT_ENCODING='br, gzip')
+            html = client.get(reverse('landing_page')).content.decode()
+            stylesheet = re.search(r'href="(/static/css/style\.[0-9a-f]{12}\.css)"', html)
+            self.assertIsNotNone(stylesheet)
+            response = client.get(stylesheet[1])
+            css = brotli.decompress(b''.join(response.streaming_content)).decode()
+            response.close()
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertRegex(css, r'background-960\.[0-9a-f]{12}\.webp')
+
+
+class StaticAssetsTests(TestCase):
+    """The PDF renderer's url_fetcher serves files from the static directories and nothing else"""
+
+    def setUp(self):
+        self.assets = renderer.StaticAssets()
+
+    def test_static_urls_map_to_names(self):
+        for url in ['http://testserver/static/images/logo.png', '/static/images/./logo.png', '/static/css/../images/logo.png']:
+            with self.subTest(url=url):
+                self.assertEqual(self.assets.name_for_url(url), 'images/logo.png')
+        with open(os.path.join(settings.BASE_DIR, 'static', 'images', 'logo.png'), 'rb') as f:
+            self.assertEqual(self.assets.get('images/logo.png'), f.read())
+
+    def test_traversal_is_refused(self):
+        for url in [
+            '/static/../vms/settings.py', '/static/images/../../vms/settings.py', '/static/%2e%2e/vms/settings.py',
+            '/static/images%2f%2e%2e%2f%2e%2e%2fvms/settings.py', '/static//etc/passwd', '/static/%2fetc/passwd',
+        ]:
+            with self.subTest(url=url):
+                self.assertIsNone(self.assets.name_for_url(url))
+        # Names that get past name_for_url some other way still find nothing outside the static directories
+        for name in ['../vms/settings.py', '/etc/passwd', 'images', '.']:
+            with self.subTest(name=name):
+                self.assertIsNone(self.assets.find(name))
+                self.assertIsNone(self.assets.get(name))
+
+    def test_other_urls_fall_through(self):
+        for url in ['/media/logo.png', '/staticfiles/images/logo.png', '/vouchers/CPV-00000001/', 'data:image/png;base64,AAAA']:
+            with self.subTest(url=url):
+                self.assertIsNone(self.assets.name_for_url(url))
+        self.assertIsNone(self.assets.get('images/missing.png'))
+
+
+class WriteLockTests(TestCase):
+    """With VOUCHER_SERIALIZE_WRITES on, write transactions queue instead of overlapping"""
+
+    def test_two_threads_write_one_after_the_other(self):
+        self.enterContext(override_settings(VOUCHER_SERIALIZE_WRITES=True))
+        events, first_inside = [], threading.Event()
+
+        def write(name):
+            try:
+                with locking.write_transaction():
+                    events.append(f'{name} in')
+                    if name == 'first':
+                        first_inside.set()
+                        # Long enough for the second thread to get in, if nothing stopped it
+                        time.sleep(0.2)
+                    events.append(f'{name} out')
+            finally:
+                connection.close()
+
+        first = threading.Thread(target=write, args=['first'])
+        first.start()
+        self.assertTrue(first_inside.wait(5))
+        second = threading.Thread(target=write, args=['second'])
+        second.start()
+        first.join()
+        second.join()
+        self.assertEqual(events, ['first in', 'first out', 'second in', 'second out'])
+
+
+class SearchTests(TestCase):
+    """The FTS5 index is kept in step by triggers, including for bulk inserts"""
+
+    def test_search_follows_writes(self):
+        voucher = make_voucher(payee='Zephyr Logistics', memo='Freight for March')
+        self.assertEqual(search.search('zeph'), [voucher])
+        self.assertEqual(search.search('"line 2"'), [voucher])
+        self.assertEqual(search.search('"2 line"'), [])
+
+        Item.objects.create(voucher=voucher, account='4010', description='Demurrage charges', amount=Decimal('5.00'))
+        self.assertEqual(search.search('demurr'), [voucher])
+        voucher.payee = 'Boreas Shipping'
+        voucher.save()
+        self.assertEqual(search.search('zephyr'), [])
+        self.assertEqual(search.search('boreas freight'), [voucher])
+
+        voucher.delete()
+        self.assertEqual(search.search('boreas'), [])
+
+    def test_bulk_created_vouchers_are_indexed(self):
+        voucher_ids = services.bulk_create_vouchers([
+            ('CPV', {'date': datetime.date(2025, 8, 1), 'payee': 'Payee', 'memo': None, 'prepared_by': 'Clerk'},
+             [{'account': '1001', 'description': f'Accrual {n}', 'amount': Decimal('1.00')}]) for n in range(3)
+        ])
+        self.assertCountEqual([voucher.pk for voucher in search.search('accrual')], voucher_ids)
+        self.assertEqual(search.rebuild(), 3)
+        self.assertEqual(len(search.search('accrual')), 3)
+
+    def test_results_page_shows_amounts_like_the_list(self):
+        make_voucher(payee='Zephyr Logistics', total_amount=Decimal('1250.50'))
+        response = self.client.get(reverse('search_vouchers'), {'q': 'zephyr'})
+        self.assertContains(response, '<td>1250.50</td>', html=True)
+        self.assertNotContains(response, '$')
+
+    def test_query_syntax_is_treated_as_text(self):
+        make_voucher(payee='Acme')
+        self.assertEqual(search.build_query('payee:foo NEAR(a b) "x'), '"payee foo"* "NEAR a"* "b"* "x"')
+        self.assertEqual(search.search('OR AND "'), [])
+
+
+class SummaryTests(TestCase):
+    """Reporting summaries are kept in step with every way vouchers are created or deleted"""
+
+    def test_summaries_follow_creates_and_deletes(self):
+        bpv = services.create_voucher('BPV', {
+            'date': datetime.date(2025, 8, 1), 'payee': 'Acme', 'prepared_by': 'Clerk', 'bank': 'HBL', 'cheque_no': '1',
+        }, [{'account': 'Rent', 'description': 'August', 'amount': Decimal('100.00')}])
+        services.bulk_create_vouchers([
+            ('CRV', {'date': datetime.date(2025, 8, 2), 'payee': 'Acme', 'memo': None, 'prepared_by': 'Clerk'},
+             [{'account': 'Rent', 'description': 'Refund', 'amount': Decimal('30.00')}]),
+        ])
+        self.assertEqual(reports.verify(), [])
+
+        rows, totals = reports.trial_balance(datetime.date(2025, 7, 1), datetime.date(2025, 8, 31))
+        self.assertEqual(rows, [{'account': 'Rent', 'debit': Decimal('100'), 'credit': Decimal('30'), 'balance': Decimal('70')}])
+        self.assertEqual(reports.payee_totals(datetime.date(2025, 8, 1), datetime.date(2025, 8, 31))[0]['total'], Decimal('130'))
+
+        bpv.delete()
+        self.assertEqual(reports.verify(), [])
+        rows, _ = reports.trial_balance(datetime.date(2025, 7, 1), datetime.date(2025, 8, 31))
+        self.assertEqual(rows[0]['debit'], Decimal('0'))
+
+    def test_summaries_follow_orm_edits(self):
+        voucher = services.create_voucher('CPV', {
+            'date': datetime.date(2025, 8, 1), 'payee': 'Acme', 'prepared_by': 'Clerk',
+        }, [{'account': 'Rent', 'description': 'August', 'amount': Decimal('100.00')}])
+        bpv = make_voucher(BankPaymentVoucher, items=0, bank='HBL', cheque_no='1', total_amount=Decimal('5.00'))
+        item = Item.objects.create(voucher=bpv, account='Fuel', description='Trip', amount=Decimal('5.00'))
+        self.assertEqual(reports.verify(), [])
+
+        edits = {
+            'date': lambda: setattr(voucher, 'date', datetime.date(2025, 9, 15)),
+            'payee': lambda: setattr(voucher, 'payee', 'Zed'),
+            'type': lambda: setattr(voucher, 'voucher_type', 'CRV'),
+            'total': lambda: setattr(voucher, 'total_amount', Decimal('150.00')),
+        }
+        for name, edit in edits.items():
+            with self.subTest(edit=name):
+                edit()
+                voucher.save()
+                self.assertEqual(reports.verify(), [])
+        # Fields left out of update_fields aren't saved, so the summaries stay as they are
+        voucher.date = datetime.date(2025, 10, 1)
+        voucher.save(update_fields=['memo'])
+        self.assertEqual(reports.verify(), [])
+        voucher.refresh_from_db()
+
+        Item.objects.create(voucher=voucher, account='Fuel', description='Trip', amount=Decimal('50.00'))
+        self.assertEqual(reports.verify(), [])
+        item.amount, item.account = Decimal('7.50'), 'Supplies'
+        item.save()
+        self.assertEqual(reports.verify(), [])
+        item.voucher = voucher
+        item.save()
+        self.assertEqual(reports.verify(), [])
+        item.delete()
+        self.assertEqual(reports.verify(), [])
+        voucher.items.filter(account='Fuel').delete()
+        self.assertEqual(reports.verify(), [])
+        Voucher.objects.filter(pk__in=[voucher.pk, bpv.pk]).delete()
+        self.assertEqual(reports.verify(), [])
+        self.assertFalse(AccountDailySummary.objects.exclude(item_count=0).exists())
+        self.assertFalse(PayeeMonthlySummary.objects.exclude(voucher_count=0).exists())
+
+    def test_rebuild_repairs_drift(self):
+        # bulk_create sends no signals, so these items aren't in the summaries until a rebuild
+        voucher = make_voucher(voucher_type='CPV')
+        self.assertEqual([model for model, *_ in reports.verify()], ['AccountDailySummary'])
+        reports.rebuild()
+        self.assertEqual(reports.verify(), [])
+        with self.assertNumQueries(1):
+            reports.trial_balance(*reports.year_to_date(voucher.date))
+
+
+class ReconcileTests(TestCase):
+    """reconcile_vouchers finds stored totals that no longer match the items, and repairs them"""
+
+    def setUp(self):
+        # make_voucher stores a total of 0 against items adding up to 30
+        self.stale = make_voucher(voucher_type='CPV')
+        self.good = make_voucher(voucher_type='CPV', items=0)
+        reports.rebuild()
+
+    def test_dry_run_changes_nothing(self):
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, "1 of 2 vouchers don't match"):
+            call_command('reconcile_vouchers', '--dry-run', stdout=out)
+        self.assertIn(f"{self.stale.pk}: stored 0.00 '', items add up to 30.00 'Thirty Rupees only'", out.getvalue())
+        self.assertEqual(Voucher.objects.get(pk=self.stale.pk).total_amount, Decimal('0.00'))
+        self.assertFalse(ReconcileRun.objects.exists())
+
+    def test_repair_and_incremental_run(self):
+        call_command('reconcile_vouchers', stdout=StringIO())
+        voucher = Voucher.objects.get(pk=self.stale.pk)
+        self.assertEqual((voucher.total_amount, voucher.amount_in_words), (Decimal('30.00'), 'Thirty Rupees only'))
+        self.assertEqual(reports.verify(), [])
+        run = ReconcileRun.objects.get()
+        self.assertEqual((run.checked, run.repaired, run.incremental), (2, 1, False))
+
+        # Only the vouchers updated since (with the overlap) are checked the next time
+        old = run.started_at - reconcile.OVERLAP * 2
+        Voucher.objects.update(updated_at=old)
+        Item.objects.filter(voucher=self.stale).update(amount=Decimal('5.00'))
+        Voucher.objects.filter(pk=self.stale.pk).update(updated_at=run.started_at)
+        batches = list(reconcile.reconcile(incremental=True))
+        self.assertEqual([(checked, [m.total for m in mismatches]) for checked, mismatches in batches],
+                         [(1, [Decimal('15.00')])])
+        self.assertEqual(PayeeMonthlySummary.objects.get().total, Decimal('15.00'))
+        self.assertEqual(ReconcileRun.objects.latest('started_at').checked, 1)
+
+
+class ImportTests(TestCase):
+    """import_vouchers reads CSV and JSON Lines alike, reports bad vouchers and resumes only the same file"""
+
+    RECORDS = [
+        {'record': 'voucher', 'ref': 'A1', 'voucher_type': 'CPV', 'date': '2025-08-01', 'payee': 'Acme', 'prepared_by': 'Clerk'},
+        {'record': 'item', 'account': 'Rent', 'description': 'August', 'amount': '100.00'},
+        {'record': 'item', 'account': 'Fuel', 'description': 'Trip', 'amount': '25.50'},
+        {'record': 'voucher', 'ref': 'A2', 'voucher_type': 'CPV', 'date': '2025-08-40', 'payee': 'Acme', 'prepared_by': 'Clerk'},
+        {'record': 'item', 'account': 'Rent', 'description': 'Bad date', 'amount': '1.00'},
+        {'record': 'voucher', 'ref': 'A3', 'voucher_type': 'BPV', 'date': '2025-08-02', 'payee': 'Zed', 'prepared_by': 'Clerk',
+         'bank': 'HBL', 'cheque_no': '77'},
+        {'record': 'item', 'account': 'Supplies', 'description': 'Paper', 'amount': '10.00'},
+        {'record': 'voucher', 'ref': 'A4', 'voucher_type': 'CPV', 'date': '2025-08-03', 'payee': 'Acme', 'prepared_by': 'Clerk'},
+        {'record': 'item', 'account': 'Rent', 'description': 'Deposit', 'amount': 'ten'},
+        {'record': 'voucher', 'ref': 'A5', 'voucher_type': 'CPV', 'date': '2025-08-04', 'payee': 'Acme', 'prepared_by': 'Clerk'},
+        {'record': 'item', 'account': 'Fuel', 'description': 'Trip', 'amount': '5.00'},
+    ]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, records):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', newline='') as f:
+            if name.endswith('.csv'):
+                fields = list(dict.fromkeys(key for record in records for key in record))
+                writer = csv.DictWriter(f, fields)
+                writer.writeheader()
+                writer.writerows(records)
+            else:
+                f.writelines(json.dumps(record) + '\n' for record in records)
+        return path
+
+    def imported(self):
+        return [
+            (v.pk, v.payee, v.total_amount, v.amount_in_words, [item.amount for item in v.items.all()])
+            for v in Voucher.objects.order_by('date').prefetch_related('items')
+        ]
+
+    def test_csv_and_jsonl_import_alike(self):
+        results = {}
+        for name in ['vouchers.csv', 'vouchers.jsonl']:
+            with self.subTest(name=name), open(self.write(name, self.RECORDS), 'rb') as f:
+                result = importer.import_vouchers(f, name.rsplit('.', 1)[1])
+                self.assertEqual((result.imported, result.failed), (3, 2))
+                # Line numbers count the CSV header
+                header = 1 if name.endswith('.csv') else 0
+                self.assertEqual([(line, ref, list(errors)) for line, ref, errors in result.errors],
+                                 [(4 + header, 'A2', ['date']), (8 + header, 'A4', [f'line {9 + header} amount'])])
+                results[name] = [row[1:] for row in self.imported()]
+                Voucher.objects.all().delete()
+        self.assertEqual(results['vouchers.csv'], results['vouchers.jsonl'])
+        self.assertEqual(results['vouchers.csv'][0], ('Acme', Decimal('125.50'), 'One Hundred And Twenty-Five Rupees and Fifty Paisas',
+                                                      [Decimal('100.00'), Decimal('25.50')]))
+
+    def test_ids_are_reserved_in_one_block_per_type(self):
+        make_voucher(voucher_type='CPV', items=0)
+        make_voucher(BankPaymentVoucher, items=0, bank='MCB', cheque_no='1')
+        with open(self.write('vouchers.csv', self.RECORDS), 'rb') as f, CaptureQueriesContext(connection) as queries:
+            importer.import_vouchers(f, 'csv')
+        reservations = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "vouchers_vouchersequence"')]
+        self.assertEqual(len(reservations), 2)
+        self.assertEqual(sorted(pk for pk, *_ in self.imported()),
+                         ['BPV-00000001', 'BPV-00000002', 'CPV-00000001', 'CPV-00000002', 'CPV-00000003'])
+        self.assertEqual(BankPaymentVoucher.objects.get(pk='BPV-00000002').bank, 'HBL')
+
+    def test_resume_only_the_same_file(self):
+        path = self.write('export.csv', self.RECORDS[:7])
+        out = StringIO()
+        call_command('import_vouchers', path, '--batch-size', '1', stdout=out, stderr=StringIO())
+        self.assertIn('Imported 2 vouchers, rejected 1', out.getvalue())
+        # Nothing is read twice
+        call_command('import_vouchers', path, stdout=out, stderr=StringIO())
+        self.assertIn('Imported 0 vouchers, rejected 0', out.getvalue())
+        self.assertEqual(Voucher.objects.count(), 2)
+
+        # Next month's export.csv has other content: refused rather than skipping its first 3 vouchers
+        self.write('export.csv', self.RECORDS[7:])
+        with self.assertRaisesMessage(CommandError, '--restart'):
+            call_command('import_vouchers', path, stdout=StringIO(), stderr=StringIO())
+        call_command('import_vouchers', path, '--restart', stdout=out, stderr=StringIO())
+        self.assertIn('Imported 1 vouchers, rejected 1', out.getvalue())
+        self.assertEqual(Voucher.objects.count(), 3)
+
+
+class ExportTests(TestCase):
+    """The ledger export has one row per item, the same in CSV and XLSX"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bpv = make_voucher(BankPaymentVoucher, items=2, bank='HBL', cheque_no='1234', total_amount=Decimal('20.00'),
+                               memo='Rent, "August"\x07')
+        cls.cpv = make_voucher(voucher_type='CPV', items=0, date=datetime.date(2025, 8, 2), payee='Zed')
+
+    def test_csv_rows(self):
+        rows = list(csv.reader(StringIO(''.join(exports.stream_csv(exports.ledger_rows())))))
+        self.assertEqual(rows[0], exports.HEADER)
+        self.assertEqual(rows[1], [
+            self.bpv.pk, 'BPV', '2025-08-01', 'Acme Traders', 'Rent, "August"\x07', 'Clerk', 'HBL', '1234', '', '',
+            '20.00', 'Twenty Rupees only', '1001', 'Line 0', '10.00',
+        ])
+        self.assertEqual(rows[2][-3:], ['1001', 'Line 1', '10.00'])
+        # A voucher without items still has its row, with the item columns empty
+        self.assertEqual(rows[3][:4] + rows[3][-3:], [self.cpv.pk, 'CPV', '2025-08-02', 'Zed', '', '', ''])
+        self.assertEqual(len(rows), 4)
+
+    def test_xlsx_workbook(self):
+        import openpyxl
+
+        response = self.client.get(reverse('export_ledger'), {'format': 'xlsx', 'payee': 'Acme'})
+        workbook = openpyxl.load_workbook(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(workbook.sheetnames, ['Ledger'])
+        rows = list(workbook.active.values)
+        self.assertEqual(list(rows[0]), exports.HEADER)
+        self.assertEqual(list(rows[1]), [
+            self.bpv.pk, 'BPV', datetime.datetime(2025, 8, 1), 'Acme Traders', 'Rent, "August"', 'Clerk', 'HBL', '1234',
+            None, None, 20.0, 'Twenty Rupees only', '1001', 'Line 0', 10.0,
+        ])
+        self.assertEqual(workbook.active['C2'].number_format, 'mm-dd-yy')
+        self.assertEqual(workbook.active['K2'].number_format, '#,##0.00')
+        self.assertEqual(len(rows), 3)
+
+
+class SeedVouchersTests(TestCase):
+    """manage.py seed_vouchers writes complete vouchers, the same ones for the same seed"""
+
+    def test_seeded_vouchers_are_complete_and_repeatable(self):
+        call_command('seed_vouchers', 40, '--items', '2-3', '--seed', '7', '--end-date', '2025-08-31', stdout=StringIO())
+        self.assertEqual(Voucher.objects.count(), 40)
+        self.assertEqual(BankPaymentVoucher.objects.count(), Voucher.objects.filter(voucher_type='BPV').count())
+        self.assertEqual(BankReceiptVoucher.objects.count(), Voucher.objects.filter(voucher_type='BRV').count())
+        item_counts = set(Voucher.objects.annotate(n=Count('items')).values_list('n', flat=True))
+        self.assertTrue(item_counts <= {2, 3})
+        self.assertEqual(reports.verify(), [])
+
+        generator = synthetic.VoucherGenerator(seed=7, items=(2, 3))
+        payees = [data['payee'] for _, data, _ in generator.records(40, datetime.date(2024, 9, 1), datetime.date(2025, 8, 31))]
+        self.assertEqual(payees, list(Voucher.objects.order_by('date', 'voucher_id').values_list('payee', flat=True)))
+
+
+class PerformanceMiddlewareTests(TestCase):
+    """Requests are timed into Server-Timing, the log and the metrics endpoint"""
+
+    def setUp(self):
+        # Off unless VMS_PERF_METRICS=1; read when the test client loads the middleware
+        self.enterContext(override_settings(VOUCHER_PERF_METRICS=True))
+        performance.reset()
+
+    def test_request_is_timed_and_exported(self):
+        voucher = make_voucher(voucher_type='CPV')
+        with self.assertLogs('vouchers.performance', 'DEBUG') as logs:
+            response = self.client.get(reverse('voucher_detail', args=[voucher.pk]))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('view=voucher_detail method=GET status=200', logs.output[0])
+        self.assertEqual(logs.records[0].queries, 3)
+
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('vms_request_phase_seconds_count{view="voucher_detail",phase="sql"} 1', metrics)
+        self.assertIn('vms_sql_queries_total{view="voucher_detail"} 3', metrics)
+
+    def test_unnamed_views_are_labelled_with_their_path(self):
+        request = RequestFactory().get('/')
+        request.resolver_match = ResolverMatch(views.voucher_list, (), {}, url_name=None)
+        middleware = performance.PerformanceMiddleware(lambda request: HttpResponse())
+        middleware(request)
+        self.assertIn('view="vouchers.views.voucher_list"', performance.prometheus_text())
+
+
+class StartupTests(TestCase):
+    def test_urlconf_does_not_import_the_pdf_engine(self):
+        script = (
+            "import sys, django; django.setup(); from django.urls import resolve; resolve('/vouchers/'); "
+            "print('weasyprint' in sys.modules)"
+        )
+        env = {**os.environ, 'VMS_PDF_PRELOAD': '0'}
+        output = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), 'False')
+
+
+class ArchiveTests(TransactionTestCase):
+    """Closing a fiscal year moves it to a read-only archive that the voucher page, search and reports still read"""
+
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        override = override_settings(VOUCHER_ARCHIVE_DIR=archive_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.old = services.create_voucher(
+            'BPV', {'date': datetime.date(2023, 8, 1), 'payee': 'Zephyr Logistics', 'prepared_by': 'Clerk',
+                    'bank': 'HBL', 'cheque_no': '1234'},
+            [{'account': '1001', 'description': 'Freight', 'amount': Decimal('25.00')}],
+        )
+        self.live = services.create_voucher(
+            'CPV', {'date': datetime.date(2024, 8, 1), 'payee': 'Acme Traders', 'prepared_by': 'Clerk'},
+            [{'account': '1001', 'description': 'Stationery', 'amount': Decimal('10.00')}],
+        )
+
+    def use_archives(self):
+        """Lets the test query the archives, which didn't exist when TransactionTestCase listed the allowed databases"""
+        aliases, allowed = archive.databases(), type(self).databases
+        type(self).databases = allowed | set(aliases)
+
+        def forget():
+            type(self).databases = allowed
+            for alias in aliases:
+                connections[alias].close()
+                del connections[alias]
+                del connections.settings[alias]
+        self.addCleanup(forget)
+
+    def test_archive_year(self):
+        call_command('archive_year', '2023', stdout=StringIO())
+        self.use_archives()
+        self.assertEqual(list(Voucher.objects.values_list('pk', flat=True)), [self.live.pk])
+
+        response = self.client.get(self.old.get_absolute_url())
+        self.assertContains(response, 'Zephyr Logistics')
+        self.assertContains(response, 'Archived')
+        self.assertEqual([(voucher.pk, voucher._state.db) for voucher in search.search('zephyr')],
+                         [(self.old.pk, 'archive_2023')])
+        _, totals = reports.trial_balance(datetime.date(2023, 7, 1), datetime.date(2024, 6, 30))
+        self.assertEqual(totals['debit'], Decimal('25.00'))
+        self.assertEqual(reports.verify(), [])
+
+        with self.assertRaises(archive.ClosedYearError):
+            Voucher.objects.using('archive_2023').get(pk=self.old.pk).save()
+        form = VoucherForm({'date': '2023-09-01', 'payee': 'Acme Traders', 'prepared_by': 'Clerk'})
+        self.assertIn('date', form.errors)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        response = self.client.post(reverse('admin:vouchers_voucher_change', args=[self.live.pk]), {
+            'voucher_type': 'CPV', 'date': '2023-09-01', 'payee': 'Acme Traders', 'prepared_by': 'Clerk',
+            'items-TOTAL_FORMS': '0', 'items-INITIAL_FORMS': '0',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('date', response.context['adminform'].form.errors)
+        self.assertEqual(Voucher.objects.get(pk=self.live.pk).date, datetime.date(2024, 8, 1))
+        with self.assertRaisesMessage(CommandError, 'archived already'):
+            call_command('archive_year', '2023')
+
+    def test_years_are_listed_when_the_directory_changes(self):
+        directory = archive.archive_dir()
+        self.assertEqual(archive.years(), [])
+        stat = os.stat(directory)
+        (directory / 'fy2022.sqlite3').touch()
+        os.utime(directory, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(archive.years(), [])
+        os.utime(directory, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertEqual(archive.years(), [2022])
+        (directory / 'fy2022.sqlite3').unlink()
+        os.utime(directory, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        archive.forget_years()
+        self.assertEqual(archive.years(), [])
+
+    def test_mismatch_keeps_live_rows(self):
+        AccountDailySummary.objects.filter(date__year=2023).update(total=0)
+        with self.assertRaisesMessage(CommandError, 'rebuild_summaries'):
+            call_command('archive_year', '2023')
+        self.assertEqual(archive.years(), [])
+        self.assertTrue(Voucher.objects.filter(pk=self.old.pk).exists())
@@ -1,12 +1,35 @@
 # vouchers/urls.py
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Under ASGI (VOUCHER_ASYNC_VIEWS, set by vms/asgi.py) the busiest pages are served by their async versions
+if getattr(settings, 'VOUCHER_ASYNC_VIEWS', False):
+    voucher_list, voucher_detail = views.voucher_list_async, views.voucher_detail_async
+    download_voucher_pdf, api_voucher = views.download_voucher_pdf_async, views.api_voucher_async
+else:
+    voucher_list, voucher_detail = views.voucher_list, views.voucher_detail
+    download_voucher_pdf, api_voucher = views.download_voucher_pdf, views.api_voucher
+
 urlpatterns = [
     path('', views.landing_page, name='landing_page'),
-    path('vouchers/', views.voucher_list, name='voucher_list'),
+    path('vouchers/', voucher_list, name='voucher_list'),
     path('new-voucher/', views.create_voucher, name='create_voucher'),
+    path('vouchers/print/', views.batch_print, name='batch_print'),
+    path('vouchers/import/', views.import_vouchers, name='import_vouchers'),
+    path('vouchers/export/', views.export_ledger, name='export_ledger'),
+    path('vouchers/search/', views.search_vouchers, name='search_vouchers'),
+    path('vouchers/search.json', views.search_vouchers_json, name='search_vouchers_json'),
+    path('reports/trial-balance/', views.trial_balance, name='trial_balance'),
+    path('reports/periods/', views.period_totals, name='period_totals'),
+    path('reports/payees/', views.payee_totals, name='payee_totals'),
     # Use <str:voucher_id> because our pk is now a string
-    path('vouchers/<str:voucher_id>/', views.voucher_detail, name='voucher_detail'),
-    path('vouchers/<str:voucher_id>/download/', views.download_voucher_pdf, name='download_voucher_pdf'),
+    path('vouchers/<str:voucher_id>/', voucher_detail, name='voucher_detail'),
+    path('vouchers/<str:voucher_id>/download/', download_voucher_pdf, name='download_voucher_pdf'),
+    path('vouchers/<str:voucher_id>/render/', views.queue_voucher_pdf, name='queue_voucher_pdf'),
+    path('pdf-jobs/<int:job_id>/', views.pdf_job_status, name='pdf_job_status'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('api/v1/vouchers/', views.api_vouchers, name='api_vouchers'),
+    path('api/v1/vouchers/changes/', views.api_voucher_changes, name='api_voucher_changes'),
+    path('api/v1/vouchers/<str:voucher_id>/', api_voucher, name='api_voucher'),
 ]
\ No newline at end of file
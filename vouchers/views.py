@@ -1,25 +1,156 @@
 # vouchers/views.py
+import hashlib
+import json
+import tempfile
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db import transaction
-from django.db.models import F, Window
-from django.db.models.functions import Lag, Lead
-from django.core.paginator import Paginator
-from django.http import HttpResponse
-from django.template.loader import render_to_string
-from weasyprint import HTML, CSS
-from .models import Voucher, BankPaymentVoucher, BankReceiptVoucher, Item
-from .forms import VoucherForm, ItemFormSet
-from weasyprint import HTML, CSS # Make sure CSS is imported from weasyprint
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F, FilteredRelation, Q
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_http_methods, require_POST
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date, urlencode
+from .models import Voucher, BankPaymentVoucher, BankReceiptVoucher, Item, PdfRenderJob, VoucherNavigation
+from .forms import (
+    VoucherForm, ItemFormSet, BatchPrintForm, ImportVouchersForm, ExportForm,
+    ReportForm, PeriodReportForm, PayeeReportForm,
+)
+from . import services, pdf_cache, pdf_jobs, pdf_pool, importer, exports, search, reports, performance, navigation, api, archive
+from . import batch_print as batch_print_service
+from .pagination import keyset_page, akeyset_page, approximate_count, aapproximate_count
+from .pdf import pdf_filename
+
+def page_etag(*parts):
+    """A strong ETag built from everything a page's content depends on"""
+    return '"{}"'.format(hashlib.sha256(repr(parts).encode()).hexdigest()[:32])
+
+def set_validators(response, etag, last_modified=None):
+    """Adds ETag/Last-Modified and has browsers revalidate on every visit, which is cheap when nothing changed"""
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 def landing_page(request):
     return render(request, 'vouchers/landing_page.html')
 
 def voucher_list(request):
-    vouchers = Voucher.objects.all().order_by('-date', '-voucher_id')
-    paginator = Paginator(vouchers, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    return render(request, 'vouchers/voucher_list.html', {'page_obj': page_obj})
+    # Cursor pagination: ?after=/?before= tokens instead of page numbers, so deep pages cost the same as page 1
+    page_obj = keyset_page(
+        Voucher.objects.all(),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+    # An exact total needs a full COUNT(*), so it is only done on request
+    count_is_exact = request.GET.get('count') == 'exact'
+    total_count = Voucher.objects.count() if count_is_exact else approximate_count()
+    return voucher_list_page(request, page_obj, total_count, count_is_exact)
+
+async def voucher_list_async(request):
+    """voucher_list with the async ORM, served under ASGI"""
+    page_obj = await akeyset_page(
+        Voucher.objects.all(),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+    count_is_exact = request.GET.get('count') == 'exact'
+    total_count = await Voucher.objects.acount() if count_is_exact else await aapproximate_count()
+    return voucher_list_page(request, page_obj, total_count, count_is_exact)
+
+def voucher_list_page(request, page_obj, total_count, count_is_exact):
+    # The exact count link stays on the page being shown
+    cursor = {key: request.GET[key] for key in ('after', 'before') if request.GET.get(key)}
+    exact_count_query = urlencode({**cursor, 'count': 'exact'})
+    # The queries above are cheap index lookups; rendering is what a 304 saves
+    etag = page_etag(
+        count_is_exact, total_count, page_obj.next_cursor, page_obj.previous_cursor, exact_count_query,
+        *[(voucher.voucher_id, voucher.updated_at.isoformat()) for voucher in page_obj],
+    )
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return set_validators(not_modified, etag)
+    context = {
+        'page_obj': page_obj,
+        'total_count': total_count,
+        'count_is_exact': count_is_exact,
+        'exact_count_query': exact_count_query,
+    }
+    return set_validators(render(request, 'vouchers/voucher_list.html', context), etag)
+
+def search_vouchers(request):
+    """Search box results page; the same search is available as JSON from search_vouchers_json"""
+    query = request.GET.get('q', '').strip()
+    results = search.search(query) if query else []
+    return render(request, 'vouchers/search.html', {'query': query, 'results': results})
+
+def search_vouchers_json(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = int(request.GET.get('limit', 20))
+    except ValueError:
+        limit = 20
+    results = search.search(query, limit=max(limit, 1)) if query else []
+    return JsonResponse({
+        'query': query,
+        'results': [
+            {
+                'voucher_id': voucher.voucher_id,
+                'voucher_type': voucher.voucher_type,
+                'date': voucher.date,
+                'payee': voucher.payee,
+                'total_amount': voucher.total_amount,
+                'snippet': voucher.search_snippet,
+                'url': voucher.get_absolute_url(),
+            }
+            for voucher in results
+        ],
+    })
+
+# The report views read only the summary tables (see reports.py), never Item or Voucher
+
+def trial_balance(request):
+    form = ReportForm(request.GET or None)
+    form.is_valid()
+    start_date, end_date = form.date_range()
+    rows, totals = reports.trial_balance(start_date, end_date)
+    context = {'form': form, 'rows': rows, 'totals': totals, 'start_date': start_date, 'end_date': end_date}
+    return render(request, 'vouchers/trial_balance.html', context)
+
+def period_totals(request):
+    form = PeriodReportForm(request.GET or None)
+    form.is_valid()
+    start_date, end_date = form.date_range()
+    period = form.cleaned_data.get('period') if form.is_bound else None
+    voucher_types = Voucher.VOUCHER_TYPE_CHOICES
+    rows = [
+        (start, [by_type.get(code) for code, _ in voucher_types], total)
+        for start, by_type, total in reports.period_totals(start_date, end_date, period or 'month')
+    ]
+    context = {
+        'form': form, 'rows': rows, 'voucher_types': voucher_types, 'period': period or 'month',
+        'start_date': start_date, 'end_date': end_date,
+    }
+    return render(request, 'vouchers/period_totals.html', context)
+
+def payee_totals(request):
+    form = PayeeReportForm(request.GET or None)
+    form.is_valid()
+    start_date, end_date = form.date_range()
+    voucher_type = form.cleaned_data.get('voucher_type') if form.is_bound else None
+    rows = reports.payee_totals(start_date, end_date, voucher_type=voucher_type)
+    context = {'form': form, 'rows': rows, 'start_date': start_date, 'end_date': end_date}
+    return render(request, 'vouchers/payee_totals.html', context)
 
 def create_voucher(request):
     if request.method == 'POST':
@@ -28,40 +159,7 @@ def create_voucher(request):
         voucher_type = request.POST.get('voucher_type')
 
         if voucher_form.is_valid() and item_formset.is_valid():
-            with transaction.atomic():
-                common_data = {
-                    'date': voucher_form.cleaned_data['date'],
-                    'payee': voucher_form.cleaned_data['payee'],
-                    'memo': voucher_form.cleaned_data['memo'],
-                    'prepared_by': voucher_form.cleaned_data['prepared_by'],
-                }
-
-                if voucher_type == 'BPV':
-                    voucher = BankPaymentVoucher.objects.create(
-                        **common_data,
-                        bank=voucher_form.cleaned_data['bank'],
-                        cheque_no=voucher_form.cleaned_data['cheque_no']
-                    )
-                elif voucher_type == 'BRV':
-                    voucher = BankReceiptVoucher.objects.create(
-                        **common_data,
-                        bank=voucher_form.cleaned_data['bank'],
-                        inst_type=voucher_form.cleaned_data['inst_type'],
-                        inst_no=voucher_form.cleaned_data['inst_no']
-                    )
-                else: # CPV or CRV
-                    voucher = Voucher.objects.create(
-                        **common_data,
-                        voucher_type=voucher_type
-                    )
-                
-                item_formset.instance = voucher
-                item_formset.save()
-                
-                # Recalculate total and save again to generate amount_in_words
-                voucher.total_amount = voucher.calculate_total()
-                voucher.save()
-
+            voucher = services.create_voucher_from_forms(voucher_type, voucher_form, item_formset)
             return redirect(voucher.get_absolute_url())
     else:
         voucher_form = VoucherForm()
@@ -74,108 +172,420 @@ def create_voucher(request):
     }
     return render(request, 'vouchers/create_voucher.html', context)
 
+def export_ledger(request):
+    """Streams items joined with their vouchers as CSV or XLSX; the file is never built in memory"""
+    form = ExportForm(request.GET if 'format' in request.GET else None)
+    if not form.is_valid():
+        return render(request, 'vouchers/export_ledger.html', {'form': form})
+
+    file_format = form.cleaned_data['format']
+    response = StreamingHttpResponse(
+        exports.stream_export(file_format, **form.filters()),
+        content_type=exports.CONTENT_TYPES[file_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="ledger.{file_format}"'
+    return response
+
+def import_vouchers(request):
+    """Upload endpoint for importer.import_vouchers(); large migrations should use manage.py import_vouchers"""
+    result = None
+    if request.method == 'POST':
+        form = ImportVouchersForm(request.POST, request.FILES)
+        if form.is_valid():
+            result = importer.import_vouchers(form.cleaned_data['file'].file, form.file_format())
+    else:
+        form = ImportVouchersForm()
+    return render(request, 'vouchers/import_vouchers.html', {'form': form, 'result': result})
+
 # vouchers/views.py
 
 def voucher_detail(request, voucher_id):
-    # Get the main voucher object for display
-    voucher_base = get_object_or_404(Voucher, pk=voucher_id)
+    # One lookup by primary key gives everything the page depends on: when the voucher or one of its
+    # items last changed (updated_at) and, from its stored navigation links, which vouchers the arrows
+    # point to. An unchanged page is answered 304 from that alone, without loading the items or rendering anything.
+    scope = nav_scope(request)
+    using = DEFAULT_DB_ALIAS
+    state = page_state(voucher_id, scope, using).first()
+    if state is None:
+        # Not live: it may be in the archive of a closed fiscal year
+        using = archive.locate(voucher_id)
+        state = using and page_state(voucher_id, scope, using).first()
+    if state is None:
+        return old_voucher_id_redirect(voucher_id)
+
+    etag, last_modified = detail_validators(voucher_id, scope, state)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return set_validators(not_modified, etag, last_modified)
+
+    # Only loaded (bank fields and items in two queries) when the voucher_content fragment isn't cached
+    voucher = SimpleLazyObject(
+        lambda: Voucher.objects.using(using).with_details().get(pk=voucher_id).get_child_instance()
+    )
+    context = detail_context(voucher_id, scope, using, state, voucher)
+    return set_validators(render(request, 'vouchers/voucher_detail.html', context), etag, last_modified)
+
+async def voucher_detail_async(request, voucher_id):
+    """voucher_detail with the async ORM, served under ASGI"""
+    scope = nav_scope(request)
+    using = DEFAULT_DB_ALIAS
+    state = await page_state(voucher_id, scope, using).afirst()
+    if state is None:
+        using = await sync_to_async(archive.locate)(voucher_id)
+        state = using and await page_state(voucher_id, scope, using).afirst()
+    if state is None:
+        return await sync_to_async(old_voucher_id_redirect)(voucher_id)
+
+    etag, last_modified = detail_validators(voucher_id, scope, state)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return set_validators(not_modified, etag, last_modified)
+
+    # Templates can't query from the event loop, so the voucher isn't left to the template to load:
+    # the cached fragment is looked up here, and the voucher loaded only if it is missing
+    key = make_template_fragment_key('voucher_content', [voucher_id, state['updated_at'].isoformat()])
+    fragment = await fragment_cache().aget(key)
+    voucher = None
+    if fragment is None:
+        voucher = (await Voucher.objects.using(using).with_details().aget(pk=voucher_id)).get_child_instance()
+    context = detail_context(voucher_id, scope, using, state, voucher, fragment)
+    return set_validators(render(request, 'vouchers/voucher_detail.html', context), etag, last_modified)
+
+def old_voucher_id_redirect(voucher_id):
+    """Live vouchers numbered before IDs were padded to Voucher.ID_DIGITS moved to the padded ID"""
+    canonical = Voucher.canonical_voucher_id(voucher_id)
+    if canonical == voucher_id or not Voucher.objects.filter(pk=canonical).exists():
+        raise Http404("No Voucher matches the given query.")
+    return redirect('voucher_detail', canonical, permanent=True)
+
+def nav_scope(request):
+    """The navigation scope asked for with ?nav=, or the default one"""
+    scope = request.GET.get('nav')
+    return scope if scope in navigation.SCOPES else navigation.default_scope()
+
+def page_state(voucher_id, scope, using):
+    """The voucher's updated_at and its navigation links in `scope`, as a one-row values() queryset"""
+    return Voucher.objects.using(using).filter(pk=voucher_id).annotate(
+        link=FilteredRelation('navigation', condition=Q(navigation__scope=scope)),
+    ).values('updated_at', next_id=F('link__next_id'), prev_id=F('link__prev_id'))
+
+def fragment_cache():
+    """The cache {% cache %} keeps template fragments in"""
+    return caches['template_fragments'] if 'template_fragments' in settings.CACHES else caches[DEFAULT_CACHE_ALIAS]
+
+def detail_validators(voucher_id, scope, state):
+    """(ETag, Last-Modified timestamp) of a voucher page"""
+    etag = page_etag(voucher_id, state['updated_at'].isoformat(), scope, state['next_id'], state['prev_id'])
+    return etag, int(state['updated_at'].timestamp())
+
+def detail_context(voucher_id, scope, using, state, voucher, cached_content=None):
+    return {
+        'voucher': voucher,
+        'voucher_id': voucher_id,
+        # The voucher_content fragment, when the view has already read it from the cache
+        'cached_content': cached_content,
+        'archived': archive.is_archive(using),
+        'content_version': state['updated_at'].isoformat(),
+        'content_cache_seconds': getattr(settings, 'VOUCHER_FRAGMENT_CACHE_SECONDS', 86400),
+        'next_id': state['next_id'],
+        'prev_id': state['prev_id'],
+        'nav_scope': scope,
+        # Kept on the arrows when it isn't the default
+        'nav_query': f'?nav={scope}' if scope != navigation.default_scope() else '',
+        'nav_scopes': VoucherNavigation.SCOPE_CHOICES,
+    }
+
+
+
+def download_voucher_pdf(request, voucher_id):
+    """
+    Serves the voucher as a PDF from the dedicated, self-contained print template.
+    Rendered PDFs are cached on disk by content, and the same key doubles as the ETag.
+    """
+    voucher_base = Voucher.objects.with_details().filter(pk=voucher_id).first()
+    if voucher_base is None:
+        using = archive.locate(voucher_id)
+        if using is None:
+            raise Http404("No Voucher matches the given query.")
+        voucher_base = Voucher.objects.using(using).with_details().get(pk=voucher_id)
     voucher = voucher_base.get_child_instance()
 
-    # --- NEW NAVIGATION LOGIC THAT AVOIDS WINDOW FUNCTIONS ---
+    key = pdf_cache.content_key(voucher)
+    etag = f'"{key}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    # Render jobs live next to live vouchers; the rare archived PDF is rendered in the request
+    if queues_pdf(voucher):
+        # Don't render in the request: serve a cached copy or hand the work to run_pdf_worker
+        pdf_file = pdf_cache.get(voucher.voucher_id, key)
+        if pdf_file is None:
+            try:
+                job = pdf_jobs.enqueue(voucher.voucher_id, request.build_absolute_uri('/'))
+            except pdf_jobs.QueueFull:
+                return queue_full_response()
+            return render(request, 'vouchers/pdf_job.html', {'voucher': voucher, 'job': job}, status=202)
+    else:
+        pdf_file = pdf_cache.get_or_render(voucher, request.build_absolute_uri('/'), key=key)
+    return pdf_response(voucher, pdf_file, etag)
+
+
+async def download_voucher_pdf_async(request, voucher_id):
+    """download_voucher_pdf served under ASGI: renders run on the bounded pdf_pool, never on the event loop"""
+    voucher_base = await Voucher.objects.with_details().filter(pk=voucher_id).afirst()
+    if voucher_base is None:
+        using = await sync_to_async(archive.locate)(voucher_id)
+        if using is None:
+            raise Http404("No Voucher matches the given query.")
+        voucher_base = await Voucher.objects.using(using).with_details().aget(pk=voucher_id)
+    voucher = voucher_base.get_child_instance()
 
-    # Find the next voucher
-    next_voucher = Voucher.objects.filter(voucher_id__gt=voucher_id).order_by('voucher_id').first()
+    key = pdf_cache.content_key(voucher)
+    etag = f'"{key}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    if queues_pdf(voucher):
+        pdf_file = pdf_cache.get(voucher.voucher_id, key)
+        if pdf_file is None:
+            try:
+                job = await sync_to_async(pdf_jobs.enqueue)(voucher.voucher_id, request.build_absolute_uri('/'))
+            except pdf_jobs.QueueFull:
+                return queue_full_response()
+            return render(request, 'vouchers/pdf_job.html', {'voucher': voucher, 'job': job}, status=202)
+    else:
+        try:
+            pdf_file = await pdf_pool.run(
+                pdf_cache.get_or_render, voucher, request.build_absolute_uri('/'), key=key,
+            )
+        except pdf_pool.Busy:
+            return queue_full_response()
+    return pdf_response(voucher, pdf_file, etag)
 
-    # Find the previous voucher
-    prev_voucher = Voucher.objects.filter(voucher_id__lt=voucher_id).order_by('-voucher_id').first()
 
-    # --- END NEW LOGIC ---
+def queues_pdf(voucher):
+    """Whether an uncached PDF of the voucher goes to run_pdf_worker instead of being rendered in the request"""
+    return pdf_jobs.async_enabled() and not archive.is_archive(voucher._state.db)
 
-    context = {
-        'voucher': voucher,
-        'next_id': next_voucher.voucher_id if next_voucher else None,
-        'prev_id': prev_voucher.voucher_id if prev_voucher else None,
-    }
-    return render(request, 'vouchers/voucher_detail.html', context)
-# vouchers/views.py
-''' 2nd
-def voucher_detail(request, voucher_id):
-    # Step 1: Get the specific voucher object we are viewing. This is for the main display.
-    voucher_base = get_object_or_404(Voucher, pk=voucher_id)
-    voucher = voucher_base.get_child_instance()
 
-    # --- CORRECTED NAVIGATION LOGIC ---
+def pdf_response(voucher, pdf_file, etag):
+    response = HttpResponse(pdf_file, content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="{pdf_filename(voucher)}"'
+    response['ETag'] = etag
+    return response
 
-    # Step 2: Annotate the ENTIRE Voucher table to find the next/prev IDs for every row.
-    # The `order_by` argument inside Lead/Lag defines the window's ordering.
-    annotated_queryset = Voucher.objects.annotate(
-        next_id=Lead('voucher_id', order_by=F('voucher_id').asc()),
-        prev_id=Lag('voucher_id', order_by=F('voucher_id').asc())
-    )
 
-    # Step 3: Now that all rows are annotated, filter down to the specific one we need.
-    nav_voucher = annotated_queryset.filter(pk=voucher_id).first()
-    
-    # --- END CORRECTION ---
+def queue_full_response():
+    response = JsonResponse({'error': 'Too many PDFs are being rendered, try again shortly.'}, status=503)
+    response['Retry-After'] = '5'
+    return response
 
-    context = {
-        'voucher': voucher,
-        'next_id': nav_voucher.next_id if nav_voucher else None,
-        'prev_id': nav_voucher.prev_id if nav_voucher else None,
+
+def pdf_job_data(job):
+    return {
+        'id': job.pk,
+        'voucher_id': job.voucher_id,
+        'status': job.status,
+        'queue_position': pdf_jobs.queue_position(job),
+        'error': job.error,
+        'status_url': reverse('pdf_job_status', args=[job.pk]),
+        'download_url': reverse('download_voucher_pdf', args=[job.voucher_id]) if job.status == PdfRenderJob.DONE else None,
     }
-    return render(request, 'vouchers/voucher_detail.html', context)
 
-    2nd 
-    '''
-# ---------------
-'''
-def voucher_detail(request, voucher_id):
-    voucher_base = get_object_or_404(Voucher, pk=voucher_id)
-    voucher = voucher_base.get_child_instance() # Get the specific child instance
 
-    # Navigation logic for Next/Previous
-    # window = Window(expression=F('voucher_id'), order_by=F('voucher_id').asc())
-    window = Window(order_by=F('voucher_id').asc())
-    nav_vouchers = Voucher.objects.annotate(
-        next_id=Lead('voucher_id', over=window),
-        prev_id=Lag('voucher_id', over=window)
-    ).filter(pk=voucher_id).first()
+@csrf_exempt
+@require_POST
+def queue_voucher_pdf(request, voucher_id):
+    """
+    Queues a background render of the voucher PDF and returns the job to poll.
+    For API clients, so like the API it takes VOUCHER_API_TOKEN (or a staff login). Only a
+    request with the token is spared the CSRF check: a browser, logged in or not (no token
+    set), can't be made to queue renders from another site.
+    """
+    denied = api_denied(request) or csrf_denied(request)
+    if denied:
+        return denied
+    voucher = get_object_or_404(Voucher, pk=voucher_id)
+    try:
+        job = pdf_jobs.enqueue(voucher.voucher_id, request.build_absolute_uri('/'))
+    except pdf_jobs.QueueFull:
+        return queue_full_response()
+    return JsonResponse(pdf_job_data(job), status=202)
 
-    context = {
-        'voucher': voucher,
-        'next_id': nav_vouchers.next_id if nav_vouchers else None,
-        'prev_id': nav_vouchers.prev_id if nav_vouchers else None,
-    }
-    return render(request, 'vouchers/voucher_detail.html', context)
-'''
 
+def pdf_job_status(request, job_id):
+    job = get_object_or_404(PdfRenderJob, pk=job_id)
+    return JsonResponse(pdf_job_data(job))
 
 
-def download_voucher_pdf(request, voucher_id):
+def has_bearer_token(request, token):
+    """Whether the request carries "Authorization: Bearer <token>"; never when no token is configured"""
+    return bool(token) and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+
+def metrics(request):
+    """Request timings of this process (see performance.py) in Prometheus text format, for staff or a bearer token"""
+    token = getattr(settings, 'VOUCHER_METRICS_TOKEN', None)
+    if not (request.user.is_active and request.user.is_staff) and not has_bearer_token(request, token):
+        return HttpResponse('Staff login or a metrics token is required.', status=403, content_type='text/plain')
+    return HttpResponse(performance.prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# --- Read-only JSON API for integrations (see api.py), under /api/v1/ ---
+
+def api_error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+def api_denied(request, user=None):
     """
-    Generates a PDF from the dedicated, self-contained print template.
+    A 403 response if VOUCHER_API_TOKEN is set and the request has neither it nor a staff login.
+    Async views pass the user from request.auser(), as request.user can't be loaded on the event loop.
     """
-    voucher_base = get_object_or_404(Voucher, pk=voucher_id)
-    voucher = voucher_base.get_child_instance()
+    token = getattr(settings, 'VOUCHER_API_TOKEN', None)
+    user = user or request.user
+    if not token or has_bearer_token(request, token) or (user.is_active and user.is_staff):
+        return None
+    return api_error('An API token ("Authorization: Bearer <token>") or a staff login is required.', status=403)
 
-    # Render the DEDICATED print template
-    html_string = render_to_string(
-        'vouchers/voucher_print_template.html',
-        {'voucher': voucher}
-    )
 
-    # Convert to PDF. The base_url is still crucial for finding the logo image.
-    pdf_file = HTML(
-        string=html_string,
-        base_url=request.build_absolute_uri('/')
-    ).write_pdf()
+def csrf_denied(request):
+    """The CSRF middleware's 403 for a POST that doesn't carry VOUCHER_API_TOKEN, or None"""
+    token = getattr(settings, 'VOUCHER_API_TOKEN', None)
+    if token and has_bearer_token(request, token):
+        return None
+    return CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
 
-    # Create the HTTP response
-    response = HttpResponse(pdf_file, content_type='application/pdf')
-    filename = f"{voucher.voucher_id}_{voucher.date}.pdf"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
 
-    return response
+def api_response(request, data, etag):
+    """JSON with an ETag; 304 when a GET already has it (POSTed batch fetches are always answered in full)"""
+    if request.method in ('GET', 'HEAD'):
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return set_validators(not_modified, etag)
+    return set_validators(JsonResponse(data()), etag)
+
+
+def row_versions(rows):
+    return [(row['voucher_id'], row['updated_at'].isoformat()) for row in rows]
+
+
+@csrf_exempt
+@gzip_page
+@require_http_methods(['GET', 'HEAD', 'POST'])
+def api_vouchers(request):
+    """
+    Batch fetch in a fixed number of queries: GET ?ids=BPV-00000001,CPV-00000002&fields=...,
+    or for long lists POST {"ids": [...], "fields": [...]} (read-only all the same).
+    """
+    denied = api_denied(request)
+    if denied:
+        return denied
+    try:
+        if request.method == 'POST':
+            try:
+                body = json.loads(request.body or b'{}')
+            except ValueError:
+                raise api.ApiError("The request body must be a JSON object.")
+            if not isinstance(body, dict) or not isinstance(body.get('ids'), list):
+                raise api.ApiError('The request body must be a JSON object with an "ids" list.')
+            voucher_ids, fields = api.parse_ids(body['ids']), api.parse_fields(body.get('fields'))
+        else:
+            voucher_ids, fields = api.parse_ids(request.GET.getlist('ids')), api.parse_fields(request.GET.get('fields'))
+    except api.ApiError as error:
+        return api_error(str(error))
+    rows, missing = api.fetch(voucher_ids, fields)
+    etag = page_etag(fields, missing, row_versions(rows))
+    return api_response(request, lambda: {'vouchers': api.serialize(rows, fields), 'missing': missing}, etag)
+
+
+@gzip_page
+@require_http_methods(['GET', 'HEAD'])
+def api_voucher_changes(request):
+    """Incremental sync: vouchers changed since ?after=<cursor>, oldest first, ?limit= at a time"""
+    denied = api_denied(request)
+    if denied:
+        return denied
+    try:
+        fields = api.parse_fields(request.GET.get('fields'))
+        try:
+            limit = min(max(int(request.GET.get('limit', api.page_size())), 1), api.batch_limit())
+        except ValueError:
+            raise api.ApiError("limit must be a number.")
+        rows, cursor, more = api.changes(request.GET.get('after'), limit, fields)
+    except api.ApiError as error:
+        return api_error(str(error))
+    etag = page_etag(fields, cursor, more, row_versions(rows))
+    return api_response(
+        request, lambda: {'vouchers': api.serialize(rows, fields), 'cursor': cursor, 'more': more}, etag,
+    )
+
+
+@gzip_page
+@require_http_methods(['GET', 'HEAD'])
+def api_voucher(request, voucher_id):
+    denied = api_denied(request)
+    if denied:
+        return denied
+    try:
+        fields = api.parse_fields(request.GET.get('fields'))
+    except api.ApiError as error:
+        return api_error(str(error))
+    rows, _ = api.fetch([voucher_id], fields)
+    if not rows:
+        return api_error(f"No voucher {voucher_id}.", status=404)
+    etag = page_etag(fields, row_versions(rows))
+    return api_response(request, lambda: api.serialize(rows, fields)[0], etag)
+
+
+@gzip_page
+@require_http_methods(['GET', 'HEAD'])
+async def api_voucher_async(request, voucher_id):
+    """api_voucher with the async ORM, served under ASGI"""
+    denied = api_denied(request, await request.auser())
+    if denied:
+        return denied
+    try:
+        fields = api.parse_fields(request.GET.get('fields'))
+    except api.ApiError as error:
+        return api_error(str(error))
+    rows, _ = await api.afetch([voucher_id], fields)
+    if not rows:
+        return api_error(f"No voucher {voucher_id}.", status=404)
+    etag = page_etag(fields, row_versions(rows))
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return set_validators(not_modified, etag)
+    return set_validators(JsonResponse((await api.aserialize(rows, fields))[0]), etag)
+
+
+def batch_print(request):
+    """
+    Prints every voucher matching a filter as one PDF (one voucher per page) or a ZIP of PDFs.
+    The file is written to a temporary file and streamed from there, not built in memory.
+    """
+    form = BatchPrintForm(request.GET or None)
+    if not form.is_valid():
+        return render(request, 'vouchers/batch_print.html', {'form': form})
+
+    vouchers = batch_print_service.select_vouchers(**form.filters())
+    limit = getattr(settings, 'VOUCHER_BATCH_PRINT_LIMIT', 500)
+    if vouchers.count() > limit:
+        form.add_error(None, f"That matches more than {limit} vouchers. Narrow the filter or use manage.py print_vouchers.")
+        return render(request, 'vouchers/batch_print.html', {'form': form})
+
+    output = tempfile.TemporaryFile()
+    base_url = request.build_absolute_uri('/')
+    if form.cleaned_data['format'] == 'zip':
+        batch_print_service.write_zip(vouchers, base_url, output)
+        content_type, filename = 'application/zip', 'vouchers.zip'
+    else:
+        batch_print_service.write_merged_pdf(vouchers, base_url, output)
+        content_type, filename = 'application/pdf', 'vouchers.pdf'
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=filename, content_type=content_type)
 
 
 '''
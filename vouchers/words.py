@@ -0,0 +1,79 @@
+# vouchers/words.py
+"""
+Amount in words using the Indian numbering system (thousand, lakh, crore).
+
+Produces the same wording as num2words(..., lang='en_IN').title() (which stops
+at 999 crore; past that the count of crores is worded the same way), but builds
+it from a precomputed table of 0-999 and memoizes whole amounts, so saving
+vouchers in bulk does not pay for the conversion again and again.
+"""
+from decimal import Decimal
+from functools import lru_cache
+
+ONES = [
+    'Zero', 'One', 'Two', 'Three', 'Four', 'Five', 'Six', 'Seven', 'Eight', 'Nine',
+    'Ten', 'Eleven', 'Twelve', 'Thirteen', 'Fourteen', 'Fifteen', 'Sixteen',
+    'Seventeen', 'Eighteen', 'Nineteen',
+]
+TENS = ['', '', 'Twenty', 'Thirty', 'Forty', 'Fifty', 'Sixty', 'Seventy', 'Eighty', 'Ninety']
+
+# Indian groups above the last three digits, largest first: (size, name)
+GROUPS = [(10_000_000, 'Crore'), (100_000, 'Lakh'), (1_000, 'Thousand')]
+
+PAISA = Decimal('0.01')
+
+
+def _below_hundred(number):
+    if number < 20:
+        return ONES[number]
+    tens, ones = divmod(number, 10)
+    return f"{TENS[tens]}-{ONES[ones]}" if ones else TENS[tens]
+
+
+def _below_thousand(number):
+    hundreds, rest = divmod(number, 100)
+    if not hundreds:
+        return _below_hundred(rest)
+    words = f"{ONES[hundreds]} Hundred"
+    return f"{words} And {_below_hundred(rest)}" if rest else words
+
+
+# Words for every number from 0 to 999, built once at import time
+SMALL_NUMBERS = tuple(_below_thousand(n) for n in range(1000))
+
+
+@lru_cache(maxsize=8192)
+def number_in_words(number):
+    """Returns a whole, non-negative number in words, e.g. 'One Lakh, Twenty Thousand'"""
+    if number < 1000:
+        return SMALL_NUMBERS[number]
+
+    parts = []
+    for size, name in GROUPS:
+        count, number = divmod(number, size)
+        if count:
+            # Counts above 999 only happen for crores, so recurse for those
+            count_words = SMALL_NUMBERS[count] if count < 1000 else number_in_words(count)
+            parts.append(f"{count_words} {name}")
+    if not number:
+        return ', '.join(parts)
+    # A trailing value below a hundred is joined with 'And' rather than a comma
+    separator = ' And ' if number < 100 else ', '
+    return ', '.join(parts) + separator + SMALL_NUMBERS[number]
+
+
+@lru_cache(maxsize=8192)
+def amount_in_words(amount):
+    """Returns an amount as 'X Rupees and Y Paisas' (or 'X Rupees only'), exact for Decimals"""
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    rupees, paisas = divmod(int(amount.quantize(PAISA) * 100), 100)
+    words = f"{number_in_words(rupees)} Rupees"
+    if paisas > 0:
+        return f"{words} and {number_in_words(paisas)} Paisas"
+    return f"{words} only"
+
+
+def amounts_in_words(amounts):
+    """Batch version of amount_in_words() for imports and backfills, in the same order"""
+    return [amount_in_words(amount) for amount in amounts]